@@ -1,5 +1,6 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Request, Response, request, jsonify, send_file
 from flask_cors import CORS
+import asyncio
 import os
 import uuid
 import logging
@@ -8,11 +9,13 @@ import threading
 import time
 import tempfile
 import json
+import hashlib
 import numpy as np
 from code_pdf.doclayout import OnnxModel
 import re
 import requests
 from pathlib import Path
+from werkzeug.exceptions import RequestEntityTooLarge
 
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO,
@@ -33,35 +36,176 @@ os.makedirs("/tmp/.cache/huggingface", exist_ok=True)
 os.makedirs("/tmp/.cache/code_pdf", exist_ok=True)
 os.makedirs("/tmp/pdf_translate_api", exist_ok=True)
 
-# Khởi tạo mô hình DocLayout
-from code_pdf.doclayout import ModelInstance, OnnxModel
-
 # Đường dẫn đến font Noto Sans Vietnamese mặc định
 NOTO_SANS_VIETNAMESE_URL = "https://github.com/googlefonts/noto-fonts/raw/main/hinted/ttf/NotoSans/NotoSansVietnamese-Regular.ttf"
 
-try:
-    if ModelInstance.value is None:
-        ModelInstance.value = OnnxModel.load_available()
-except Exception as e:
-    logger.warning(f"Unable to load DocLayout model: {str(e)}")
-    logger.warning("The application will still work but document layout analysis may be limited")
-    # Không raise exception ở đây, để server vẫn có thể khởi động
-    # nhưng API sẽ báo lỗi khi được gọi
+def init_app(warmup=True):
+    """
+    Mở bộ nhớ đệm dịch và nạp mô hình DocLayout. Import app.py không còn nạp mô hình,
+    hàm này được gọi một lần trong mỗi tiến trình phục vụ request (python app.py, hoặc
+    post_fork của gunicorn.conf.py), không gọi trước khi fork.
+    """
+    import code_pdf
+    
+    try:
+        code_pdf.init(cache=True, model=True, warmup=warmup)
+    except Exception as e:
+        logger.warning(f"Unable to load DocLayout model: {str(e)}")
+        logger.warning("The application will still work but document layout analysis may be limited")
+        # Không raise exception ở đây, để server vẫn có thể khởi động,
+        # mô hình sẽ được thử nạp lại ở request đầu tiên cần đến nó
 
-# Khởi tạo Flask app
-app = Flask(__name__)
-CORS(app)  # Cho phép CORS để web frontend có thể gọi API
+def get_model():
+    """Mô hình DocLayout dùng chung, nạp ở lần dùng đầu nếu chưa được nạp, lỗi thì trả về None"""
+    from code_pdf.doclayout import ModelInstance
+    
+    try:
+        return ModelInstance.get()
+    except Exception as e:
+        logger.warning(f"Unable to load DocLayout model: {str(e)}")
+        return None
 
 # Thư mục lưu trữ tạm thời
 UPLOAD_FOLDER = os.path.join(tempfile.gettempdir(), "pdf_translate_api")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Giới hạn kích thước file tải lên
+MAX_UPLOAD_MB = 20
+
+class StagedUpload:
+    """
+    File tải lên được ghi thẳng vào UPLOAD_FOLDER theo từng khối trong lúc werkzeug
+    đọc request: vượt giới hạn thì dừng ngay, sha256 được tính dần, không giữ cả file
+    trong bộ nhớ. File bị xóa khi request kết thúc, trừ khi đã được claim() cho một task.
+    """
+    
+    def __init__(self, limit):
+        fd, self.path = tempfile.mkstemp(suffix='.upload', dir=UPLOAD_FOLDER)
+        self.file = os.fdopen(fd, 'w+b')
+        self.limit = limit
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.claimed = False
+    
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            # werkzeug bỏ dở request, file không được gắn vào request.files nên tự xóa ở đây
+            self.close()
+            raise RequestEntityTooLarge(f'Kích thước file vượt quá giới hạn {MAX_UPLOAD_MB}MB')
+        self.sha256.update(data)
+        return self.file.write(data)
+    
+    def claim(self, path):
+        """Chuyển file sang path và giữ lại sau khi request kết thúc"""
+        self.file.flush()
+        os.replace(self.path, path)
+        self.path = path
+        self.claimed = True
+        return path
+    
+    def close(self):
+        self.file.close()
+        if not self.claimed:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+    
+    def __getattr__(self, name):
+        # read, seek, tell... dùng của file thật
+        return getattr(self.file, name)
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return StagedUpload(MAX_UPLOAD_MB * 1024 * 1024)
+
+# Khởi tạo Flask app
+app = Flask(__name__)
+app.request_class = UploadRequest
+# Từ chối ngay theo Content-Length, chừa chỗ cho các trường form khác
+app.config['MAX_CONTENT_LENGTH'] = (MAX_UPLOAD_MB + 1) * 1024 * 1024
+CORS(app)  # Cho phép CORS để web frontend có thể gọi API
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({'error': f'Kích thước file vượt quá giới hạn {MAX_UPLOAD_MB}MB'}), 413
+
 # Thư mục font
 FONT_FOLDER = os.path.join(os.environ.get("XDG_CACHE_HOME", "/tmp/.cache"), "babeldoc", "fonts")
 os.makedirs(FONT_FOLDER, exist_ok=True)
 
 # Lưu trữ status của các task
 tasks = {}
+# Sự kiện huỷ của từng task đang chạy, luồng dịch kiểm tra giữa các trang và các yêu cầu dịch
+cancel_events = {}
+# Trạng thái kết thúc, stream sự kiện của task đóng lại sau khi gửi trạng thái này
+FINAL_STATUSES = ('completed', 'failed', 'cancelled', 'deleted')
+# Mỗi client theo dõi /events (SSE hoặc long-poll) giữ một luồng của worker gthread
+# suốt thời gian kết nối: stream tự đóng sau EVENTS_STREAM_SECONDS giây (client kết nối
+# lại với Last-Event-ID) và mỗi worker chỉ nhận tối đa MAX_WATCHERS client cùng lúc,
+# chừa các luồng còn lại cho upload, /status và tải kết quả
+EVENTS_STREAM_SECONDS = 60
+MAX_WATCHERS = max(1, int(os.environ.get("GUNICORN_THREADS", 8)) // 2)
+watchers = threading.BoundedSemaphore(MAX_WATCHERS)
+
+class TaskEvents:
+    """
+    Tiến độ của một task: luồng dịch cập nhật, các client theo dõi chờ trên một
+    condition variable và chỉ thức dậy khi có thay đổi, không phải polling liên tục.
+    cond cũng là khoá cho các lần đổi trạng thái của task (hoàn tất, lỗi, huỷ).
+    """
+    
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.version = 0
+        self.started = None  # thời điểm bắt đầu dịch các trang, để ước lượng ETA
+        self.state = {
+            'status': 'processing',
+            'stage': 'queued',
+            'progress': 0,
+            'page': None,
+            'pages_done': 0,
+            'pages_total': None,
+            'paragraphs_done': 0,
+            'paragraphs_failed': 0,
+            'elapsed': 0,
+            'eta': None
+        }
+        self.created = time.time()
+    
+    def update(self, **fields):
+        with self.cond:
+            state = self.state
+            state.update(fields)
+            now = time.time()
+            if state['stage'] == 'translating' and self.started is None:
+                self.started = now
+            state['elapsed'] = round(now - self.created, 1)
+            if state['status'] == 'completed':
+                state['progress'], state['eta'] = 100, 0
+            elif state['pages_total']:
+                done = state['pages_done'] / state['pages_total']
+                state['progress'] = min(int(done * 100), 99)
+                if self.started is not None and done > 0:
+                    state['eta'] = round((now - self.started) * (1 - done) / done, 1)
+            self.version += 1
+            self.cond.notify_all()
+    
+    def wait(self, version, timeout):
+        """Chờ tới khi có phiên bản mới hơn version (hoặc hết timeout), trả về (phiên bản, trạng thái)"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.version > version, timeout)
+            return self.version, dict(self.state)
+
+def drop_task(task_id):
+    """Xóa task và báo cho các client đang theo dõi sự kiện"""
+    task = tasks.pop(task_id, None)
+    if task is not None and 'events' in task:
+        task['events'].update(status='deleted', stage='deleted')
+    if task is not None and task.get('partial') is not None:
+        task['partial'].close()  # xoá file tạm của các trang đã dịch
+    return task
 
 @app.route('/', methods=['GET'])
 def index():
@@ -75,13 +219,18 @@ def index():
         'endpoints': {
             '/translate': 'POST - Dịch file PDF',
             '/translate/{task_id}/status': 'GET - Kiểm tra trạng thái',
+            '/translate/{task_id}/events': 'GET - Theo dõi tiến độ (SSE, hoặc long-poll với ?wait=)',
             '/translate/{task_id}/download': 'GET - Tải xuống kết quả',
+            '/translate/{task_id}/pages/{n}': 'GET - Tải trang n (hoặc n trang đầu với ?first=true) ngay khi dịch xong',
             '/services': 'GET - Danh sách dịch vụ dịch',
             '/languages': 'GET - Danh sách ngôn ngữ hỗ trợ',
             '/fonts': 'GET - Danh sách font chữ hỗ trợ',
-            '/cleanup-task/{task_id}': 'DELETE - Xóa task',
+            '/translate/{task_id}/cancel': 'POST - Huỷ task đang dịch',
+            '/cleanup-task/{task_id}': 'DELETE - Huỷ (nếu đang chạy) và xóa task',
             '/health': 'GET - Kiểm tra sức khỏe API',
-            '/extract-text': 'POST - Trích xuất các đoạn văn bản với bounding boxes'
+            '/warmup': 'POST - Nạp và chạy thử mô hình DocLayout',
+            '/metrics': 'GET - Hạn mức, giới hạn tốc độ và thống kê chuỗi dịch vụ dịch',
+            '/extract-text': 'POST - Trích xuất các đoạn văn bản với bounding boxes (engine=pdfminer|mupdf, stream=true cho NDJSON)'
         }
     })
 
@@ -248,8 +397,12 @@ def translate_pdf():
     - Các tham số tùy chọn:
         - source_lang: Ngôn ngữ nguồn (mặc định: 'en')
         - target_lang: Ngôn ngữ đích (mặc định: 'vi')
-        - service: Dịch vụ dịch (mặc định: 'google')
+        - service: Dịch vụ dịch (mặc định: 'google'), có thể là chuỗi dịch vụ:
+          'deepl>google' (lỗi/chậm thì chuyển dịch vụ sau), 'openai|deepseek' (gửi song song có trễ)
         - threads: Số luồng (mặc định: 4)
+        - processes: Số tiến trình xử lý trang song song (mặc định: 1, không chia)
+        - max_retries: Số lần gửi tối đa cho mỗi đoạn (mặc định: 5), hết lượt thì giữ nguyên bản gốc
+        - timeout: Thời hạn của cả task tính bằng giây (mặc định: 0, không giới hạn)
         - prompt_translation: Prompt để hướng dẫn phong cách dịch (tùy chọn)
         - font_name: Tên font chữ cho văn bản đã dịch (tùy chọn)
         - font_size_factor: Hệ số điều chỉnh cỡ chữ (mặc định: 1.0)
@@ -259,9 +412,8 @@ def translate_pdf():
     - JSON với task_id để theo dõi tiến trình
     """
     try:
-        # Kiểm tra mô hình đã được tải chưa
-        from code_pdf.doclayout import ModelInstance
-        if ModelInstance.value is None:
+        # Kiểm tra mô hình đã được tải chưa (nạp ở lần dùng đầu)
+        if get_model() is None:
             return jsonify({
                 'error': 'Mô hình DocLayout chưa được tải. Vui lòng thử lại sau.'
             }), 500
@@ -306,26 +458,40 @@ def translate_pdf():
             threads = int(request.form.get('threads', 4))
             if threads < 1:
                 threads = 1
-            elif threads > 8:  # Giới hạn số luồng tối đa
-                threads = 8
+            elif threads > 32:  # Số yêu cầu dịch đồng thời mỗi trang, chạy trên event loop chung nên không tốn luồng
+                threads = 32
         except ValueError:
             threads = 4
         
+        try:
+            processes = int(request.form.get('processes', 1))
+            processes = max(1, min(processes, os.cpu_count() or 1))
+        except ValueError:
+            processes = 1
+        
+        try:
+            max_retries = max(1, min(int(request.form.get('max_retries', 5)), 20))
+        except ValueError:
+            max_retries = 5
+        
+        try:
+            timeout = max(0.0, float(request.form.get('timeout', 0)))
+        except ValueError:
+            timeout = 0.0
+        
         # Kiểm tra loại file
         if not file.filename.lower().endswith('.pdf'):
             return jsonify({'error': 'Chỉ hỗ trợ file PDF'}), 400
         
-        # Đọc file
-        file_data = file.read()
-        
-        # Kiểm tra kích thước file (giới hạn 20MB)
-        file_size_mb = len(file_data) / (1024 * 1024)
-        if file_size_mb > 20:
-            return jsonify({'error': 'Kích thước file vượt quá giới hạn 20MB'}), 400
-        
         # Tạo task ID
         task_id = str(uuid.uuid4())
         
+        # File đã được ghi vào UPLOAD_FOLDER trong lúc tải lên (giới hạn MAX_UPLOAD_MB),
+        # task chỉ giữ đường dẫn, nội dung được đọc khi bắt đầu dịch
+        upload = file.stream
+        input_path = upload.claim(os.path.join(UPLOAD_FOLDER, f"{task_id}.pdf"))
+        file_size_mb = upload.size / (1024 * 1024)
+        
         # Lưu thông tin task
         tasks[task_id] = {
             'status': 'processing',
@@ -342,15 +508,20 @@ def translate_pdf():
             'use_font_substitution': use_font_substitution,
             'use_line_height_adjustment': use_line_height_adjustment,
             'file_size': file_size_mb,
-            'created_at': time.time()
+            'sha256': upload.sha256.hexdigest(),
+            'created_at': time.time(),
+            'events': TaskEvents()
         }
         
+        cancel_events[task_id] = threading.Event()
+        
         # Chạy task xử lý file trong background
         thread = threading.Thread(
             target=process_task, 
-            args=(task_id, file_data, source_lang, target_lang, service, threads, 
+            args=(task_id, input_path, source_lang, target_lang, service, threads, 
                   prompt_translation, font_name, font_size_factor, letter_spacing,
-                  use_accent_positioning, use_font_substitution, use_line_height_adjustment)
+                  use_accent_positioning, use_font_substitution, use_line_height_adjustment,
+                  processes, max_retries, timeout)
         )
         thread.daemon = True
         thread.start()
@@ -358,9 +529,12 @@ def translate_pdf():
         return jsonify({
             'task_id': task_id,
             'status': 'processing',
+            'sha256': tasks[task_id]['sha256'],
             'message': 'Đã bắt đầu xử lý file PDF'
         })
         
+    except RequestEntityTooLarge as e:
+        return upload_too_large(e)
     except Exception as e:
         logger.exception("Lỗi khi xử lý yêu cầu dịch")
         return jsonify({'error': str(e)}), 500
@@ -431,25 +605,33 @@ def check_vietnamese_support(font_path):
         logger.exception(f"Lỗi khi kiểm tra font hỗ trợ tiếng Việt: {str(e)}")
         return False
 
-def process_task(task_id, file_data, source_lang, target_lang, service, threads, 
+def process_task(task_id, input_path, source_lang, target_lang, service, threads, 
                 prompt_translation="", font_name="", font_size_factor=1.0, letter_spacing=0.02,
-                use_accent_positioning=True, use_font_substitution=True, use_line_height_adjustment=True):
+                use_accent_positioning=True, use_font_substitution=True, use_line_height_adjustment=True,
+                processes=1, max_retries=5, timeout=0):
     """Xử lý task dịch trong background"""
+    partial = None
     try:
         # Import tại đây để tránh circular import
-        from code_pdf.high_level import translate_stream
-        from code_pdf.doclayout import ModelInstance
+        from code_pdf.converter import RetryPolicy
+        from code_pdf.high_level import PartialResult, translate_stream
         from string import Template
         import os
         
+        events = tasks[task_id]['events'] if task_id in tasks else TaskEvents()
+        
         # Kiểm tra mô hình đã được tải chưa
-        if ModelInstance.value is None:
-            if task_id in tasks:
-                tasks[task_id].update({
-                    'status': 'failed',
-                    'error': 'Mô hình DocLayout chưa được tải',
-                    'message': 'Lỗi khởi tạo mô hình DocLayout'
-                })
+        events.update(stage='loading_model')
+        model = get_model()
+        if model is None:
+            with events.cond:
+                if task_id in tasks:
+                    tasks[task_id].update({
+                        'status': 'failed',
+                        'error': 'Mô hình DocLayout chưa được tải',
+                        'message': 'Lỗi khởi tạo mô hình DocLayout'
+                    })
+                events.update(status='failed', stage='failed', error='Mô hình DocLayout chưa được tải')
             return
         
         # Cập nhật task progress callback
@@ -565,32 +747,63 @@ def process_task(task_id, file_data, source_lang, target_lang, service, threads,
         # Log thông tin font và cỡ chữ
         logger.info(f"Sử dụng font '{font_name}' với hệ số cỡ chữ {font_size_factor}")
                 
-        # Thực hiện dịch
+        # Thực hiện dịch, đoạn nào hết lượt thử hoặc quá hạn thì giữ nguyên bản gốc
+        report = {}
+        partial = PartialResult()
+        if task_id in tasks:
+            tasks[task_id]['partial'] = partial
+        cancel_event = cancel_events.get(task_id)
+        if cancel_event is None or cancel_event.is_set():  # bị huỷ trước khi bắt đầu
+            raise asyncio.CancelledError("task cancelled")
+        # Truyền đường dẫn để file được đọc dần khi cần, không nạp cả file vào bộ nhớ
         mono_data, dual_data = translate_stream(
-            stream=file_data,
+            stream=input_path,
             lang_in=source_lang,
             lang_out=target_lang,
             service=service,
             thread=threads,
+            processes=processes,
             callback=progress_callback,
-            model=ModelInstance.value,
+            model=model,
             prompt=prompt_template,
             font_name=font_name,
             font_size_factor=font_size_factor,
+            retry_policy=RetryPolicy(attempts=max_retries),
+            timeout=timeout,
+            report=report,
+            cancellation_event=cancel_event,
+            on_progress=events.update,
+            partial=partial,
             **vi_font_config  # Thêm cấu hình font cho tiếng Việt
         )
         
         # Kiểm tra task còn tồn tại không
         if task_id in tasks:
-            # Lưu kết quả vào task
-            tasks[task_id].update({
-                'status': 'completed',
-                'progress': 100,
-                'mono_data': mono_data,
-                'dual_data': dual_data,
-                'message': 'Dịch thành công',
-                'completed_at': time.time()
-            })
+            with events.cond:  # cùng khoá với cancel_task
+                # Lưu kết quả vào task
+                tasks[task_id].update({
+                    'status': 'completed',
+                    'progress': 100,
+                    'mono_data': mono_data,
+                    'dual_data': dual_data,
+                    'message': 'Dịch thành công',
+                    'paragraphs': report.get('paragraphs', 0),
+                    'failed_paragraphs': report.get('failed', 0),
+                    'errors': report.get('errors', []),
+                    'completed_at': time.time(),
+                    'partial': None  # đã có kết quả đầy đủ
+                })
+                if report.get('failed'):
+                    tasks[task_id]['message'] = (
+                        f"Dịch xong, {report['failed']}/{report['paragraphs']} đoạn giữ nguyên bản gốc do lỗi dịch vụ"
+                    )
+                events.update(
+                    status='completed',
+                    stage='completed',
+                    message=tasks[task_id]['message'],
+                    paragraphs_done=report.get('paragraphs', 0),
+                    paragraphs_failed=report.get('failed', 0)
+                )
             
             logger.info(f"Task {task_id} đã hoàn tất")
             
@@ -599,20 +812,43 @@ def process_task(task_id, file_data, source_lang, target_lang, service, threads,
             cleanup_timer.daemon = True
             cleanup_timer.start()
         
+    except asyncio.CancelledError:
+        logger.info(f"Task {task_id} đã bị huỷ")
+        if task_id in tasks:
+            task = tasks[task_id]
+            with task['events'].cond:
+                task.update({
+                    'status': 'cancelled',
+                    'message': 'Task đã bị huỷ'
+                })
+                task['events'].update(status='cancelled', stage='cancelled')
     except Exception as e:
         logger.exception(f"Lỗi xử lý task {task_id}")
         if task_id in tasks:
-            tasks[task_id].update({
-                'status': 'failed',
-                'error': str(e),
-                'message': 'Dịch thất bại: ' + str(e)
-            })
+            task = tasks[task_id]
+            with task['events'].cond:
+                task.update({
+                    'status': 'failed',
+                    'error': str(e),
+                    'message': 'Dịch thất bại: ' + str(e)
+                })
+                task['events'].update(status='failed', stage='failed', error=str(e))
+    finally:
+        cancel_events.pop(task_id, None)
+        # Đã có kết quả đầy đủ hoặc task đã bị xoá: file tạm của partial không còn cần.
+        # Task lỗi hoặc bị huỷ giữ partial để tải các trang đã dịch, xoá cùng task.
+        if partial is not None and tasks.get(task_id, {}).get('partial') is not partial:
+            partial.close()
+        try:
+            os.remove(input_path)
+        except FileNotFoundError:
+            pass
 
 def cleanup_task_internal(task_id):
     """Xóa task nội bộ sau thời gian chờ"""
     if task_id in tasks:
         logger.info(f"Tự động xóa task {task_id}")
-        del tasks[task_id]
+        drop_task(task_id)
 
 @app.route('/translate/<task_id>/status', methods=['GET'])
 def get_task_status(task_id):
@@ -653,9 +889,87 @@ def get_task_status(task_id):
         
     if task['status'] == 'failed' and 'error' in task:
         response['error'] = task['error']
+    
+    if task.get('failed_paragraphs'):
+        response['failed_paragraphs'] = task['failed_paragraphs']
+        response['paragraphs'] = task['paragraphs']
+        response['errors'] = task['errors']
         
     return jsonify(response)
 
+@app.route('/translate/<task_id>/events', methods=['GET'])
+def task_events(task_id):
+    """
+    Theo dõi tiến độ của task qua Server-Sent Events, thay cho việc gọi /status liên tục
+    
+    Mỗi sự kiện 'progress' chứa status, stage (queued, loading_model, preparing,
+    translating, writing, completed...), page, pages_done/pages_total,
+    paragraphs_done/paragraphs_failed, progress (%), elapsed và eta (giây).
+    Stream kết thúc sau trạng thái completed, failed, cancelled hoặc deleted.
+    
+    Query parameters:
+    - since: phiên bản đã nhận (mặc định lấy từ header Last-Event-ID khi kết nối lại)
+    - wait: long-poll, trả về một JSON ngay khi có phiên bản mới hơn since hoặc sau
+      wait giây (tối đa 30); không giữ kết nối giữa các lần gọi
+    
+    Mỗi kết nối giữ một luồng của worker: stream SSE tự đóng sau EVENTS_STREAM_SECONDS
+    giây (EventSource tự kết nối lại với Last-Event-ID, không mất sự kiện) và khi đã có
+    MAX_WATCHERS client theo dõi, request mới nhận 503 kèm Retry-After, dùng /status.
+    """
+    task = tasks.get(task_id)
+    if task is None:
+        return jsonify({'error': 'Không tìm thấy task'}), 404
+    events = task['events']
+    
+    try:
+        since = int(request.args.get('since', request.headers.get('Last-Event-ID', -1)))
+    except ValueError:
+        since = -1
+    
+    if not watchers.acquire(blocking=False):
+        response = jsonify({'error': 'Quá nhiều client đang theo dõi, hãy dùng /status'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    if 'wait' in request.args:
+        try:
+            try:
+                wait = max(0.0, min(float(request.args['wait']), 30.0))
+            except ValueError:
+                wait = 30.0
+            version, state = events.wait(since, wait)
+        finally:
+            watchers.release()
+        return jsonify({'version': version, **state})
+    
+    def generate():
+        version = since
+        deadline = time.monotonic() + EVENTS_STREAM_SECONDS
+        yield 'retry: 1000\n\n'  # thời gian chờ trước khi EventSource kết nối lại
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return  # trả luồng cho worker, client kết nối lại với Last-Event-ID
+            new_version, state = events.wait(version, min(15, remaining))
+            if new_version == version:
+                yield ': keep-alive\n\n'  # giữ kết nối qua proxy khi chưa có thay đổi
+                continue
+            version = new_version
+            yield f"id: {version}\nevent: progress\ndata: {json.dumps(state)}\n\n"
+            if state['status'] in FINAL_STATUSES:
+                return
+            # Gộp các cập nhật dồn dập (mỗi đoạn dịch xong) thành tối đa 10 sự kiện mỗi giây
+            time.sleep(0.1)
+    
+    response = Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Trả chỗ khi kết nối đóng, kể cả khi client ngắt trước lúc stream bắt đầu
+    response.call_on_close(watchers.release)
+    return response
+
 @app.route('/translate/<task_id>/download', methods=['GET'])
 def download_result(task_id):
     """
@@ -698,6 +1012,65 @@ def download_result(task_id):
         logger.exception(f"Lỗi khi tải xuống file cho task {task_id}")
         return jsonify({'error': f'Lỗi khi tải xuống file: {str(e)}'}), 500
 
+@app.route('/translate/<task_id>/pages/<int:page>', methods=['GET'])
+def download_pages(task_id, page):
+    """
+    Tải trang đã dịch xong mà không cần chờ cả tài liệu
+    
+    Query parameters:
+    - type: 'mono' hoặc 'dual' (trang gốc rồi trang dịch, mặc định)
+    - first: 'true' để lấy các trang 1..page trong một file PDF
+    
+    Response:
+    - File PDF, 409 kèm danh sách trang đã xong nếu trang chưa dịch xong
+    """
+    task = tasks.get(task_id)
+    if task is None:
+        return jsonify({'error': 'Không tìm thấy task'}), 404
+    if page < 1:
+        return jsonify({'error': 'Số trang không hợp lệ'}), 404
+    
+    dual = request.args.get('type', 'dual') != 'mono'
+    first = request.args.get('first', 'false').lower() == 'true'
+    pagenos = list(range(page)) if first else [page - 1]
+    name = os.path.splitext(task['filename'])[0]
+    suffix = f"p1-{page}" if first else f"p{page}"
+    filename = f"{name}_{suffix}_en_vi.pdf" if dual else f"{name}_{suffix}_vi.pdf"
+    
+    try:
+        if task['status'] == 'completed':
+            from pymupdf import Document
+            
+            doc = Document(stream=task['dual_data'] if dual else task['mono_data'])
+            if page > (doc.page_count // 2 if dual else doc.page_count):
+                return jsonify({'error': 'Số trang không hợp lệ'}), 404
+            if dual:
+                pagenos = [i for p in pagenos for i in (p * 2, p * 2 + 1)]
+            doc.select(pagenos)
+            pdf_data = doc.write(deflate=True, garbage=3, use_objstms=1)
+        else:
+            partial = task.get('partial')
+            ready = partial.ready() if partial is not None else []
+            if partial is not None and partial.page_count and not 1 <= page <= partial.page_count:
+                return jsonify({'error': 'Số trang không hợp lệ'}), 404
+            if partial is None or not set(pagenos) <= set(ready):
+                return jsonify({
+                    'error': 'Trang chưa dịch xong',
+                    'status': task['status'],
+                    'ready_pages': [p + 1 for p in ready]
+                }), 409
+            pdf_data = partial.render(pagenos, dual=dual)
+        
+        return send_file(
+            io.BytesIO(pdf_data),
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=filename
+        )
+    except Exception as e:
+        logger.exception(f"Lỗi khi tải trang {page} của task {task_id}")
+        return jsonify({'error': f'Lỗi khi tải trang: {str(e)}'}), 500
+
 @app.route('/services', methods=['GET'])
 def get_available_services():
     """
@@ -752,16 +1125,50 @@ def get_available_languages():
     }
     return jsonify(languages)
 
+@app.route('/translate/<task_id>/cancel', methods=['POST'])
+def cancel_task(task_id):
+    """
+    Huỷ task đang dịch: các yêu cầu dịch đang chạy và các đoạn đang chờ bị huỷ,
+    việc nhận dạng bố cục dừng ở trang kế tiếp
+    
+    Response:
+    - JSON với trạng thái task (202 nếu đang huỷ)
+    """
+    task = tasks.get(task_id)
+    if task is None:
+        return jsonify({'error': 'Không tìm thấy task'}), 404
+    
+    # process_task ghi trạng thái cuối dưới cùng khoá, task không thể kết thúc giữa
+    # lúc kiểm tra và lúc ghi 'cancelling' (ghi đè mất 'completed')
+    with task['events'].cond:
+        event = cancel_events.get(task_id)
+        if event is None or task['status'] in FINAL_STATUSES:  # task đã kết thúc
+            return jsonify({
+                'error': 'Task không còn chạy',
+                'status': task['status']
+            }), 409
+        
+        event.set()
+        task.update({
+            'status': 'cancelling',
+            'message': 'Đang huỷ task'
+        })
+        task['events'].update(status='cancelling')
+    return jsonify({'status': 'cancelling', 'message': 'Đang huỷ task'}), 202
+
 @app.route('/cleanup-task/<task_id>', methods=['DELETE'])
 def cleanup_task(task_id):
     """
-    Xóa task và tài nguyên liên quan
+    Xóa task và tài nguyên liên quan, task đang chạy sẽ bị huỷ
     
     Response:
     - JSON với kết quả xóa
     """
     if task_id in tasks:
-        del tasks[task_id]
+        event = cancel_events.get(task_id)
+        if event is not None:
+            event.set()
+        drop_task(task_id)
         return jsonify({'status': 'success', 'message': 'Đã xóa task thành công'})
     else:
         return jsonify({'error': 'Không tìm thấy task'}), 404
@@ -786,6 +1193,46 @@ def health_check():
         'model_status': model_status
     })
 
+@app.route('/warmup', methods=['POST'])
+def warmup():
+    """
+    Nạp mô hình DocLayout (nếu chưa nạp) và chạy thử một trang trắng,
+    để request dịch đầu tiên không phải chờ
+    
+    Response:
+    - JSON với trạng thái mô hình và thời gian khởi động
+    """
+    from code_pdf.doclayout import ModelInstance
+    
+    start = time.time()
+    try:
+        ModelInstance.warmup()
+    except Exception as e:
+        logger.exception("Lỗi khi khởi động mô hình DocLayout")
+        return jsonify({'model_status': 'not_loaded', 'error': str(e)}), 500
+    return jsonify({
+        'model_status': 'loaded',
+        'seconds': round(time.time() - start, 3)
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Trạng thái bộ giới hạn tốc độ của từng dịch vụ dịch (dùng chung cho mọi task)
+    
+    Response:
+    - JSON với hạn mức hiện tại, số yêu cầu đang chạy, số lần bị giới hạn và thử lại,
+      cùng độ trễ và số lần lỗi theo dịch vụ của các chuỗi dịch vụ (ví dụ 'deepl>google')
+    """
+    from code_pdf import ratelimit
+    from code_pdf.translator import chain_metrics
+    
+    return jsonify({
+        'active_tasks': len(tasks),
+        'rate_limits': ratelimit.metrics(),
+        'chains': chain_metrics()
+    })
+
 @app.route('/extract-text', methods=['POST'])
 def extract_text_chunks():
     """
@@ -793,9 +1240,18 @@ def extract_text_chunks():
     
     Request:
     - Form-data với 'file': File PDF cần trích xuất
+    - engine: 'pdfminer' (mặc định, phân tích bố cục dòng) hoặc 'mupdf' (chỉ dùng
+      PyMuPDF, nhanh hơn nhiều, phù hợp khi cần trích xuất số lượng lớn)
+    - workers: số tiến trình trích xuất song song theo trang cho tài liệu dài (mặc định 1)
+    - stream=true (hoặc header Accept: application/x-ndjson): trả về NDJSON
     
     Response:
-    - JSON với danh sách các đoạn văn bản và bounding boxes
+    - JSON với danh sách các đoạn văn bản và bounding boxes, cùng định dạng cho cả hai engine.
+      Không cần mô hình DocLayout.
+    - 413 nếu file vượt quá MAX_UPLOAD_MB
+    - Với stream: mỗi dòng là JSON của một trang ({'page_number', 'width', 'height', 'chunks'}),
+      gửi ngay khi trang được trích xuất xong; lỗi giữa chừng là một dòng {'error': ...}.
+      Không áp dụng phương án dự phòng văn bản thô khi cả tài liệu không có chunk nào.
     """
     try:
         # Kiểm tra file có được gửi không
@@ -810,76 +1266,49 @@ def extract_text_chunks():
         if not file.filename.lower().endswith('.pdf'):
             return jsonify({'error': 'Chỉ hỗ trợ file PDF'}), 400
         
-        # Đọc file
-        file_data = file.read()
+        from code_pdf.extract import ENGINES, MAX_WORKERS, extract_text
         
-        # Kiểm tra kích thước file (giới hạn 20MB)
-        file_size_mb = len(file_data) / (1024 * 1024)
-        if file_size_mb > 20:
-            return jsonify({'error': 'Kích thước file vượt quá giới hạn 20MB'}), 400
+        engine = request.form.get('engine', request.args.get('engine', 'pdfminer')).lower()
+        if engine not in ENGINES:
+            return jsonify({'error': f'engine phải là một trong: {", ".join(ENGINES)}'}), 400
         
-        # Trích xuất văn bản và bounding boxes
-        from code_pdf.doclayout import ModelInstance
-        if ModelInstance.value is None:
-            return jsonify({
-                'error': 'Mô hình DocLayout chưa được tải. Vui lòng thử lại sau.'
-            }), 500
+        try:
+            workers = int(request.form.get('workers', request.args.get('workers', 1)))
+            workers = max(1, min(workers, MAX_WORKERS))
+        except ValueError:
+            workers = 1
+        
+        # Đọc file (file quá MAX_UPLOAD_MB đã bị từ chối với 413 trong lúc tải lên)
+        file_data = file.read()
+        
+        stream = (
+            request.form.get('stream', request.args.get('stream', 'false')).lower() == 'true'
+            or request.accept_mimetypes.best == 'application/x-ndjson'
+        )
+        if stream:
+            return Response(
+                stream_text_pages(file_data, engine, workers),
+                mimetype='application/x-ndjson'
+            )
         
         try:
-            # Đảm bảo các thư viện phụ thuộc được import
-            try:
-                import pymupdf
-            except ImportError:
-                # Nếu pymupdf chưa được cài đặt, thử cài đặt
-                logger.warning("Thư viện pymupdf chưa được cài đặt, đang thử cài đặt...")
-                import subprocess
-                subprocess.check_call([sys.executable, "-m", "pip", "install", "pymupdf"])
-                import pymupdf
-            
-            try:
-                from pdfminer.pdfparser import PDFParser
-                from pdfminer.pdfdocument import PDFDocument
-                from pdfminer.pdfpage import PDFPage
-                from pdfminer.pdfinterp import PDFResourceManager
-                from pdfminer.pdfinterp import PDFPageInterpreter
-                from pdfminer.layout import LAParams
-                from pdfminer.converter import PDFPageAggregator
-            except ImportError:
-                # Nếu pdfminer chưa được cài đặt, thử cài đặt
-                logger.warning("Thư viện pdfminer chưa được cài đặt, đang thử cài đặt...")
-                import subprocess
-                subprocess.check_call([sys.executable, "-m", "pip", "install", "pdfminer.six"])
-                from pdfminer.pdfparser import PDFParser
-                from pdfminer.pdfdocument import PDFDocument
-                from pdfminer.pdfpage import PDFPage
-                from pdfminer.pdfinterp import PDFResourceManager
-                from pdfminer.pdfinterp import PDFPageInterpreter
-                from pdfminer.layout import LAParams
-                from pdfminer.converter import PDFPageAggregator
-            
-            # Gọi phương thức extract_text_chunks để trích xuất text
-            text_chunks = ModelInstance.value.extract_text_chunks(file_data)
+            # Trích xuất văn bản và bounding boxes
+            text_chunks = extract_text(file_data, engine=engine, workers=workers)
             
             # Kiểm tra kết quả trả về
-            if not text_chunks or not text_chunks.get('pages'):
-                logger.warning("extract_text_chunks trả về kết quả rỗng hoặc không hợp lệ")
-                
-                # Tạo cấu trúc mặc định nếu kết quả rỗng
-                if not text_chunks:
-                    text_chunks = {'pages': []}
+            if not text_chunks.get('pages'):
+                logger.warning("extract_text trả về kết quả rỗng hoặc không hợp lệ")
                 
-                # Thêm thông tin trang nếu không có
-                if len(text_chunks['pages']) == 0:
-                    # Sử dụng pymupdf để lấy thông tin trang
-                    from pymupdf import Document
-                    doc = Document(stream=file_data)
-                    for page_idx, page in enumerate(doc):
-                        text_chunks['pages'].append({
-                            'page_number': page_idx + 1,
-                            'width': page.rect.width,
-                            'height': page.rect.height,
-                            'chunks': []
-                        })
+                # Sử dụng pymupdf để lấy thông tin trang
+                from pymupdf import Document
+                doc = Document(stream=file_data)
+                for page_idx, page in enumerate(doc):
+                    text_chunks['pages'].append({
+                        'page_number': page_idx + 1,
+                        'width': page.rect.width,
+                        'height': page.rect.height,
+                        'chunks': []
+                    })
             
             return jsonify(text_chunks)
         except Exception as e:
@@ -889,10 +1318,30 @@ def extract_text_chunks():
                 'details': str(e.__class__.__name__)
             }), 500
         
+    except RequestEntityTooLarge as e:
+        return upload_too_large(e)
     except Exception as e:
         logger.exception("Lỗi khi xử lý yêu cầu trích xuất văn bản")
         return jsonify({'error': str(e)}), 500
 
+def stream_text_pages(file_data, engine, workers):
+    """Sinh từng dòng NDJSON theo trang, client ngắt kết nối thì dừng trích xuất"""
+    from code_pdf.extract import iter_pages
+    
+    try:
+        count = 0
+        for page in iter_pages(file_data, engine, workers=workers):
+            count += 1
+            yield json.dumps(page) + '\n'
+        if count == 0:
+            yield json.dumps({'error': 'Không đọc được trang nào từ file PDF'}) + '\n'
+    except Exception as e:
+        logger.exception("Lỗi khi trích xuất văn bản")
+        yield json.dumps({
+            'error': f'Lỗi khi trích xuất văn bản: {str(e)}',
+            'details': str(e.__class__.__name__)
+        }) + '\n'
+
 # Dọn dẹp file tạm định kỳ (chạy trong thread riêng)
 def periodic_cleanup():
     """Dọn dẹp task cũ và file tạm thời"""
@@ -902,7 +1351,18 @@ def periodic_cleanup():
     for task_id in current_tasks:
         if task_id in tasks and tasks[task_id].get('created_at', 0) < time.time() - 86400:
             logger.info(f"Xóa task cũ {task_id}")
-            del tasks[task_id]
+            event = cancel_events.get(task_id)
+            if event is not None:
+                event.set()
+            drop_task(task_id)
+    
+    # Xóa file tải lên bị bỏ lại (ví dụ tiến trình bị dừng giữa chừng)
+    try:
+        for entry in os.scandir(UPLOAD_FOLDER):
+            if entry.is_file() and entry.stat().st_mtime < time.time() - 86400:
+                os.remove(entry.path)
+    except OSError as e:
+        logger.warning(f"Không thể dọn thư mục tải lên: {e}")
     
     # Lên lịch chạy lại sau 1 giờ
     cleanup_timer = threading.Timer(3600, periodic_cleanup)
@@ -917,6 +1377,9 @@ def start_cleanup_thread():
 
 # Khởi tạo khi server bắt đầu
 if __name__ == '__main__':
+    # Nạp bộ nhớ đệm và mô hình trước khi nhận request
+    init_app()
+    
     # Bắt đầu dọn dẹp định kỳ
     start_cleanup_thread()
     
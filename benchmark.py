@@ -0,0 +1,620 @@
+"""
+Các micro-benchmark chạy tay cho pipeline dịch PDF.
+
+Cách dùng:
+    python benchmark.py vflag [EVENTA.pdf]
+    python benchmark.py execute [--sizes 10000 50000 200000]
+    python benchmark.py layout [EVENTA.pdf]
+    python benchmark.py linebreak [--sizes 1000 10000 50000]
+    python benchmark.py bing [--paragraphs 200] [--rotate 50]
+    python benchmark.py importtime [code_pdf code_pdf.translator]
+    python benchmark.py preload [--workers 4] [--model doclayout.onnx]
+    python benchmark.py config [--jobs 20000]
+    python benchmark.py extract [--pages 300] [--pdf EVENTA.pdf]
+"""
+
+import argparse
+import io
+import re
+import time
+import unicodedata
+
+from pdfminer.converter import PDFPageAggregator
+from pdfminer.layout import LTChar, LTFigure
+from pdfminer.pdfdevice import PDFDevice
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+
+
+def collect_chars(pdf_path):
+    """Lấy danh sách (fontname, text) của mọi ký tự trong tài liệu"""
+    rsrcmgr = PDFResourceManager()
+    device = PDFPageAggregator(rsrcmgr, laparams=None)
+    interpreter = PDFPageInterpreter(rsrcmgr, device)
+    chars = []
+
+    def walk(items):
+        for item in items:
+            if isinstance(item, LTChar):
+                chars.append((item.fontname, item.get_text()))
+            elif isinstance(item, LTFigure):
+                walk(item)
+
+    with open(pdf_path, "rb") as f:
+        for page in PDFPage.get_pages(f):
+            interpreter.process_page(page)
+            walk(device.get_result())
+    return chars
+
+
+def legacy_vflag(font, char, vfont=None, vchar=None):
+    """Bản cũ của vflag trong receive_layout, giữ lại để so sánh"""
+    if isinstance(font, bytes):
+        try:
+            font = font.decode("utf-8")
+        except UnicodeDecodeError:
+            font = ""
+    font = font.split("+")[-1]
+    if re.match(r"\(cid:", char):
+        return True
+    if vfont:
+        if re.match(vfont, font):
+            return True
+    else:
+        if re.match(
+            r"(CM[^R]|MS.M|XY|MT|BL|RM|EU|LA|RS|LINE|LCIRCLE|TeX-|rsfs|txsy|wasy|stmary|.*Mono|.*Code|.*Ital|.*Sym|.*Math)",
+            font,
+        ):
+            return True
+    if vchar:
+        if re.match(vchar, char):
+            return True
+    else:
+        if (
+            char
+            and char != " "
+            and (
+                unicodedata.category(char[0])
+                in ["Lm", "Mn", "Sk", "Sm", "Zl", "Zp", "Zs"]
+                or ord(char[0]) in range(0x370, 0x400)
+            )
+        ):
+            return True
+    return False
+
+
+def timed(label, func, chars, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = [func(font, char) for font, char in chars]
+    elapsed = time.perf_counter() - start
+    print(f"{label:>10}: {len(chars) * rounds / elapsed:,.0f} ký tự/giây")
+    return result
+
+
+def bench_vflag(args):
+    from code_pdf.converter import FormulaClassifier
+
+    chars = collect_chars(args.pdf)
+    print(f"{len(chars)} ký tự từ {args.pdf}, {args.rounds} vòng")
+    before = timed("trước", legacy_vflag, chars, args.rounds)
+    after = timed("sau", FormulaClassifier(), chars, args.rounds)
+    assert before == after, "Kết quả phân loại không khớp"
+
+
+def make_figure_pdf(segments):
+    """Tạo PDF một trang chỉ gồm hình vector với số đoạn thẳng cho trước"""
+    from pymupdf import Document
+
+    doc = Document()
+    page = doc.new_page()
+    page.draw_line((0, 0), (1, 1))
+    ops = b"".join(
+        b"%d.5 %d.25 m %d.5 %d.75 l S\n" % (i % 500, i % 700, i % 400, i % 600)
+        for i in range(segments)
+    )
+    doc.update_stream(page.get_contents()[0], ops)
+    return doc.tobytes()
+
+
+def bench_execute(args):
+    from code_pdf.pdfinterp import PDFPageInterpreterEx
+
+    print(f"{'đoạn':>10} {'toán tử':>10} {'giây':>8} {'µs/toán tử':>12}")
+    for segments in args.sizes:
+        pdf = make_figure_pdf(segments)
+        page = next(PDFPage.get_pages(io.BytesIO(pdf)))
+        rsrcmgr = PDFResourceManager()
+        interpreter = PDFPageInterpreterEx(rsrcmgr, PDFDevice(rsrcmgr), {})
+        start = time.perf_counter()
+        ops = interpreter.render_contents(page.resources, page.contents)
+        elapsed = time.perf_counter() - start
+        count = segments * 3
+        print(f"{segments:>10} {count:>10} {elapsed:>8.3f} {elapsed / count * 1e6:>12.2f}")
+        assert ops.count(" S ") == segments
+
+
+def bench_layout(args):
+    """Đo receive_layout theo trang, bản dịch giả lập bằng chính văn bản gốc"""
+    import tracemalloc
+
+    import numpy as np
+    from pymupdf import Document, Font
+
+    from code_pdf.converter import TranslateConverter
+    from code_pdf.pdfinterp import PDFPageInterpreterEx
+
+    with open(args.pdf, "rb") as f:
+        data = f.read()
+    # Bố cục giả lập: mỗi khối văn bản của pymupdf là một vùng
+    layout = {}
+    for pageno, page in enumerate(Document(stream=data)):
+        h, w = int(page.rect.height), int(page.rect.width)
+        box = np.ones((h, w))
+        for i, b in enumerate(page.get_text("blocks")):
+            x0, y0, x1, y1 = (int(v) for v in b[:4])
+            box[max(h - y1, 0) : max(h - y0, 0), max(x0, 0) : max(x1, 0)] = i + 2
+        layout[pageno] = box
+
+    stats = {"time": 0.0, "peak": 0, "calls": 0}
+
+    def run(trace=False):
+        rsrcmgr = PDFResourceManager()
+        device = TranslateConverter(
+            rsrcmgr,
+            thread=1,
+            layout=layout,
+            lang_in="en",
+            lang_out="vi",
+            service="google",
+            noto_name="noto",
+            noto=Font("helv"),
+        )
+
+        async def identity(s):
+            return s
+
+        device.translator.atranslate = identity
+        receive_layout = device.receive_layout
+
+        def timed_layout(ltpage):  # chỉ đo riêng receive_layout
+            if trace:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            ops = receive_layout(ltpage)
+            stats["time"] += time.perf_counter() - start
+            stats["calls"] += 1
+            if trace:
+                stats["peak"] = max(stats["peak"], tracemalloc.get_traced_memory()[1] - base)
+            return ops
+
+        device.receive_layout = timed_layout
+        interpreter = PDFPageInterpreterEx(rsrcmgr, device, {})
+        for pageno, page in enumerate(PDFPage.get_pages(io.BytesIO(data))):
+            page.pageno = page.page_xref = pageno
+            interpreter.process_page(page)
+
+    run()  # làm nóng bộ nhớ đệm glyph và phân loại
+    stats.update(time=0.0, calls=0)
+    for _ in range(args.rounds):
+        run()
+    per_call = stats["time"] / stats["calls"] * 1000
+    tracemalloc.start()
+    run(trace=True)
+    tracemalloc.stop()
+    print(f"{len(layout)} trang, {args.rounds} vòng")
+    print(f"receive_layout: {per_call:.2f} ms/lần, đỉnh cấp phát {stats['peak'] / 1024:.0f} KiB")
+
+
+def legacy_break_lines(new, glyphs, vlen, varm, font, size, x, x0, x1, brk, height, line_height):
+    """Bản cũ của vòng lặp xếp chữ trong receive_layout, giữ lại để so sánh"""
+    items, cstk, lidx, tx, fcur, fcur_, ptr = [], "", 0, x, font, font, 0
+    while ptr < len(new):
+        vy_regex = re.match(r"\{\s*v([\d\s]+)\}", new[ptr:], re.IGNORECASE)
+        mod = 0
+        if vy_regex:
+            ptr += len(vy_regex.group(0))
+            try:
+                vid = int(vy_regex.group(1).replace(" ", ""))
+                adv = vlen[vid]
+            except Exception:
+                continue
+            mod = varm[vid]
+        else:
+            ch = new[ptr]
+            fcur_, adv, _ = glyphs[ch]
+            adv *= size
+            ptr += 1
+        if fcur_ != fcur or vy_regex or x + adv > x1 + 0.1 * size:
+            if cstk:
+                items.append((fcur, tx, lidx, cstk))
+                cstk = ""
+        if brk and x + adv > x1 + 0.1 * size:
+            x = x0
+            lidx += 1
+        if vy_regex:
+            items.append((vid, x, lidx))
+        else:
+            if not cstk:
+                tx = x
+                if x == x0 and ch == " ":
+                    adv = 0
+                else:
+                    cstk += ch
+            else:
+                cstk += ch
+        adv -= mod
+        fcur = fcur_
+        x += adv
+    if cstk:
+        items.append((fcur, tx, lidx, cstk))
+    while (lidx + 1) * size * line_height > height and line_height >= 1:
+        line_height -= 0.05
+    return items, line_height
+
+
+def bench_linebreak(args):
+    from pymupdf import Font
+
+    from code_pdf.linelayout import break_lines, fit_line_height, tokenize
+
+    font = Font("helv")
+    words = "Lorem ipsum dolor sit amet, consectetur adipiscing elit {v%d} sed do eiusmod".split(" ")
+    vlen, varm = [12.5, 30.25, 7.0], [0.0, 1.5, 0.0]
+    print(f"{'ký tự':>8} {'trước (ms)':>12} {'sau (ms)':>10}")
+    for length in args.sizes:
+        parts, n = [], 0
+        while n < length:
+            word = words[len(parts) % len(words)].replace("%d", str(len(parts) % 4))  # {v3} vượt giới hạn
+            parts.append(word)
+            n += len(word) + 1
+        new = " ".join(parts)
+        glyphs = {ch: ("tiro", font.glyph_advance(ord(ch)), ord(ch)) for ch in set(new)}
+        para = dict(font="tiro", size=10.0, x=72.0, x0=72.0, x1=540.0, brk=True)
+        height = length / 80 * 10.0
+
+        start = time.perf_counter()
+        before = legacy_break_lines(new, glyphs, vlen, varm, **para, height=height, line_height=1.2)
+        t_before = time.perf_counter() - start
+
+        start = time.perf_counter()
+        items, lines = break_lines(tokenize(new, len(vlen)), glyphs, vlen, varm, **para)
+        after = [tuple(item) for item in items], fit_line_height(1.2, lines, para["size"], height)
+        t_after = time.perf_counter() - start
+
+        print(f"{length:>8} {t_before * 1000:>12.2f} {t_after * 1000:>10.2f}")
+        assert before == after, "Kết quả xếp dòng không khớp"
+
+
+def fake_bing_server(rotate):
+    """Máy chủ Bing giả lập trên localhost, đổi token sau mỗi rotate lượt dịch"""
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs
+
+    state = {"token": 0, "served": 0, "get": 0, "post": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def reply(self, body, ctype="application/json"):
+            body = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with lock:
+                state["get"] += 1
+                token = state["token"]
+            self.reply(
+                '<div data-iid="translator.5023"></div><script>var _G={"ig":"F00D"};'
+                f'var params_AbusePreventionHelper = [1700000000000,"tok{token}",3600000];'
+                "</script>",
+                "text/html",
+            )
+
+        def do_POST(self):
+            form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+            with lock:
+                state["post"] += 1
+                if form["token"][0] != f"tok{state['token']}":
+                    return self.reply('{"statusCode": 205}')
+                state["served"] += 1
+                if state["served"] % rotate == 0:
+                    state["token"] += 1
+            self.reply(json.dumps([{"translations": [{"text": form["text"][0][::-1]}]}]))
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def bench_bing(args):
+    """Số yêu cầu HTTP trên mỗi đoạn của BingTranslator (trước đây là 2: GET token + POST)"""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    from code_pdf.aio import run_sync
+    from code_pdf.translator import BingTranslator
+
+    paragraphs = [f"Paragraph {i} of the benchmark." for i in range(args.paragraphs)]
+    print(f"{args.paragraphs} đoạn, token đổi sau mỗi {args.rotate} lượt dịch")
+    print(f"{'cách gọi':>10} {'GET':>6} {'POST':>6} {'yêu cầu/đoạn':>14} {'giây':>8}")
+    for mode in ("sync", "async"):
+        server, state = fake_bing_server(args.rotate)
+        translator = BingTranslator("en", "vi", None)
+        translator.endpoint = f"http://127.0.0.1:{server.server_port}/translator"
+        start = time.perf_counter()
+        if mode == "sync":
+            with ThreadPoolExecutor(args.threads) as pool:
+                result = list(pool.map(translator.do_translate, paragraphs))
+        else:
+
+            async def run():
+                semaphore = asyncio.Semaphore(args.threads)  # như TranslateConverter
+
+                async def worker(text):
+                    async with semaphore:
+                        return await translator.ado_translate(text)
+
+                return await asyncio.gather(*map(worker, paragraphs))
+
+            result = run_sync(run())
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        assert result == [p[::-1] for p in paragraphs], "Kết quả dịch không khớp"
+        total = state["get"] + state["post"]
+        print(
+            f"{mode:>10} {state['get']:>6} {state['post']:>6} "
+            f"{total / args.paragraphs:>14.2f} {elapsed:>8.2f}"
+        )
+
+
+def bench_importtime(args):
+    """Thời gian import (python -X importtime) và RSS của tiến trình mới, như một worker vừa spawn"""
+    import subprocess
+    import sys
+
+    print(f"{'module':>24} {'import (ms)':>12} {'RSS (MiB)':>10}")
+    for module in args.modules:
+        times, rss = [], []
+        for _ in range(args.rounds):
+            proc = subprocess.run(
+                [
+                    sys.executable,
+                    "-X",
+                    "importtime",
+                    "-c",
+                    f"import resource, {module}; "
+                    "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)",
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            # Dòng cuối của importtime là module cấp cao nhất, cột 2 là thời gian cộng dồn (µs)
+            last = [line for line in proc.stderr.splitlines() if line.startswith("import time:")][-1]
+            times.append(int(last.split("|")[1]) / 1000)
+            rss.append(int(proc.stdout.split()[-1]) / 1024)
+        print(f"{module:>24} {min(times):>12.0f} {min(rss):>10.1f}")
+
+
+def memory_rollup():
+    """PSS và bộ nhớ riêng (KiB) của tiến trình hiện tại, từ /proc/self/smaps_rollup"""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields["Pss"], fields["Private_Clean"] + fields["Private_Dirty"]
+
+
+def bench_preload(args):
+    """So sánh bộ nhớ của worker khi mô hình nạp trước khi fork và khi mỗi worker tự nạp"""
+    import os
+
+    import numpy as np
+
+    import code_pdf
+    from code_pdf.doclayout import ModelInstance, OnnxModel
+
+    def load():
+        return OnnxModel(args.model) if args.model else OnnxModel.load_available()
+
+    page = np.full((1024, 768, 3), 255, np.uint8)
+
+    def run_workers(preloaded):
+        pipes = []
+        for _ in range(args.workers):
+            r, w = os.pipe()
+            if os.fork() == 0:
+                os.close(r)
+                model = ModelInstance.value if preloaded else load()
+                model.predict(page)
+                os.write(w, ("%d %d" % memory_rollup()).encode())
+                os._exit(0)
+            os.close(w)
+            pipes.append(r)
+        results = []
+        for r in pipes:
+            results.append(tuple(int(v) for v in os.read(r, 64).split()))
+            os.close(r)
+            os.wait()
+        pss = sum(p for p, _ in results) / 1024
+        private = sum(p for _, p in results) / 1024
+        label = "nạp trước fork" if preloaded else "mỗi worker tự nạp"
+        print(f"{label:>18} {pss:>14.1f} {private:>16.1f}")
+
+    print(f"{args.workers} worker, mỗi worker chạy mô hình trên một trang")
+    print(f"{'':>18} {'tổng PSS (MiB)':>14} {'tổng riêng (MiB)':>16}")
+    run_workers(preloaded=False)
+    code_pdf.init(cache=False, model=load(), warmup=True)
+    run_workers(preloaded=True)
+
+
+def bench_config(args):
+    """Thời gian đọc cấu hình và nạp envs của translator mỗi job, đếm số lần ghi config.json"""
+    import json
+    import os
+    import tempfile
+    from unittest import mock
+
+    from code_pdf.config import ConfigManager
+    from code_pdf.translator import OpenAITranslator
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "config.json")
+        with open(path, "w") as f:
+            json.dump({"NOTO_FONT_PATH": "/app/GoNotoKurrent-Regular.ttf"}, f)
+        ConfigManager.custome_config(path)
+        writes = {"n": 0}
+        real_dump = json.dump
+
+        def counting_dump(*a, **kw):
+            writes["n"] += 1
+            return real_dump(*a, **kw)
+
+        # Chỉ đo phần cấu hình của OpenAITranslator.__init__, không tạo client
+        translator = object.__new__(OpenAITranslator)
+        with mock.patch("json.dump", counting_dump):
+            start = time.perf_counter()
+            for i in range(args.jobs):
+                # Mỗi job đọc font, hạn mức và nạp envs với khóa API riêng
+                ConfigManager.get("NOTO_FONT_PATH")
+                ConfigManager.get("RATE_LIMITS")
+                translator.envs = OpenAITranslator.envs
+                translator.set_envs({"OPENAI_API_KEY": f"sk-{i % 4}"})
+            elapsed = time.perf_counter() - start
+            ConfigManager.get_instance().flush()
+        print(
+            f"{args.jobs} job: {elapsed * 1e6 / args.jobs:.1f} µs/job, "
+            f"{writes['n']} lần ghi config.json"
+        )
+
+
+def make_text_pdf(pages, lines=40):
+    """PDF tổng hợp gồm nhiều trang văn bản, mỗi trang lines dòng"""
+    import pymupdf
+
+    doc = pymupdf.open()
+    for i in range(pages):
+        page = doc.new_page()
+        for j in range(lines):
+            page.insert_text((50, 60 + j * 18), f"Page {i + 1} line {j + 1}: lorem ipsum dolor sit amet")
+    return doc.tobytes()
+
+
+def legacy_page_lookup(pdf_bytes):
+    """Cách lấy trang cũ: mỗi trang duyệt lại cây trang từ đầu, trả về số trang đã duyệt"""
+    import pymupdf
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfparser import PDFParser
+
+    doc = PDFDocument(PDFParser(io.BytesIO(pdf_bytes)))
+    visited = 0
+    for page_idx in range(pymupdf.Document(stream=pdf_bytes).page_count):
+        for i, _ in enumerate(PDFPage.create_pages(doc)):
+            visited += 1
+            if i == page_idx:
+                break
+    return visited
+
+
+def bench_extract(args):
+    """Trích xuất text chunks trên tài liệu dài: duyệt trang, thời gian đến trang đầu và tổng"""
+    from code_pdf.extract import PageCursor, iter_pdfminer_pages
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfparser import PDFParser
+
+    if args.pdf:
+        import pymupdf
+
+        src = pymupdf.open(args.pdf)
+        doc = pymupdf.open()
+        while doc.page_count < args.pages:
+            doc.insert_pdf(src, to_page=min(src.page_count, args.pages - doc.page_count) - 1)
+        pdf_bytes = doc.tobytes()
+    else:
+        pdf_bytes = make_text_pdf(args.pages)
+
+    start = time.perf_counter()
+    visited = legacy_page_lookup(pdf_bytes)
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    cursor = PageCursor(PDFPage.create_pages(PDFDocument(PDFParser(io.BytesIO(pdf_bytes)))))
+    for index in range(args.pages):
+        cursor.seek(index)
+    single = time.perf_counter() - start
+    print(f"{args.pages} trang, chỉ tìm trang pdfminer:")
+    print(f"  duyệt lại từ đầu mỗi trang: {legacy:7.2f}s ({visited} lần tạo PDFPage)")
+    print(f"  một lượt duy nhất:          {single:7.2f}s ({cursor.index + 1} lần tạo PDFPage)")
+
+    start = time.perf_counter()
+    pages = iter_pdfminer_pages(pdf_bytes)
+    next(pages)
+    first = time.perf_counter() - start
+    count = 1 + sum(1 for _ in pages)
+    total = time.perf_counter() - start
+    print(f"  trích xuất đầy đủ: trang đầu sau {first:.2f}s, {count} trang sau {total:.2f}s")
+    start = time.perf_counter()
+    last = list(iter_pdfminer_pages(pdf_bytes, pages=[args.pages - 1]))
+    print(f"  chỉ trang cuối: {time.perf_counter() - start:.2f}s ({len(last[0]['chunks'])} chunks)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("vflag", help="Tốc độ phân loại ký tự công thức")
+    p.add_argument("pdf", nargs="?", default="EVENTA.pdf")
+    p.add_argument("--rounds", type=int, default=20)
+    p.set_defaults(func=bench_vflag)
+
+    p = sub.add_parser("execute", help="Độ tuyến tính của PDFPageInterpreterEx.execute")
+    p.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 200000])
+    p.set_defaults(func=bench_execute)
+
+    p = sub.add_parser("layout", help="Thời gian và bộ nhớ của receive_layout theo trang")
+    p.add_argument("pdf", nargs="?", default="EVENTA.pdf")
+    p.add_argument("--rounds", type=int, default=5)
+    p.set_defaults(func=bench_layout)
+
+    p = sub.add_parser("linebreak", help="Xếp dòng một đoạn dài, so với vòng lặp cũ")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    p.set_defaults(func=bench_linebreak)
+
+    p = sub.add_parser("bing", help="Số yêu cầu HTTP mỗi đoạn của Bing với máy chủ giả lập")
+    p.add_argument("--paragraphs", type=int, default=200)
+    p.add_argument("--rotate", type=int, default=50)
+    p.add_argument("--threads", type=int, default=4)
+    p.set_defaults(func=bench_bing)
+
+    p = sub.add_parser("importtime", help="Thời gian import và bộ nhớ khi khởi động")
+    p.add_argument("modules", nargs="*", default=["code_pdf", "code_pdf.translator"])
+    p.add_argument("--rounds", type=int, default=3)
+    p.set_defaults(func=bench_importtime)
+
+    p = sub.add_parser("preload", help="Bộ nhớ dùng chung của mô hình giữa các worker fork")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--model", help="đường dẫn file .onnx, mặc định tải mô hình DocLayout")
+    p.set_defaults(func=bench_preload)
+
+    p = sub.add_parser("config", help="Chi phí đọc/ghi cấu hình trên đường đi của mỗi job")
+    p.add_argument("--jobs", type=int, default=20000)
+    p.set_defaults(func=bench_config)
+
+    p = sub.add_parser("extract", help="Trích xuất text chunks theo trang trên tài liệu dài")
+    p.add_argument("--pages", type=int, default=300)
+    p.add_argument("--pdf", help="lặp lại trang của file này thay cho PDF tổng hợp")
+    p.set_defaults(func=bench_extract)
+
+    args = parser.parse_args()
+    args.func(args)
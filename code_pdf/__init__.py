@@ -5,4 +5,28 @@ log = logging.getLogger(__name__)
 
 __version__ = "1.9.3"
 __author__ = "Byaidu"
-__all__ = ["translate", "translate_stream"]
+__all__ = ["init", "translate", "translate_stream"]
+
+
+def init(cache=True, model=False, warmup: bool = False):
+    """
+    Khởi tạo tài nguyên dùng chung một cách tường minh, import code_pdf không
+    mở file hay nạp mô hình. Với nhiều tiến trình, gọi trong từng tiến trình sau khi
+    fork: phiên onnxruntime tạo trước khi fork không dùng được trong tiến trình con.
+    :param cache: True mở CSDL bộ nhớ đệm mặc định, chuỗi là đường dẫn file,
+        False để tự mở ở lần dùng đầu tiên
+    :param model: True nạp mô hình bố cục vào ModelInstance, hoặc truyền sẵn một mô hình
+    :param warmup: chạy thử mô hình một lần để onnxruntime cấp phát bộ nhớ ngay
+    """
+    from code_pdf.cache import init_db
+    from code_pdf.doclayout import ModelInstance
+
+    if cache:
+        init_db(cache_db_path=cache if isinstance(cache, str) else None)
+    if model is True:
+        ModelInstance.get()
+    elif model:
+        ModelInstance.value = model
+    if model and warmup:
+        ModelInstance.warmup()
+    return ModelInstance.value
@@ -0,0 +1,118 @@
+import asyncio
+import contextvars
+import functools
+import importlib.util
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Coroutine, Dict, TypeVar
+
+import httpx
+
+from code_pdf.config import ConfigManager
+
+T = TypeVar("T")
+
+# Có h2 thì bật HTTP/2, nhiều yêu cầu dùng chung một kết nối
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+# Số luồng cho các SDK chỉ có API đồng bộ (DeepL, Azure, Tencent...), dùng chung cho
+# mọi job của tiến trình; đặt BLOCKING_THREADS trong config.json hoặc biến môi trường.
+# Yêu cầu bị bỏ khi quá hạn vẫn giữ luồng tới khi SDK trả về hoặc hết timeout của nó.
+DEFAULT_BLOCKING_THREADS = 64
+# Đọc/ghi bộ nhớ đệm SQLite có pool riêng, không phải xếp hàng sau các yêu cầu HTTP chậm
+CACHE_THREADS = 4
+
+_loop: asyncio.AbstractEventLoop = None
+_loop_lock = threading.Lock()
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Event loop dùng chung của tiến trình, chạy trong một luồng nền
+
+    Mọi job dịch gửi yêu cầu vào cùng một loop, nên số yêu cầu đang chờ không
+    còn bị giới hạn bởi số luồng của từng trang.
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=loop.run_forever, name="code_pdf-aio", daemon=True
+                ).start()
+                _loop = loop
+    return _loop
+
+
+def run_sync(coro: Coroutine[Any, Any, T]) -> T:
+    """Chạy coroutine trên loop dùng chung và chờ kết quả từ luồng hiện tại"""
+    loop = get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("run_sync cannot be called from the shared event loop")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def blocking_threads() -> int:
+    try:
+        return max(1, int(ConfigManager.get("BLOCKING_THREADS") or DEFAULT_BLOCKING_THREADS))
+    except (TypeError, ValueError):
+        return DEFAULT_BLOCKING_THREADS
+
+
+def get_executor(kind: str) -> ThreadPoolExecutor:
+    """Pool luồng dùng chung của tiến trình: "blocking" cho lời gọi SDK, "cache" cho bộ nhớ đệm"""
+    pool = _executors.get(kind)
+    if pool is None:
+        with _loop_lock:
+            pool = _executors.get(kind)
+            if pool is None:
+                size = blocking_threads() if kind == "blocking" else CACHE_THREADS
+                pool = _executors[kind] = ThreadPoolExecutor(
+                    size, thread_name_prefix=f"code_pdf-{kind}"
+                )
+    return pool
+
+
+async def run_in(kind: str, func: Callable[..., T], *args, **kwargs) -> T:
+    """Như asyncio.to_thread nhưng chạy trong pool riêng thay vì pool mặc định của loop
+    (chỉ min(32, số CPU + 4) luồng)"""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(kind), call)
+
+
+def per_loop(
+    cache: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, T]",
+    factory: Callable[[], T],
+) -> T:
+    """Lấy đối tượng gắn với event loop đang chạy, tạo mới nếu chưa có
+
+    Client bất đồng bộ chỉ dùng được trong loop đã tạo ra nó.
+    """
+    loop = asyncio.get_running_loop()
+    value = cache.get(loop)
+    if value is None:
+        value = cache[loop] = factory()
+    return value
+
+
+def http_client() -> httpx.AsyncClient:
+    """Client HTTP có pool kết nối keep-alive, dùng chung cho mọi translator"""
+    return per_loop(
+        _clients,
+        lambda: httpx.AsyncClient(
+            http2=HTTP2,
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(max_connections=256, max_keepalive_connections=64),
+        ),
+    )
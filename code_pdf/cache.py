@@ -1,12 +1,14 @@
 import logging
 import os
 import json
+import threading
 from peewee import Model, SqliteDatabase, AutoField, CharField, TextField, SQL
 from typing import Optional
 
 
-# we don't init the database here
+# we don't init the database here, see init_db / code_pdf.init
 db = SqliteDatabase(None)
+_db_lock = threading.Lock()
 logger = logging.getLogger(__name__)
 
 
@@ -76,6 +78,7 @@ class TranslationCache:
     # Since peewee and the underlying sqlite are thread-safe,
     # get and set operations don't need locks.
     def get(self, original_text: str) -> Optional[str]:
+        ensure_db()
         result = _TranslationCache.get_or_none(
             translate_engine=self.translate_engine,
             translate_engine_params=self.translate_engine_params,
@@ -84,6 +87,7 @@ class TranslationCache:
         return result.translation if result else None
 
     def set(self, original_text: str, translation: str):
+        ensure_db()
         try:
             _TranslationCache.create(
                 translate_engine=self.translate_engine,
@@ -95,11 +99,12 @@ class TranslationCache:
             logger.debug(f"Error setting cache: {e}")
 
 
-def init_db(remove_exists=False):
-    cache_folder = os.path.join(os.path.expanduser("~"), ".cache", "code_pdf")
-    os.makedirs(cache_folder, exist_ok=True)
-    # The current version does not support database migration, so add the version number to the file name.
-    cache_db_path = os.path.join(cache_folder, "cache.v1.db")
+def init_db(remove_exists=False, cache_db_path: Optional[str] = None):
+    if cache_db_path is None:
+        cache_folder = os.path.join(os.path.expanduser("~"), ".cache", "code_pdf")
+        # The current version does not support database migration, so add the version number to the file name.
+        cache_db_path = os.path.join(cache_folder, "cache.v1.db")
+    os.makedirs(os.path.dirname(os.path.abspath(cache_db_path)), exist_ok=True)
     if remove_exists and os.path.exists(cache_db_path):
         os.remove(cache_db_path)
     db.init(
@@ -110,6 +115,16 @@ def init_db(remove_exists=False):
         },
     )
     db.create_tables([_TranslationCache], safe=True)
+    # Connections are per thread and reopened on demand, don't carry this one across fork
+    db.close()
+
+
+def ensure_db():
+    """Open the default cache database on first use unless init_db was called"""
+    if db.deferred and _TranslationCache._meta.database is db:
+        with _db_lock:
+            if db.deferred:
+                init_db()
 
 
 def init_test_db():
@@ -141,6 +156,3 @@ def clean_test_db(test_db):
     shm_path = db_path + "-shm"
     if os.path.exists(shm_path):
         os.remove(shm_path)
-
-
-init_db()
@@ -1,14 +1,21 @@
+import atexit
 import json
 from pathlib import Path
-from threading import RLock  # Chuyển thành RLock
+from threading import RLock, Timer  # Chuyển thành RLock
 import os
 import copy
+import time
 
 
 class ConfigManager:
     _instance = None
     _lock = RLock()  # Sử dụng RLock thay cho Lock, cho phép lấy khóa nhiều lần trong cùng một luồng
 
+    # Gom các lần ghi trong khoảng này thành một lần ghi file
+    save_delay = 0.5
+    # Khoảng thời gian tối thiểu giữa hai lần kiểm tra mtime của file
+    check_interval = 1.0
+
     @classmethod
     def get_instance(cls):
         """Lấy instance singleton"""
@@ -26,7 +33,13 @@ class ConfigManager:
         self._initialized = True
 
         self._config_path = Path.home() / ".config" / "PDFMathTranslate" / "config.json"
+        # Bản chụp cấu hình: chỉ được thay thế cả dict, không sửa tại chỗ,
+        # nên các thao tác đọc không cần khóa
         self._config_data = {}
+        self._stat = None  # (mtime_ns, size) của file lúc đọc hoặc ghi gần nhất
+        self._checked = 0.0
+        self._dirty = False
+        self._timer = None
 
         # Không cần thêm khóa ở đây, vì bên ngoài có thể đã khóa (get_instance), RLock cũng không sao
         self._ensure_config_exists()
@@ -40,24 +53,92 @@ class ConfigManager:
                 self._config_path.parent.mkdir(parents=True, exist_ok=True)
                 self._config_data = {}  # Nội dung cấu hình mặc định
                 self._save_config()
+                self.flush()
             else:
                 raise ValueError(f"config file {self._config_path} not found!")
         else:
             self._load_config()
 
+    def _file_stat(self):
+        try:
+            st = os.stat(self._config_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
     def _load_config(self):
         """Tải cấu hình từ config.json"""
         with self._lock:  # Khóa để đảm bảo an toàn đa luồng
+            stat = self._file_stat()
             with self._config_path.open("r", encoding="utf-8") as f:
                 self._config_data = json.load(f)
+            self._stat = stat
+            self._checked = time.monotonic()
+
+    def _refresh(self):
+        """Đọc lại file khi mtime thay đổi (file bị sửa từ bên ngoài)
+
+        Mỗi check_interval giây mới stat file một lần, nên đọc cấu hình trong
+        một job không tốn I/O đĩa.
+        """
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            self._checked = now
+            # Đang chờ ghi thì bản trong bộ nhớ là bản mới nhất
+            if self._dirty:
+                return
+            stat = self._file_stat()
+            if stat is None or stat == self._stat:
+                return
+            try:
+                self._load_config()
+            except ValueError:
+                # File đang được ghi dở bởi tiến trình khác, lần sau đọc lại
+                pass
+
+    def _update(self, func):
+        """Sửa cấu hình trên bản sao rồi thay bản chụp, sau đó lên lịch ghi file"""
+        with self._lock:
+            data = copy.deepcopy(self._config_data)
+            result = func(data)
+            self._config_data = data
+            self._save_config()
+            return result
 
     def _save_config(self):
-        """Lưu cấu hình vào config.json"""
+        """Lên lịch lưu cấu hình vào config.json, các lần gọi liên tiếp được gộp lại"""
         with self._lock:  # Khóa để đảm bảo an toàn đa luồng
+            self._dirty = True
+            # Sau khi fork luồng hẹn giờ của tiến trình cha không còn chạy
+            if self._timer is None or not self._timer.is_alive():
+                self._timer = Timer(self.save_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Ghi ngay cấu hình đang chờ: ghi ra file tạm rồi đổi tên, không để lại file ghi dở"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
             # Loại bỏ tham chiếu vòng tròn và ghi
             cleaned_data = self._remove_circular_references(self._config_data)
-            with self._config_path.open("w", encoding="utf-8") as f:
-                json.dump(cleaned_data, f, indent=4, ensure_ascii=False)
+            tmp = self._config_path.with_name(
+                f".{self._config_path.name}.{os.getpid()}.tmp"
+            )
+            try:
+                with tmp.open("w", encoding="utf-8") as f:
+                    json.dump(cleaned_data, f, indent=4, ensure_ascii=False)
+                os.replace(tmp, self._config_path)
+            except BaseException:
+                tmp.unlink(missing_ok=True)
+                raise
+            self._dirty = False
+            self._stat = self._file_stat()
 
     def _remove_circular_references(self, obj, seen=None):
         """Đệ quy loại bỏ tham chiếu vòng tròn"""
@@ -84,6 +165,8 @@ class ConfigManager:
             raise ValueError(f"Config file {custom_path} not found!")
         # Khóa
         with cls._lock:
+            if cls._instance is not None:
+                cls._instance.flush()
             instance = cls()
             instance._config_path = custom_path
             # Ở đây truyền isInit=False, nếu không tồn tại thì báo lỗi; nếu tồn tại thì _load_config() bình thường
@@ -94,22 +177,20 @@ class ConfigManager:
     def get(cls, key, default=None):
         """Lấy giá trị cấu hình"""
         instance = cls.get_instance()
-        # Khi đọc, khóa hay không khóa đều được. Nhưng để thống nhất, chúng ta khóa trước và sau khi sửa đổi cấu hình.
-        # get chỉ cần lưu cuối cùng, thì sẽ khóa -> _save_config()
-        if key in instance._config_data:
-            return instance._config_data[key]
+        instance._refresh()
+        data = instance._config_data
+        if key in data:
+            return data[key]
 
         # Nếu key tồn tại trong biến môi trường, sử dụng biến môi trường và ghi lại vào config
         if key in os.environ:
             value = os.environ[key]
-            instance._config_data[key] = value
-            instance._save_config()
+            instance._update(lambda data: data.__setitem__(key, value))
             return value
 
         # Nếu default không phải None, thì thiết lập và lưu
         if default is not None:
-            instance._config_data[key] = default
-            instance._save_config()
+            instance._update(lambda data: data.__setitem__(key, default))
             return default
 
         # Không tìm thấy thì trả về ngoại lệ
@@ -120,14 +201,13 @@ class ConfigManager:
     def set(cls, key, value):
         """Thiết lập giá trị cấu hình và lưu"""
         instance = cls.get_instance()
-        with instance._lock:
-            instance._config_data[key] = value
-            instance._save_config()
+        instance._update(lambda data: data.__setitem__(key, value))
 
     @classmethod
     def get_translator_by_name(cls, name):
         """Lấy cấu hình translator tương ứng dựa trên name"""
         instance = cls.get_instance()
+        instance._refresh()
         translators = instance._config_data.get("translators", [])
         for translator in translators:
             if translator.get("name") == name:
@@ -138,59 +218,52 @@ class ConfigManager:
     def set_translator_by_name(cls, name, new_translator_envs):
         """Thiết lập hoặc cập nhật cấu hình translator dựa trên name"""
         instance = cls.get_instance()
-        with instance._lock:
-            translators = instance._config_data.get("translators", [])
+        new_translator_envs = copy.deepcopy(new_translator_envs)
+
+        def update(data):
+            translators = data.setdefault("translators", [])
             for translator in translators:
                 if translator.get("name") == name:
-                    translator["envs"] = copy.deepcopy(new_translator_envs)
-                    instance._save_config()
+                    translator["envs"] = new_translator_envs
                     return
-            translators.append(
-                {"name": name, "envs": copy.deepcopy(new_translator_envs)}
-            )
-            instance._config_data["translators"] = translators
-            instance._save_config()
+            translators.append({"name": name, "envs": new_translator_envs})
+
+        instance._update(update)
 
     @classmethod
     def get_env_by_translatername(cls, translater_name, name, default=None):
         """Lấy cấu hình translator tương ứng dựa trên name"""
         instance = cls.get_instance()
+        instance._refresh()
         translators = instance._config_data.get("translators", [])
         for translator in translators:
             if translator.get("name") == translater_name.name:
                 if translator["envs"][name]:
                     return translator["envs"][name]
-                else:
-                    with instance._lock:
-                        translator["envs"][name] = default
-                        instance._save_config()
-                        return default
+                break
 
-        with instance._lock:
-            translators = instance._config_data.get("translators", [])
+        def update(data):
+            translators = data.setdefault("translators", [])
             for translator in translators:
                 if translator.get("name") == translater_name.name:
                     translator["envs"][name] = default
-                    instance._save_config()
-                    return default
+                    return
             translators.append(
                 {
                     "name": translater_name.name,
                     "envs": copy.deepcopy(translater_name.envs),
                 }
             )
-            instance._config_data["translators"] = translators
-            instance._save_config()
-            return default
+
+        instance._update(update)
+        return default
 
     @classmethod
     def delete(cls, key):
         """Xóa giá trị cấu hình và lưu"""
         instance = cls.get_instance()
-        with instance._lock:
-            if key in instance._config_data:
-                del instance._config_data[key]
-                instance._save_config()
+        if key in instance._config_data:
+            instance._update(lambda data: data.pop(key, None))
 
     @classmethod
     def clear(cls):
@@ -204,11 +277,22 @@ class ConfigManager:
     def all(cls):
         """Trả về tất cả các mục cấu hình"""
         instance = cls.get_instance()
-        # Đây chỉ là thao tác đọc, thường không cần khóa. Tuy nhiên để an toàn cũng có thể khóa.
+        instance._refresh()
+        # Bản chụp không bị sửa tại chỗ, đọc không cần khóa
         return instance._config_data
 
     @classmethod
     def remove(cls):
         instance = cls.get_instance()
         with instance._lock:
+            if instance._timer is not None:
+                instance._timer.cancel()
+                instance._timer = None
+            instance._dirty = False
             os.remove(instance._config_path)
+
+
+@atexit.register
+def _flush_at_exit():
+    if ConfigManager._instance is not None:
+        ConfigManager._instance.flush()
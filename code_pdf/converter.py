@@ -1,45 +1,26 @@
-import concurrent.futures
+import asyncio
 import logging
 import re
+import struct
+import time
 import unicodedata
-from enum import Enum
+from binascii import hexlify
 from string import Template
-from typing import Dict
+from typing import Dict, NamedTuple, Optional
 
-import numpy as np
 from pdfminer.converter import PDFConverter
 from pdfminer.layout import LTChar, LTFigure, LTLine, LTPage
 from pdfminer.pdffont import PDFCIDFont, PDFUnicodeNotDefined
 from pdfminer.pdfinterp import PDFGraphicState, PDFResourceManager
 from pdfminer.utils import apply_matrix_pt, mult_matrix
 from pymupdf import Font
-from tenacity import retry, wait_fixed
-
-from code_pdf.translator import (
-    AnythingLLMTranslator,
-    ArgosTranslator,
-    AzureOpenAITranslator,
-    AzureTranslator,
-    BaseTranslator,
-    BingTranslator,
-    DeepLTranslator,
-    DeepLXTranslator,
-    DeepseekTranslator,
-    DifyTranslator,
-    GeminiTranslator,
-    GoogleTranslator,
-    GorkTranslator,
-    GroqTranslator,
-    ModelScopeTranslator,
-    OllamaTranslator,
-    OpenAIlikedTranslator,
-    OpenAITranslator,
-    QwenMtTranslator,
-    SiliconTranslator,
-    TencentTranslator,
-    XinferenceTranslator,
-    ZhipuTranslator,
-)
+from tenacity import AsyncRetrying, stop_after_attempt, stop_after_delay, wait_random_exponential
+
+from code_pdf.aio import run_sync
+from code_pdf.fontcache import get_coverage
+from code_pdf.linelayout import TextRun, break_lines, fit_line_height, tokenize
+from code_pdf.ratelimit import retry_after
+from code_pdf.translator import BaseTranslator, get_translator
 
 log = logging.getLogger(__name__)
 
@@ -115,6 +96,8 @@ class PDFConverterEx(PDFConverter):
 
 
 class Paragraph:
+    __slots__ = ("y", "x", "x0", "x1", "y0", "y1", "size", "brk")
+
     def __init__(self, y, x, x0, x1, y0, y1, size, brk):
         self.y: float = y  # 初始纵坐标
         self.x: float = x  # 初始横坐标
@@ -126,7 +109,72 @@ class Paragraph:
         self.brk: bool = brk  # 换行标记
 
 
+class FormulaChar(NamedTuple):
+    # 公式符号只保留排版需要的字段，不再持有整个 LTChar
+    cid: int        # 原字符编码
+    font: str       # 原字符字体在资源中的名字
+    x0: float
+    y0: float
+    size: float
+
+
+class RetryPolicy(NamedTuple):
+    """段落翻译的重试策略，用尽后该段落保留原文"""
+    attempts: int = 5                   # 每段最多请求次数
+    attempt_timeout: float = 120.0      # 单次请求超时（秒）
+    paragraph_timeout: float = 300.0    # 每段的总时长（秒），包括退避等待
+    backoff: float = 0.5                # 带抖动的指数退避基数（秒）
+    backoff_max: float = 30.0
+
+
 # fmt: off
+class FormulaClassifier:
+    """匹配公式（和角标）字体与字符，正则只编译一次，结果按字体名和字符缓存"""
+
+    FONT_PATTERN = r"(CM[^R]|MS.M|XY|MT|BL|RM|EU|LA|RS|LINE|LCIRCLE|TeX-|rsfs|txsy|wasy|stmary|.*Mono|.*Code|.*Ital|.*Sym|.*Math)"  # latex 字体
+    CHAR_CATEGORIES = frozenset(["Lm", "Mn", "Sk", "Sm", "Zl", "Zp", "Zs"])  # 文字修饰符、数学符号、分隔符号
+
+    def __init__(self, vfont: str = None, vchar: str = None) -> None:
+        self.vfont = re.compile(vfont or self.FONT_PATTERN)
+        self.vchar = re.compile(vchar) if vchar else None
+        self.font_flags: Dict[object, bool] = {}
+        self.char_flags: Dict[str, bool] = {}
+
+    def font_flag(self, font) -> bool:
+        if isinstance(font, bytes):     # 不一定能 decode，直接转 str
+            try:
+                font = font.decode('utf-8')  # 尝试使用 UTF-8 解码
+            except UnicodeDecodeError:
+                font = ""
+        font = font.split("+")[-1]      # 字体名截断
+        return self.vfont.match(font) is not None
+
+    def char_flag(self, char: str) -> bool:
+        if char.startswith("(cid:"):
+            return True
+        if self.vchar:
+            return self.vchar.match(char) is not None
+        return (
+            char != ""
+            and char != " "                                     # 非空格
+            and (
+                unicodedata.category(char[0]) in self.CHAR_CATEGORIES
+                or 0x370 <= ord(char[0]) < 0x400                # 希腊字母
+            )
+        )
+
+    def __call__(self, font, char: str) -> bool:
+        flag = self.font_flags.get(font)
+        if flag is None:
+            flag = self.font_flags[font] = self.font_flag(font)
+        if flag:
+            return True
+        flag = self.char_flags.get(char)
+        if flag is None:
+            flag = self.char_flags[char] = self.char_flag(char)
+        return flag
+
+
 class TranslateConverter(PDFConverterEx):
     def __init__(
         self,
@@ -144,10 +192,15 @@ class TranslateConverter(PDFConverterEx):
         prompt: Template = None,
         font_name: str = "",
         font_size_factor: float = 1.0,
+        retry_policy: RetryPolicy = None,
+        deadline: Optional[float] = None,
+        cancellation_event=None,
+        progress=None,
     ) -> None:
         super().__init__(rsrcmgr)
         self.vfont = vfont
         self.vchar = vchar
+        self.vflag = FormulaClassifier(vfont, vchar)
         self.thread = thread
         self.layout = layout
         self.noto_name = noto_name
@@ -155,75 +208,73 @@ class TranslateConverter(PDFConverterEx):
         self.translator: BaseTranslator = None
         self.font_name = font_name
         self.font_size_factor = font_size_factor
-        # e.g. "ollama:gemma2:9b" -> ["ollama", "gemma2:9b"]
-        param = service.split(":", 1)
-        service_name = param[0]
-        service_model = param[1] if len(param) > 1 else None
-        if not envs:
-            envs = {}
-        for translator in [GoogleTranslator, BingTranslator, DeepLTranslator, DeepLXTranslator, OllamaTranslator, XinferenceTranslator, AzureOpenAITranslator,
-                           OpenAITranslator, ZhipuTranslator, ModelScopeTranslator, SiliconTranslator, GeminiTranslator, AzureTranslator, TencentTranslator, DifyTranslator, AnythingLLMTranslator, ArgosTranslator, GorkTranslator, GroqTranslator, DeepseekTranslator, OpenAIlikedTranslator, QwenMtTranslator,]:
-            if service_name == translator.name:
-                self.translator = translator(lang_in, lang_out, service_model, envs=envs, prompt=prompt)
-        if not self.translator:
-            raise ValueError("Unsupported translation service")
-
-    def receive_layout(self, ltpage: LTPage):
+        self.ops_buffer = bytearray()  # receive_layout 的输出缓冲区，按页复用
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.deadline = deadline  # 整个任务的截止时间（time.time()），之后的段落不再翻译
+        self.cancellation_event = cancellation_event  # threading.Event，设置后取消在途和排队的请求
+        self.stats = {"paragraphs": 0, "done": 0, "failed": 0, "errors": []}  # 翻译失败的段落保留原文
+        self.progress = progress  # 每个段落完成（成功或保留原文）后调用 progress(stats)，在事件循环线程中执行
+        # 同一配置的翻译器在各页面和任务之间复用
+        self.translator = get_translator(service, lang_in, lang_out, envs, prompt)
+
+    def select_fonts(self, text: str, default_font: str) -> Dict[str, tuple]:
+        # 逐字选择字体：自定义字体 -> tiro -> noto，只按去重后的字符计算
+        # 返回 字符 -> (字体名, 字号为 1 时的宽度, 编码)
+        result = {}
+        pending = set(text)
+        fallback = set()  # 查询时抛出异常的字符直接使用 noto
+        fnames = [default_font] if default_font != self.noto_name else []
+        if "tiro" not in fnames:
+            fnames.append("tiro")
+        for fname in fnames:
+            font = self.fontmap.get(fname)
+            if not font or not pending:
+                continue
+            for ch, (supported, width, code) in get_coverage(font).bulk(font, pending).items():
+                if supported is None:
+                    fallback.add(ch)
+                elif supported:
+                    result[ch] = (fname, width, code)
+            pending -= result.keys()
+            pending -= fallback
+        pending |= fallback
+        if pending:
+            cov = get_coverage(self.noto)
+            for ch, (_, width, code) in cov.bulk(self.noto, pending).items():
+                result[ch] = (self.noto_name, width, code)
+        return result
+
+    def receive_layout(self, ltpage: LTPage) -> bytes:
         # 段落
         sstk: list[str] = []            # 段落文字栈
         pstk: list[Paragraph] = []      # 段落属性栈
         vbkt: int = 0                   # 段落公式括号计数
         # 公式组
-        vstk: list[LTChar] = []         # 公式符号组
+        vstk: list[FormulaChar] = []    # 公式符号组
         vlstk: list[LTLine] = []        # 公式线条组
         vfix: float = 0                 # 公式纵向偏移
+        vx0: float = 0                  # 公式符号最大左边界
+        vx1: float = 0                  # 公式符号最大右边界
+        vlast: LTChar = None            # 公式最后一个符号
         # 公式组栈
-        var: list[list[LTChar]] = []    # 公式符号组栈
+        var: list[list[FormulaChar]] = []   # 公式符号组栈
         varl: list[list[LTLine]] = []   # 公式线条组栈
         varf: list[float] = []          # 公式纵向偏移栈
         vlen: list[float] = []          # 公式宽度栈
+        varm: list[float] = []          # 公式结尾文字修饰符宽度栈
         # 全局
         lstk: list[LTLine] = []         # 全局线条栈
         xt: LTChar = None               # 上一个字符
         xt_cls: int = -1                # 上一个字符所属段落，保证无论第一个字符属于哪个类别都可以触发新段落
         vmax: float = ltpage.width / 4  # 行内公式最大宽度
-        ops: str = ""                   # 渲染结果
+        ops: bytearray = self.ops_buffer  # 渲染结果，复用同一个缓冲区
+        ops.clear()
 
-        def vflag(font: str, char: str):    # 匹配公式（和角标）字体
-            if isinstance(font, bytes):     # 不一定能 decode，直接转 str
-                try:
-                    font = font.decode('utf-8')  # 尝试使用 UTF-8 解码
-                except UnicodeDecodeError:
-                    font = ""
-            font = font.split("+")[-1]      # 字体名截断
-            if re.match(r"\(cid:", char):
-                return True
-            # 基于字体名规则的判定
-            if self.vfont:
-                if re.match(self.vfont, font):
-                    return True
-            else:
-                if re.match(                                            # latex 字体
-                    r"(CM[^R]|MS.M|XY|MT|BL|RM|EU|LA|RS|LINE|LCIRCLE|TeX-|rsfs|txsy|wasy|stmary|.*Mono|.*Code|.*Ital|.*Sym|.*Math)",
-                    font,
-                ):
-                    return True
-            # 基于字符集规则的判定
-            if self.vchar:
-                if re.match(self.vchar, char):
-                    return True
-            else:
-                if (
-                    char
-                    and char != " "                                     # 非空格
-                    and (
-                        unicodedata.category(char[0])
-                        in ["Lm", "Mn", "Sk", "Sm", "Zl", "Zp", "Zs"]   # 文字修饰符、数学符号、分隔符号
-                        or ord(char[0]) in range(0x370, 0x400)          # 希腊字母
-                    )
-                ):
-                    return True
-            return False
+        def vmod(ch: LTChar) -> float:  # 文字修饰符宽度
+            text = ch.get_text()
+            if text and unicodedata.category(text[0]) in ["Lm", "Mn", "Sk"]:
+                return ch.width
+            return 0
 
         ############################################################
         # A. 原文档解析
@@ -234,7 +285,7 @@ class TranslateConverter(PDFConverterEx):
                 # ltpage.height 可能是 fig 里面的高度，这里统一用 layout.shape
                 h, w = layout.shape
                 # 读取当前字符在 layout 中的类别
-                cx, cy = np.clip(int(child.x0), 0, w - 1), np.clip(int(child.y0), 0, h - 1)
+                cx, cy = min(max(int(child.x0), 0), w - 1), min(max(int(child.y0), 0), h - 1)
                 cls = layout[cy, cx]
                 # 锚定文档中 bullet 的位置
                 if child.get_text() == "•":
@@ -243,7 +294,7 @@ class TranslateConverter(PDFConverterEx):
                 if (                                                                                        # 判定当前字符是否属于公式
                     cls == 0                                                                                # 1. 类别为保留区域
                     or (cls == xt_cls and len(sstk[-1].strip()) > 1 and child.size < pstk[-1].size * 0.79)  # 2. 角标字体，有 0.76 的角标和 0.799 的大写，这里用 0.79 取中，同时考虑首字母放大的情况
-                    or vflag(child.fontname, child.get_text())                                              # 3. 公式字体
+                    or self.vflag(child.fontname, child.get_text())                                         # 3. 公式字体
                     or (child.matrix[0] == 0 and child.matrix[3] == 0)                                      # 4. 垂直字体
                 ):
                     cur_v = True
@@ -268,7 +319,7 @@ class TranslateConverter(PDFConverterEx):
                         if (                                                # 根据公式右侧的文字修正公式的纵向偏移
                             not cur_v                                       # 1. 当前字符不属于公式
                             and cls == xt_cls                               # 2. 当前字符与前一个字符属于同一段落
-                            and child.x0 > max([vch.x0 for vch in vstk])    # 3. 当前字符在公式右侧
+                            and child.x0 > vx0                              # 3. 当前字符在公式右侧
                         ):
                             vfix = vstk[0].y0 - child.y0
                         if sstk[-1] == "":
@@ -277,6 +328,8 @@ class TranslateConverter(PDFConverterEx):
                         var.append(vstk)
                         varl.append(vlstk)
                         varf.append(vfix)
+                        vlen.append(vx1 - vstk[0].x0)
+                        varm.append(vmod(vlast))
                         vstk = []
                         vlstk = []
                         vfix = 0
@@ -306,7 +359,13 @@ class TranslateConverter(PDFConverterEx):
                         and child.x0 > xt.x0                                # 3. 前一个字符在公式左侧
                     ):
                         vfix = child.y0 - xt.y0
-                    vstk.append(child)
+                    if vstk:
+                        vx0 = max(vx0, child.x0)
+                        vx1 = max(vx1, child.x1)
+                    else:
+                        vx0, vx1 = child.x0, child.x1
+                    vstk.append(FormulaChar(child.cid, self.fontid[child.font], child.x0, child.y0, child.size))
+                    vlast = child
                 # 更新段落边界，因为段落内换行之后可能是公式开头，所以要在外边处理
                 pstk[-1].x0 = min(pstk[-1].x0, child.x0)
                 pstk[-1].x1 = max(pstk[-1].x1, child.x1)
@@ -322,7 +381,7 @@ class TranslateConverter(PDFConverterEx):
                 # ltpage.height 可能是 fig 里面的高度，这里统一用 layout.shape
                 h, w = layout.shape
                 # 读取当前线条在 layout 中的类别
-                cx, cy = np.clip(int(child.x0), 0, w - 1), np.clip(int(child.y0), 0, h - 1)
+                cx, cy = min(max(int(child.x0), 0), w - 1), min(max(int(child.y0), 0), h - 1)
                 cls = layout[cy, cx]
                 if vstk and cls == xt_cls:      # 公式线条
                     vlstk.append(child)
@@ -336,43 +395,122 @@ class TranslateConverter(PDFConverterEx):
             var.append(vstk)
             varl.append(vlstk)
             varf.append(vfix)
-        log.debug("\n==========[VSTACK]==========\n")
-        for id, v in enumerate(var):  # 计算公式宽度
-            l = max([vch.x1 for vch in v]) - v[0].x0
-            log.debug(f'< {l:.1f} {v[0].x0:.1f} {v[0].y0:.1f} {v[0].cid} {v[0].fontname} {len(varl[id])} > v{id} = {"".join([ch.get_text() for ch in v])}')
-            vlen.append(l)
+            vlen.append(vx1 - vstk[0].x0)
+            varm.append(vmod(vlast))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("\n==========[VSTACK]==========\n")
+            for id, v in enumerate(var):
+                log.debug(f'< {vlen[id]:.1f} {v[0].x0:.1f} {v[0].y0:.1f} {v[0].cid} {v[0].font} {len(varl[id])} > v{id} = {[vch.cid for vch in v]}')
 
         ############################################################
         # B. 段落翻译
         log.debug("\n==========[SSTACK]==========\n")
 
-        @retry(wait=wait_fixed(1))
-        def worker(s: str):  # 多线程翻译
-            if not s.strip() or re.match(r"^\{v\d+\}$", s):  # 空白和公式不翻译
+        policy = self.retry_policy
+
+        def past_deadline(_=None) -> bool:
+            return self.deadline is not None and time.time() >= self.deadline
+
+        # 带抖动的指数退避，服务返回 Retry-After 时至少等待该时长（不超过 backoff_max）
+        backoff = wait_random_exponential(multiplier=policy.backoff, max=policy.backoff_max)
+
+        def wait(retry_state) -> float:
+            delay = retry_after(retry_state.outcome.exception())
+            return max(backoff(retry_state), min(delay, policy.backoff_max))
+
+        def no_retry_budget(_=None) -> bool:  # 重试只在这里发生，额度来自服务的限流器
+            return not self.translator.take_retry()
+
+        def untranslatable(s: str) -> bool:  # 空白和公式不翻译
+            return not s.strip() or re.match(r"^\{v\d+\}$", s) is not None
+
+        async def worker(s: str):  # 协程翻译，所有任务共用一个事件循环
+            if untranslatable(s):
                 return s
+            self.stats["paragraphs"] += 1
+            start = time.monotonic()
+
+            def attempt_timeout() -> float:  # 单次请求不超过段落和任务剩余的时间
+                remain = [policy.attempt_timeout, policy.paragraph_timeout - (time.monotonic() - start)]
+                if self.deadline is not None:
+                    remain.append(self.deadline - time.time())
+                return max(min(remain), 0.001)
+
             try:
-                new = self.translator.translate(s)
-                return new
-            except BaseException as e:
-                if log.isEnabledFor(logging.DEBUG):
-                    log.exception(e)
-                else:
-                    log.exception(e, exc_info=False)
-                raise e
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.thread
-        ) as executor:
-            news = list(executor.map(worker, sstk))
+                if past_deadline():
+                    raise TimeoutError("job deadline exceeded")
+                async for attempt in AsyncRetrying(
+                    # 最后才检查重试预算：只有确实要重试时才消耗服务的重试额度
+                    stop=stop_after_attempt(policy.attempts) | stop_after_delay(policy.paragraph_timeout) | past_deadline | no_retry_budget,
+                    wait=wait,
+                    reraise=True,
+                ):
+                    with attempt:
+                        timeout = attempt_timeout()
+                        try:
+                            try:
+                                return await asyncio.wait_for(self.translator.atranslate(s), timeout)
+                            except asyncio.TimeoutError:
+                                raise TimeoutError(f"no response in {timeout:.1f}s") from None
+                        except Exception as e:
+                            if log.isEnabledFor(logging.DEBUG):
+                                log.exception(e)
+                            else:
+                                log.exception(e, exc_info=False)
+                            raise
+            except Exception as e:  # 重试用尽，保留原文
+                self.stats["failed"] += 1
+                if len(self.stats["errors"]) < 10:
+                    self.stats["errors"].append(f"{type(e).__name__}: {e}")
+                log.warning(f"Paragraph left untranslated: {type(e).__name__}: {e}")
+                return s
+
+        async def translate_all():
+            limit = asyncio.Semaphore(max(self.thread, 1))  # 每页同时在途的请求数
+
+            async def limited(s: str):
+                async with limit:
+                    result = await worker(s)
+                if not untranslatable(s):
+                    self.stats["done"] += 1
+                    if self.progress is not None:
+                        self.progress(self.stats)
+                return result
+
+            jobs = asyncio.gather(*[limited(s) for s in sstk])
+            if self.cancellation_event is None:
+                return await jobs
+            while True:  # 线程事件无法 await，轮询检查取消
+                done, _ = await asyncio.wait({jobs}, timeout=0.1)
+                if done:
+                    return jobs.result()
+                if self.cancellation_event.is_set():
+                    jobs.cancel()  # 取消在途请求和还在排队的段落
+                    try:
+                        await jobs
+                    except asyncio.CancelledError:
+                        pass
+                    return None
+
+        if self.cancellation_event is not None and self.cancellation_event.is_set():
+            raise asyncio.CancelledError("task cancelled")
+        news = run_sync(translate_all())
+        if news is None:
+            raise asyncio.CancelledError("task cancelled")
 
         ############################################################
         # C. 新文档排版
-        def raw_string(fcur: str, cstk: str):  # 编码字符串
+        def raw_string(fcur: str, cstk: str) -> bytes:  # 编码字符串，整串一次转为十六进制
             if fcur == self.noto_name:
-                return "".join(["%04x" % self.noto.has_glyph(ord(c)) for c in cstk])
+                glyphs = get_coverage(self.noto).bulk(self.noto, cstk)
+                return hexlify(struct.pack(f">{len(cstk)}H", *[glyphs[c][2] for c in cstk]))
             elif isinstance(self.fontmap[fcur], PDFCIDFont):  # 判断编码长度
-                return "".join(["%04x" % ord(c) for c in cstk])
+                return hexlify(cstk.encode("utf-16-be", "surrogatepass"))
             else:
-                return "".join(["%02x" % ord(c) for c in cstk])
+                try:
+                    return hexlify(cstk.encode("latin-1"))
+                except UnicodeEncodeError:  # 单字节字体里不该出现，保持原来的逐字编码
+                    return "".join(["%02x" % ord(c) for c in cstk]).encode()
 
         # 根据目标语言获取默认行距
         LANG_LINEHEIGHT_MAP = {
@@ -381,13 +519,13 @@ class TranslateConverter(PDFConverterEx):
         }
         default_line_height = LANG_LINEHEIGHT_MAP.get(self.translator.lang_out.lower(), 1.1) # 小语种默认1.1
         _x, _y = 0, 0
-        ops_list = []
+        ops += b"BT "
 
         def gen_op_txt(font, size, x, y, rtxt):
-            return f"/{font} {size:f} Tf 1 0 0 1 {x:f} {y:f} Tm [<{rtxt}>] TJ "
+            ops.extend(b"/%s %f Tf 1 0 0 1 %f %f Tm [<%s>] TJ " % (font.encode(), size, x, y, rtxt))
 
         def gen_op_line(x, y, xlen, ylen, linewidth):
-            return f"ET q 1 0 0 1 {x:f} {y:f} cm [] 0 d 0 J {linewidth:f} w 0 0 m {xlen:f} {ylen:f} l S Q BT "
+            ops.extend(b"ET q 1 0 0 1 %f %f cm [] 0 d 0 J %f w 0 0 m %f %f l S Q BT " % (x, y, linewidth, xlen, ylen))
 
         for id, new in enumerate(news):
             x: float = pstk[id].x                       # 段落初始横坐标
@@ -401,148 +539,44 @@ class TranslateConverter(PDFConverterEx):
             size: float = original_size * self.font_size_factor  # Kích thước sau khi điều chỉnh
             
             brk: bool = pstk[id].brk                    # 段落换行标记
-            cstk: str = ""                              # 当前文字栈
             
             # Sử dụng font tùy chỉnh nếu có
             default_font = "tiro" if not self.font_name else self.font_name
-            fcur: str = default_font                    # Sử dụng font được chỉ định
             
-            lidx = 0                                    # 记录换行次数
-            tx = x
-            fcur_ = fcur
-            ptr = 0
             log.debug(f"< {y} {x} {x0} {x1} {size} {brk} > {sstk[id]} | {new}")
-
-            ops_vals: list[dict] = []
-
-            while ptr < len(new):
-                vy_regex = re.match(
-                    r"\{\s*v([\d\s]+)\}", new[ptr:], re.IGNORECASE
-                )  # 匹配 {vn} 公式标记
-                mod = 0  # 文字修饰符
-                if vy_regex:  # 加载公式
-                    ptr += len(vy_regex.group(0))
-                    try:
-                        vid = int(vy_regex.group(1).replace(" ", ""))
-                        adv = vlen[vid]
-                    except Exception:
-                        continue  # 翻译器可能会自动补个越界的公式标记
-                    if var[vid][-1].get_text() and unicodedata.category(var[vid][-1].get_text()[0]) in ["Lm", "Mn", "Sk"]:  # 文字修饰符
-                        mod = var[vid][-1].width
-                else:  # 加载文字
-                    ch = new[ptr]
-                    fcur_ = None
-                    try:
-                        if fcur_ is None and default_font != self.noto_name and self.fontmap.get(default_font) and self.fontmap[default_font].to_unichr(ord(ch)) == ch:
-                            fcur_ = default_font  # Ưu tiên sử dụng font tùy chỉnh
-                        elif fcur_ is None and self.fontmap.get("tiro") and self.fontmap["tiro"].to_unichr(ord(ch)) == ch:
-                            fcur_ = "tiro"  # 默认拉丁字体
-                    except Exception:
-                        pass
-                    if fcur_ is None:
-                        fcur_ = self.noto_name  # 默认非拉丁字体
-                    if fcur_ == self.noto_name: # FIXME: change to CONST
-                        adv = self.noto.char_lengths(ch, size)[0]
-                    else:
-                        adv = self.fontmap[fcur_].char_width(ord(ch)) * size
-                    ptr += 1
-                if (                                # 输出文字缓冲区
-                    fcur_ != fcur                   # 1. 字体更新
-                    or vy_regex                     # 2. 插入公式
-                    or x + adv > x1 + 0.1 * size    # 3. 到达右边界（可能一整行都被符号化，这里需要考虑浮点误差）
-                ):
-                    if cstk:
-                        ops_vals.append({
-                            "type": OpType.TEXT,
-                            "font": fcur,
-                            "size": size,
-                            "x": tx,
-                            "dy": 0,
-                            "rtxt": raw_string(fcur, cstk),
-                            "lidx": lidx
-                        })
-                        cstk = ""
-                if brk and x + adv > x1 + 0.1 * size:  # 到达右边界且原文段落存在换行
-                    x = x0
-                    lidx += 1
-                if vy_regex:  # 插入公式
-                    fix = 0
-                    if fcur is not None:  # 段落内公式修正纵向偏移
-                        fix = varf[vid]
-                    for vch in var[vid]:  # 排版公式字符
-                        vc = chr(vch.cid)
-                        # Áp dụng hệ số kích thước chữ cho công thức
-                        formula_size = vch.size * self.font_size_factor
-                        ops_vals.append({
-                            "type": OpType.TEXT,
-                            "font": self.fontid[vch.font],
-                            "size": formula_size,
-                            "x": x + vch.x0 - var[vid][0].x0,
-                            "dy": fix + vch.y0 - var[vid][0].y0,
-                            "rtxt": raw_string(self.fontid[vch.font], vc),
-                            "lidx": lidx
-                        })
-                        if log.isEnabledFor(logging.DEBUG):
-                            lstk.append(LTLine(0.1, (_x, _y), (x + vch.x0 - var[vid][0].x0, fix + y + vch.y0 - var[vid][0].y0)))
-                            _x, _y = x + vch.x0 - var[vid][0].x0, fix + y + vch.y0 - var[vid][0].y0
-                    for l in varl[vid]:  # 排版公式线条
-                        if l.linewidth < 5:  # hack 有的文档会用粗线条当图片背景
-                            ops_vals.append({
-                                "type": OpType.LINE,
-                                "x": l.pts[0][0] + x - var[vid][0].x0,
-                                "dy": l.pts[0][1] + fix - var[vid][0].y0,
-                                "linewidth": l.linewidth,
-                                "xlen": l.pts[1][0] - l.pts[0][0],
-                                "ylen": l.pts[1][1] - l.pts[0][1],
-                                "lidx": lidx
-                            })
-                else:  # 插入文字缓冲区
-                    if not cstk:  # 单行开头
-                        tx = x
-                        if x == x0 and ch == " ":  # 消除段落换行空格
-                            adv = 0
-                        else:
-                            cstk += ch
-                    else:
-                        cstk += ch
-                adv -= mod # 文字修饰符
-                fcur = fcur_
-                x += adv
-                if log.isEnabledFor(logging.DEBUG):
-                    lstk.append(LTLine(0.1, (_x, _y), (x, y)))
-                    _x, _y = x, y
-            # 处理结尾
-            if cstk:
-                ops_vals.append({
-                    "type": OpType.TEXT,
-                    "font": fcur,
-                    "size": size,
-                    "x": tx,
-                    "dy": 0,
-                    "rtxt": raw_string(fcur, cstk),
-                    "lidx": lidx
-                })
+            glyphs = self.select_fonts(new, default_font)  # 字符 -> (字体, 宽度, 编码)
+            tokens = tokenize(new, len(vlen))           # 文字段和公式编号
+            items, lines = break_lines(tokens, glyphs, vlen, varm, default_font, size, x, x0, x1, brk)
 
             # Điều chỉnh line_height dựa trên kích thước chữ
             line_height = default_line_height * (0.9 + 0.1 * self.font_size_factor)
-
-            while (lidx + 1) * size * line_height > height and line_height >= 1:
-                line_height -= 0.05
-
-            for vals in ops_vals:
-                if vals["type"] == OpType.TEXT:
-                    ops_list.append(gen_op_txt(vals["font"], vals["size"], vals["x"], vals["dy"] + y - vals["lidx"] * size * line_height, vals["rtxt"]))
-                elif vals["type"] == OpType.LINE:
-                    ops_list.append(gen_op_line(vals["x"], vals["dy"] + y - vals["lidx"] * size * line_height, vals["xlen"], vals["ylen"], vals["linewidth"]))
+            line_height = fit_line_height(line_height, lines, size, height)
+
+            for item in items:
+                shift = item.lidx * size * line_height
+                if type(item) is TextRun:
+                    gen_op_txt(item.font, size, item.x, y - shift, raw_string(item.font, item.text))
+                    if log.isEnabledFor(logging.DEBUG):
+                        lstk.append(LTLine(0.1, (_x, _y), (item.x, y)))
+                        _x, _y = item.x, y
+                    continue
+                vid, vx = item.vid, item.x
+                fix = varf[vid]  # 段落内公式修正纵向偏移
+                vx0, vy0 = var[vid][0].x0, var[vid][0].y0
+                for vch in var[vid]:  # 排版公式字符
+                    # Áp dụng hệ số kích thước chữ cho công thức
+                    formula_size = vch.size * self.font_size_factor
+                    gen_op_txt(vch.font, formula_size, vx + vch.x0 - vx0, fix + vch.y0 - vy0 + y - shift, raw_string(vch.font, chr(vch.cid)))
+                    if log.isEnabledFor(logging.DEBUG):
+                        lstk.append(LTLine(0.1, (_x, _y), (vx + vch.x0 - vx0, fix + y + vch.y0 - vy0)))
+                        _x, _y = vx + vch.x0 - vx0, fix + y + vch.y0 - vy0
+                for l in varl[vid]:  # 排版公式线条
+                    if l.linewidth < 5:  # hack 有的文档会用粗线条当图片背景
+                        gen_op_line(l.pts[0][0] + vx - vx0, l.pts[0][1] + fix - vy0 + y - shift, l.pts[1][0] - l.pts[0][0], l.pts[1][1] - l.pts[0][1], l.linewidth)
 
         for l in lstk:  # 排版全局线条
             if l.linewidth < 5:  # hack 有的文档会用粗线条当图片背景
-                ops_list.append(gen_op_line(l.pts[0][0], l.pts[0][1], l.pts[1][0] - l.pts[0][0], l.pts[1][1] - l.pts[0][1], l.linewidth))
-
-        ops = f"BT {''.join(ops_list)}ET "
-        return ops
-
+                gen_op_line(l.pts[0][0], l.pts[0][1], l.pts[1][0] - l.pts[0][0], l.pts[1][1] - l.pts[0][1], l.linewidth)
 
-class OpType(Enum):
-    TEXT = "text"
-    LINE = "line"
+        ops += b"ET "
+        return bytes(ops)
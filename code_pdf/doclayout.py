@@ -1,27 +1,31 @@
 import abc
 import os.path
+import threading
 
 import cv2
 import numpy as np
 import ast
 from babeldoc.assets.assets import get_doclayout_onnx_model_path
-
-try:
-    import onnx
-    import onnxruntime
-except ImportError as e:
-    if "DLL load failed" in str(e):
-        raise OSError(
-            "Microsoft Visual C++ Redistributable is not installed. "
-            "Download it at https://aka.ms/vs/17/release/vc_redist.x64.exe"
-        ) from e
-    raise
-
 from huggingface_hub import hf_hub_download
 
 from code_pdf.config import ConfigManager
 
 
+def import_onnx():
+    """Import onnx and onnxruntime when a model is created, importing onnxruntime writes to ~/.cache"""
+    try:
+        import onnx
+        import onnxruntime
+    except ImportError as e:
+        if "DLL load failed" in str(e):
+            raise OSError(
+                "Microsoft Visual C++ Redistributable is not installed. "
+                "Download it at https://aka.ms/vs/17/release/vc_redist.x64.exe"
+            ) from e
+        raise
+    return onnx, onnxruntime
+
+
 class DocLayoutModel(abc.ABC):
     @staticmethod
     def load_onnx():
@@ -72,6 +76,7 @@ class YoloBox:
 class OnnxModel(DocLayoutModel):
     def __init__(self, model_path: str):
         self.model_path = model_path
+        onnx, onnxruntime = import_onnx()
 
         model = onnx.load(model_path)
         metadata = {d.key: d.value for d in model.metadata_props}
@@ -80,6 +85,10 @@ class OnnxModel(DocLayoutModel):
 
         self.model = onnxruntime.InferenceSession(model.SerializeToString())
 
+    def __reduce__(self):
+        # InferenceSession không pickle được, tiến trình con tự nạp lại từ file
+        return OnnxModel, (self.model_path,)
+
     @staticmethod
     def from_pretrained():
         pth = get_doclayout_onnx_model_path()
@@ -174,201 +183,28 @@ class OnnxModel(DocLayoutModel):
         )
         return [YoloResult(boxes=preds, names=self._names)]
 
-    def extract_text_chunks(self, pdf_bytes):
+    def extract_text_chunks(self, pdf_bytes, pages=None):
         """
-        Extract text chunks with bounding boxes from a PDF document.
-        Each text chunk corresponds to a separate line of text.
-        
+        Extract text chunks with bounding boxes from a PDF document, see code_pdf.extract.
+        The layout model is not used; kept here for existing callers.
+
         Args:
             pdf_bytes: The PDF file data as bytes
-            
+            pages: 0-based page indices to extract, all pages when None
+
         Returns:
-            Dictionary containing text chunks with their bounding boxes for each page
-            Format: {
-                'pages': [
-                    {
-                        'page_number': 1,
-                        'width': 612,
-                        'height': 792,
-                        'chunks': [
-                            {'text': 'Line 1 text', 'box': [x, y, width, height]},
-                            {'text': 'Line 2 text', 'box': [x, y, width, height]},
-                            ...
-                        ]
-                    },
-                    ...
-                ]
-            }
+            {'pages': [{'page_number', 'width', 'height', 'chunks': [{'text', 'box'}]}]}
         """
+        import logging
+
+        from code_pdf.extract import extract_text
+
         try:
-            import io
-            import logging
-            import re
-            logger = logging.getLogger(__name__)
-            
-            try:
-                from pymupdf import Document
-            except ImportError:
-                try:
-                    import fitz
-                    Document = fitz.open
-                except ImportError:
-                    logger.error("Không thể import pymupdf hoặc fitz. Hãy cài đặt thư viện: pip install pymupdf")
-                    raise
-            
-            try:
-                from pdfminer.pdfparser import PDFParser
-                from pdfminer.pdfdocument import PDFDocument
-                from pdfminer.pdfpage import PDFPage
-                from pdfminer.pdfinterp import PDFResourceManager
-                from pdfminer.pdfinterp import PDFPageInterpreter
-                from pdfminer.layout import LAParams, LTTextBox, LTText, LTTextLine, LTChar
-                from pdfminer.converter import PDFPageAggregator
-            except ImportError:
-                logger.error("Không thể import pdfminer. Hãy cài đặt thư viện: pip install pdfminer.six")
-                raise
-                
-            import numpy as np
-            
-            # Store the results
-            result = {'pages': []}
-            
-            # Open PDF with PyMuPDF for page info and images
-            try:
-                doc_mupdf = Document(stream=pdf_bytes)
-            except Exception as e:
-                logger.error(f"Lỗi khi mở PDF với PyMuPDF: {e}")
-                return result
-            
-            # Open PDF with pdfminer for text extraction
-            pdf_io = io.BytesIO(pdf_bytes)
-            parser = PDFParser(pdf_io)
-            try:
-                doc = PDFDocument(parser)
-            except Exception as e:
-                logger.error(f"Lỗi khi phân tích PDF với pdfminer: {e}")
-                # Vẫn tạo các trang cơ bản mà không có text chunks
-                for i, page in enumerate(doc_mupdf):
-                    result['pages'].append({
-                        'page_number': i + 1,
-                        'width': page.rect.width,
-                        'height': page.rect.height,
-                        'chunks': []
-                    })
-                return result
-                
-            rsrcmgr = PDFResourceManager()
-            # Sử dụng LAParams với detect_vertical=True để xác định các dòng dọc và ngang
-            laparams = LAParams(line_margin=0.5, detect_vertical=True)
-            device = PDFPageAggregator(rsrcmgr, laparams=laparams)
-            interpreter = PDFPageInterpreter(rsrcmgr, device)
-            
-            # Process each page
-            for page_idx, page_mupdf in enumerate(doc_mupdf):
-                # Get the page dimensions from PyMuPDF
-                width, height = page_mupdf.rect.width, page_mupdf.rect.height
-                
-                # Create page entry
-                page_data = {
-                    'page_number': page_idx + 1,  # 1-based page numbering
-                    'width': width,
-                    'height': height,
-                    'chunks': []
-                }
-                
-                try:
-                    # Extract text chunks from the current page using pdfminer
-                    for i, page_miner in enumerate(PDFPage.create_pages(doc)):
-                        if i == page_idx:
-                            interpreter.process_page(page_miner)
-                            layout = device.get_result()
-                            
-                            # Process each element in the layout
-                            for lt_obj in layout:
-                                if isinstance(lt_obj, LTTextBox):
-                                    # Process text box (container of text lines)
-                                    for line in lt_obj:
-                                        if isinstance(line, LTTextLine):
-                                            # Extract line text
-                                            text = line.get_text().rstrip()
-                                            if not text:
-                                                continue
-                                                
-                                            # Convert pdfminer coordinates (origin at bottom left) to our format (origin at top left)
-                                            x0, y0, x1, y1 = line.bbox
-                                            # Transform y-coordinates (PDF coordinates start from bottom)
-                                            y0, y1 = height - y1, height - y0
-                                            
-                                            # Add the line as a chunk
-                                            page_data['chunks'].append({
-                                                'text': text,
-                                                'box': [int(x0), int(y0), int(x1 - x0), int(y1 - y0)]  # [x, y, width, height]
-                                            })
-                            break # Break after finding the correct page
-                
-                except Exception as e:
-                    logger.error(f"Lỗi khi trích xuất văn bản từ trang {page_idx + 1}: {e}")
-                    # Thử phương pháp dự phòng với PyMuPDF
-                    try:
-                        # Sử dụng PyMuPDF để trích xuất văn bản theo từng dòng
-                        text_page = page_mupdf.get_textpage()
-                        blocks = page_mupdf.get_text("dict")["blocks"]
-                        
-                        for block in blocks:
-                            if "lines" in block:
-                                for line in block["lines"]:
-                                    if "spans" in line:
-                                        line_text = ""
-                                        for span in line["spans"]:
-                                            line_text += span.get("text", "")
-                                        
-                                        if line_text.strip():
-                                            # Extract bounding box for the line
-                                            bbox = line.get("bbox", [0, 0, 0, 0])
-                                            x0, y0, x1, y1 = bbox
-                                            
-                                            page_data['chunks'].append({
-                                                'text': line_text.strip(),
-                                                'box': [int(x0), int(y0), int(x1 - x0), int(y1 - y0)]
-                                            })
-                    except Exception as e2:
-                        logger.error(f"Phương pháp dự phòng cũng gặp lỗi: {e2}")
-                
-                # Add page data to result
-                result['pages'].append(page_data)
-            
-            # Kiểm tra nếu không có chunks nào được tìm thấy
-            if not any(page.get('chunks') for page in result['pages']):
-                logger.warning("Không phát hiện được text chunks nào, thử phương pháp đơn giản hơn")
-                try:
-                    for page_idx, page in enumerate(doc_mupdf):
-                        text = page.get_text()
-                        if text.strip():
-                            # Phân tách thành từng dòng
-                            lines = text.splitlines()
-                            y_pos = 0
-                            line_height = page.rect.height / (len(lines) or 1)
-                            
-                            for line in lines:
-                                if line.strip():
-                                    # Tạo bounding box đơn giản cho từng dòng
-                                    page_data = result['pages'][page_idx]
-                                    page_data['chunks'].append({
-                                        'text': line.strip(),
-                                        'box': [0, y_pos, int(page.rect.width), int(line_height)]
-                                    })
-                                y_pos += line_height
-                except Exception as e:
-                    logger.error(f"Lỗi khi trích xuất text đơn giản: {e}")
-            
-            # Kiểm tra và sắp xếp lại các chunks theo thứ tự y (từ trên xuống dưới)
-            for page in result['pages']:
-                page['chunks'].sort(key=lambda chunk: chunk['box'][1])
-            
-            return result
-            
+            return extract_text(pdf_bytes, pages)
         except Exception as e:
-            logger.error(f"Lỗi không xác định trong extract_text_chunks: {e}")
+            logging.getLogger(__name__).error(
+                f"Lỗi không xác định trong extract_text_chunks: {e}"
+            )
             # Return minimal result structure
             return {
                 'pages': [{
@@ -381,4 +217,25 @@ class OnnxModel(DocLayoutModel):
 
 
 class ModelInstance:
+    """Shared layout model of the process, loaded on first use or by code_pdf.init"""
+
     value: OnnxModel = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls) -> OnnxModel:
+        if cls.value is None:
+            with cls._lock:
+                if cls.value is None:
+                    cls.value = OnnxModel.load_available()
+        return cls.value
+
+    @classmethod
+    def warmup(cls, imgsz: int = 1024) -> OnnxModel:
+        """
+        Run one blank page through the model so onnxruntime allocates its
+        buffers now instead of during the first request.
+        """
+        model = cls.get()
+        model.predict(np.full((imgsz, imgsz * 3 // 4, 3), 255, np.uint8), imgsz=imgsz)
+        return model
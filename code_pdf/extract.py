@@ -0,0 +1,319 @@
+import collections
+import concurrent.futures
+import io
+import itertools
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import pymupdf
+from pdfminer.converter import PDFPageAggregator
+from pdfminer.layout import LAParams, LTTextBox, LTTextLine
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ("pdfminer", "mupdf")
+
+# Text only: image blocks carry their pixels in the dict output and have no lines
+MUPDF_FLAGS = pymupdf.TEXTFLAGS_DICT & ~pymupdf.TEXT_PRESERVE_IMAGES
+
+
+def page_indices(page_count: int, pages: Optional[Iterable[int]] = None) -> List[int]:
+    """Sorted 0-based page indices to extract, all pages when pages is empty"""
+    if not pages:
+        return list(range(page_count))
+    return sorted({p for p in pages if 0 <= p < page_count})
+
+
+def empty_page(page: pymupdf.Page, index: int) -> Dict[str, Any]:
+    return {
+        "page_number": index + 1,  # 1-based page numbering
+        "width": page.rect.width,
+        "height": page.rect.height,
+        "chunks": [],
+    }
+
+
+def pdfminer_chunks(layout, height: float) -> List[Dict[str, Any]]:
+    """One chunk per text line of a pdfminer layout, with the origin moved to the top left"""
+    chunks = []
+    for lt_obj in layout:
+        if not isinstance(lt_obj, LTTextBox):
+            continue
+        for line in lt_obj:
+            if not isinstance(line, LTTextLine):
+                continue
+            text = line.get_text().rstrip()
+            if not text:
+                continue
+            x0, y0, x1, y1 = line.bbox
+            # PDF coordinates start from the bottom
+            y0, y1 = height - y1, height - y0
+            chunks.append(
+                {"text": text, "box": [int(x0), int(y0), int(x1 - x0), int(y1 - y0)]}
+            )
+    return chunks
+
+
+def mupdf_chunks(page: pymupdf.Page) -> List[Dict[str, Any]]:
+    """One chunk per text line from page.get_text("dict")"""
+    chunks = []
+    for block in page.get_text("dict", flags=MUPDF_FLAGS)["blocks"]:
+        for line in block.get("lines", ()):
+            text = "".join(span.get("text", "") for span in line.get("spans", ()))
+            if text.strip():
+                x0, y0, x1, y1 = line.get("bbox", [0, 0, 0, 0])
+                chunks.append(
+                    {
+                        "text": text.strip(),
+                        "box": [int(x0), int(y0), int(x1 - x0), int(y1 - y0)],
+                    }
+                )
+    return chunks
+
+
+def plain_chunks(page: pymupdf.Page) -> List[Dict[str, Any]]:
+    """Last resort: plain text lines with evenly spaced full-width boxes"""
+    chunks = []
+    text = page.get_text()
+    if not text.strip():
+        return chunks
+    lines = text.splitlines()
+    y_pos = 0
+    line_height = page.rect.height / (len(lines) or 1)
+    for line in lines:
+        if line.strip():
+            chunks.append(
+                {
+                    "text": line.strip(),
+                    "box": [0, y_pos, int(page.rect.width), int(line_height)],
+                }
+            )
+        y_pos += line_height
+    return chunks
+
+
+class PageCursor:
+    """Forward-only access to pdfminer pages by index, walking the page tree once"""
+
+    def __init__(self, pages: Iterator[PDFPage]):
+        self.pages = pages
+        self.index = -1
+        self.page = None
+        self.error = None
+
+    def seek(self, index: int) -> Optional[PDFPage]:
+        """Page at index (increasing between calls), None past the end of the page tree"""
+        if self.error is not None:
+            raise self.error
+        try:
+            while self.index < index:
+                self.page = next(self.pages, None)
+                self.index += 1
+        except Exception as e:
+            # The page tree cannot be walked further, every later page fails the same way
+            self.error = e
+            raise
+        return self.page
+
+
+def iter_pdfminer_pages(
+    pdf_bytes: bytes, pages: Optional[Iterable[int]] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield text chunks page by page, in one pass over the pdfminer and PyMuPDF pages.
+    Page sizes come from PyMuPDF; pages pdfminer fails on fall back to PyMuPDF text lines.
+
+    Args:
+        pdf_bytes: The PDF file data as bytes
+        pages: 0-based page indices to extract, all pages when None
+    """
+    try:
+        doc_mupdf = pymupdf.Document(stream=pdf_bytes)
+    except Exception as e:
+        logger.error(f"Lỗi khi mở PDF với PyMuPDF: {e}")
+        return
+    wanted = page_indices(doc_mupdf.page_count, pages)
+
+    try:
+        doc = PDFDocument(PDFParser(io.BytesIO(pdf_bytes)))
+    except Exception as e:
+        logger.error(f"Lỗi khi phân tích PDF với pdfminer: {e}")
+        # Vẫn tạo các trang cơ bản mà không có text chunks
+        for index in wanted:
+            yield empty_page(doc_mupdf[index], index)
+        return
+
+    rsrcmgr = PDFResourceManager()
+    # Sử dụng LAParams với detect_vertical=True để xác định các dòng dọc và ngang
+    laparams = LAParams(line_margin=0.5, detect_vertical=True)
+    device = PDFPageAggregator(rsrcmgr, laparams=laparams)
+    interpreter = PDFPageInterpreter(rsrcmgr, device)
+    cursor = PageCursor(PDFPage.create_pages(doc))
+
+    for index in wanted:
+        page_mupdf = doc_mupdf[index]
+        page_data = empty_page(page_mupdf, index)
+        try:
+            page_miner = cursor.seek(index)
+            if page_miner is not None:
+                interpreter.process_page(page_miner)
+                page_data["chunks"] = pdfminer_chunks(
+                    device.get_result(), page_data["height"]
+                )
+        except Exception as e:
+            logger.error(f"Lỗi khi trích xuất văn bản từ trang {index + 1}: {e}")
+            # Thử phương pháp dự phòng với PyMuPDF
+            try:
+                page_data["chunks"] = mupdf_chunks(page_mupdf)
+            except Exception as e2:
+                logger.error(f"Phương pháp dự phòng cũng gặp lỗi: {e2}")
+        # Sắp xếp các chunks theo thứ tự y (từ trên xuống dưới)
+        page_data["chunks"].sort(key=lambda chunk: chunk["box"][1])
+        yield page_data
+
+
+def iter_mupdf_pages(
+    pdf_bytes: bytes, pages: Optional[Iterable[int]] = None
+) -> Iterator[Dict[str, Any]]:
+    """Yield text chunks page by page using PyMuPDF only, same format as iter_pdfminer_pages"""
+    try:
+        doc = pymupdf.Document(stream=pdf_bytes)
+    except Exception as e:
+        logger.error(f"Lỗi khi mở PDF với PyMuPDF: {e}")
+        return
+    for index in page_indices(doc.page_count, pages):
+        page = doc[index]
+        page_data = empty_page(page, index)
+        try:
+            page_data["chunks"] = mupdf_chunks(page)
+        except Exception as e:
+            logger.error(f"Lỗi khi trích xuất văn bản từ trang {index + 1}: {e}")
+        page_data["chunks"].sort(key=lambda chunk: chunk["box"][1])
+        yield page_data
+
+
+_iterators = {"pdfminer": iter_pdfminer_pages, "mupdf": iter_mupdf_pages}
+
+# Server-side cap on extraction processes: the shared pool is created once at this
+# size (processes start on demand) and requested workers are clamped to it
+MAX_WORKERS = os.cpu_count() or 1
+
+_executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> concurrent.futures.ProcessPoolExecutor:
+    """Process pool shared by all extraction requests, never replaced while in use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: the caller may be a threaded server holding locks
+            _executor = concurrent.futures.ProcessPoolExecutor(
+                MAX_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def _extract_batch(path: str, engine: str, indices: List[int]) -> List[Dict[str, Any]]:
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+    return list(_iterators[engine](pdf_bytes, indices))
+
+
+def iter_pages(
+    pdf_bytes: bytes,
+    engine: str = "pdfminer",
+    pages: Optional[Iterable[int]] = None,
+    workers: int = 1,
+    batch_size: int = 16,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield text chunks page by page, in page order.
+
+    Args:
+        engine: "pdfminer" (line layout analysis) or "mupdf" (PyMuPDF text lines, much faster)
+        pages: 0-based page indices to extract, all pages when None
+        workers: with more than one (at most MAX_WORKERS), up to that many batches of
+            batch_size pages are extracted at once in a shared process pool; the
+            document is handed over as a temporary file
+    """
+    if engine not in _iterators:
+        raise ValueError(f"Unknown extraction engine {engine!r}, expected one of {ENGINES}")
+    workers = min(workers, MAX_WORKERS)
+    if workers > 1:
+        try:
+            page_count = pymupdf.Document(stream=pdf_bytes).page_count
+        except Exception:
+            page_count = 0  # the engine reports the error
+        wanted = page_indices(page_count, pages)
+        if len(wanted) > batch_size:
+            yield from _iter_pages_parallel(pdf_bytes, engine, wanted, workers, batch_size)
+            return
+    yield from _iterators[engine](pdf_bytes, pages)
+
+
+def _iter_pages_parallel(pdf_bytes, engine, wanted, workers, batch_size):
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf_bytes)
+        executor = get_executor()
+        batches = iter(range(0, len(wanted), batch_size))
+        futures = collections.deque()
+
+        def submit():
+            for i in itertools.islice(batches, workers - len(futures)):
+                futures.append(executor.submit(_extract_batch, path, engine, wanted[i : i + batch_size]))
+
+        try:
+            # At most `workers` batches of this request in the shared pool at a time
+            submit()
+            while futures:
+                pages = futures[0].result()
+                futures.popleft()
+                submit()
+                yield from pages
+        finally:
+            # Client gone or error: drop the batches that have not started
+            for future in futures:
+                future.cancel()
+            concurrent.futures.wait(futures)
+    finally:
+        os.remove(path)
+
+
+def extract_text(
+    pdf_bytes: bytes,
+    pages: Optional[Iterable[int]] = None,
+    engine: str = "pdfminer",
+    workers: int = 1,
+) -> Dict[str, Any]:
+    """
+    Extract text chunks with bounding boxes from a PDF document, see iter_pages.
+    Each text chunk corresponds to a separate line of text.
+
+    Returns:
+        {'pages': [{'page_number': 1, 'width': 612, 'height': 792,
+                    'chunks': [{'text': 'Line 1 text', 'box': [x, y, width, height]}, ...]},
+                   ...]}
+    """
+    result = {"pages": list(iter_pages(pdf_bytes, engine, pages, workers))}
+
+    # Kiểm tra nếu không có chunks nào được tìm thấy
+    if result["pages"] and not any(page["chunks"] for page in result["pages"]):
+        logger.warning("Không phát hiện được text chunks nào, thử phương pháp đơn giản hơn")
+        try:
+            doc = pymupdf.Document(stream=pdf_bytes)
+            for page_data in result["pages"]:
+                page_data["chunks"] = plain_chunks(doc[page_data["page_number"] - 1])
+        except Exception as e:
+            logger.error(f"Lỗi khi trích xuất text đơn giản: {e}")
+    return result
@@ -0,0 +1,88 @@
+import abc
+import hashlib
+import threading
+import weakref
+from typing import Dict, Iterable, Optional, Tuple
+
+from pdfminer.pdffont import PDFFont
+from pymupdf import Font
+
+# codepoint -> (hỗ trợ, độ rộng ở cỡ chữ 1, mã glyph dùng khi mã hoá)
+# hỗ trợ = None nghĩa là font ném ngoại lệ khi tra ký tự này
+GlyphInfo = Tuple[Optional[bool], float, int]
+
+
+class GlyphCoverage(abc.ABC):
+    """Bảng tra độ phủ glyph và độ rộng của một font, tính một lần cho mỗi ký tự
+
+    Bảng không giữ tham chiếu tới đối tượng font (font của pdfminer giữ cả
+    tài liệu), font được truyền vào mỗi lần tra.
+    """
+
+    def __init__(self) -> None:
+        self.glyphs: Dict[int, GlyphInfo] = {}
+
+    @abc.abstractmethod
+    def measure(self, font, cp: int) -> GlyphInfo:
+        """Tính thông tin glyph của ký tự cp"""
+
+    def lookup(self, font, ch: str) -> GlyphInfo:
+        cp = ord(ch)
+        info = self.glyphs.get(cp)
+        if info is None:
+            info = self.glyphs[cp] = self.measure(font, cp)
+        return info
+
+    def bulk(self, font, text: Iterable[str]) -> Dict[str, GlyphInfo]:
+        """Tra cả chuỗi, chỉ tính những ký tự chưa có trong bảng"""
+        glyphs = self.glyphs
+        result = {}
+        for ch in set(text):
+            cp = ord(ch)
+            info = glyphs.get(cp)
+            if info is None:
+                info = glyphs[cp] = self.measure(font, cp)
+            result[ch] = info
+        return result
+
+
+class PDFFontCoverage(GlyphCoverage):
+    """Font đã nhúng trong trang, đọc qua pdfminer"""
+
+    def measure(self, font: PDFFont, cp: int) -> GlyphInfo:
+        try:
+            supported = font.to_unichr(cp) == chr(cp)
+        except Exception:
+            supported = None
+        return supported, font.char_width(cp), cp
+
+
+class MupdfFontCoverage(GlyphCoverage):
+    """Font noto nạp bằng pymupdf, mã glyph là glyph id trong font"""
+
+    def measure(self, font: Font, cp: int) -> GlyphInfo:
+        return True, font.glyph_advance(cp), font.has_glyph(cp)
+
+
+# Font của pdfminer thuộc về một tài liệu: hai tài liệu có thể nhúng hai tập con khác
+# nhau dưới cùng tên tài nguyên và tên font, nên bảng tra sống theo đối tượng font.
+# Font noto nạp bằng pymupdf dùng chung bảng tra theo nội dung file font.
+_by_font: "weakref.WeakKeyDictionary[object, GlyphCoverage]" = weakref.WeakKeyDictionary()
+_by_content: Dict[str, GlyphCoverage] = {}
+_registry_lock = threading.Lock()
+
+
+def get_coverage(font) -> GlyphCoverage:
+    """Lấy bảng tra của font, tự bỏ khi font (và tài liệu chứa nó) được giải phóng"""
+    cov = _by_font.get(font)
+    if cov is None:
+        with _registry_lock:
+            cov = _by_font.get(font)
+            if cov is None:
+                if isinstance(font, Font):
+                    digest = hashlib.sha1(font.buffer).hexdigest()
+                    cov = _by_content.setdefault(digest, MupdfFontCoverage())
+                else:
+                    cov = PDFFontCoverage()
+                _by_font[font] = cov
+    return cov
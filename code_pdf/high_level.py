@@ -1,16 +1,22 @@
 """Functions that can be used for the most common use-cases for code_pdf.six"""
 
 import asyncio
-import io
+import concurrent.futures
+import math
+import mmap
+import multiprocessing
 import os
 import re
 import sys
 import tempfile
+import threading
+import time
 import logging
 from asyncio import CancelledError
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from string import Template
-from typing import Any, BinaryIO, List, Optional, Dict
+from typing import Any, BinaryIO, Callable, List, Optional, Dict, Union
 
 import numpy as np
 import requests
@@ -23,7 +29,8 @@ from pdfminer.pdfparser import PDFParser
 from pymupdf import Document, Font
 import pikepdf  # Add the missing pikepdf import
 
-from code_pdf.converter import TranslateConverter
+from code_pdf import ratelimit
+from code_pdf.converter import RetryPolicy, TranslateConverter
 from code_pdf.doclayout import OnnxModel
 from code_pdf.pdfinterp import PDFPageInterpreterEx
 
@@ -68,6 +75,147 @@ def check_files(files: List[str]) -> List[str]:
     return missing_files
 
 
+def predict_layout(model: OnnxModel, page) -> np.ndarray:
+    """Chạy mô hình bố cục trên ảnh của trang, trả về bản đồ vùng theo pixel"""
+    pix = page.get_pixmap()
+    image = np.fromstring(pix.samples, np.uint8).reshape(
+        pix.height, pix.width, 3
+    )[:, :, ::-1]
+    page_layout = model.predict(image, imgsz=int(pix.height / 32) * 32)[0]
+    # kdtree là không thể, tốt hơn là render thành hình ảnh, dùng không gian đổi lấy thời gian
+    box = np.ones((pix.height, pix.width))
+    h, w = box.shape
+    vcls = ["abandon", "figure", "table", "isolate_formula", "formula_caption"]
+    for i, d in enumerate(page_layout.boxes):
+        if page_layout.names[int(d.cls)] not in vcls:
+            x0, y0, x1, y1 = d.xyxy.squeeze()
+            x0, y0, x1, y1 = (
+                np.clip(int(x0 - 1), 0, w - 1),
+                np.clip(int(h - y1 - 1), 0, h - 1),
+                np.clip(int(x1 + 1), 0, w - 1),
+                np.clip(int(h - y0 + 1), 0, h - 1),
+            )
+            box[y0:y1, x0:x1] = i + 2
+    for i, d in enumerate(page_layout.boxes):
+        if page_layout.names[int(d.cls)] in vcls:
+            x0, y0, x1, y1 = d.xyxy.squeeze()
+            x0, y0, x1, y1 = (
+                np.clip(int(x0 - 1), 0, w - 1),
+                np.clip(int(h - y1 - 1), 0, h - 1),
+                np.clip(int(x1 + 1), 0, w - 1),
+                np.clip(int(h - y0 + 1), 0, h - 1),
+            )
+            box[y0:y1, x0:x1] = 0
+    return box
+
+
+def open_pdf(source) -> Document:
+    """Mở PDF từ đường dẫn, bytes hoặc đối tượng hỗ trợ buffer protocol (mmap, memoryview...)"""
+    if isinstance(source, (str, os.PathLike)):
+        return Document(os.fspath(source))  # MuPDF đọc file khi cần, không nạp cả file
+    if isinstance(source, (bytes, bytearray)):
+        return Document(stream=source)
+    return Document(stream=bytes(source))  # pymupdf chỉ nhận bytes/bytearray
+
+
+def map_file(path: str) -> mmap.mmap:
+    """Ánh xạ file chỉ đọc vào bộ nhớ, vẫn dùng được sau khi xoá file"""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def new_page_xref(doc_zh: Document, pageno: int) -> int:
+    """新建一个 xref 存放页面的新指令流"""
+    xref = doc_zh.get_new_xref()
+    doc_zh.update_object(xref, "<<>>")
+    doc_zh.update_stream(xref, b"")
+    doc_zh[pageno].set_contents(xref)
+    return xref
+
+
+class PartialResult:
+    """Các trang đã dịch xong của một job đang chạy, để tải trước từng trang
+
+    translate_stream ghi lại tài liệu gốc và tài liệu đích đã chuẩn bị font (trước khi
+    vá), mỗi trang dịch xong thêm phần obj_patch của trang đó. Khi cần, trang được dựng
+    lại trên một bản sao riêng, không đụng tới tài liệu mà luồng dịch đang sửa.
+    Hai tài liệu là file tạm do PartialResult giữ (own), MuPDF mở thẳng từ file nên không
+    có bản sao nào trong heap; close() xoá các file khi task kết thúc hoặc bị xoá.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.original = None
+        self.base = None
+        self.page_count = 0
+        self.subset_fonts = True
+        self.pages: Dict[int, tuple] = {}  # số trang (từ 0) -> (xref nội dung mới, obj_patch của trang)
+        self.files: List[str] = []
+        self.closed = False
+
+    def own(self, path: str):
+        """Nhận file tạm path, file bị xoá khi close() (ngay lập tức nếu đã close)"""
+        with self.lock:
+            if not self.closed:
+                self.files.append(path)
+                return
+        os.remove(path)
+
+    def start(self, original: str, base: str, page_count: int, subset_fonts: bool):
+        with self.lock:
+            self.original = original
+            self.base = base
+            self.page_count = page_count
+            self.subset_fonts = subset_fonts
+
+    def add(self, pageno: int, page_xref: int, patch: dict):
+        with self.lock:
+            self.pages[pageno] = (page_xref, patch)
+
+    def ready(self) -> List[int]:
+        with self.lock:
+            return sorted(self.pages)
+
+    def close(self):
+        with self.lock:
+            files, self.files = self.files, []
+            self.closed = True
+            self.pages.clear()
+        for path in files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def render(self, pagenos: List[int], dual: bool = False) -> bytes:
+        """PDF gồm các trang pagenos (đã dịch xong), dual thì mỗi trang gốc đi trước trang dịch"""
+        with self.lock:
+            if self.closed:
+                raise ValueError("partial result is closed")
+            pages = {p: self.pages[p] for p in pagenos}
+            # Mở trong khoá: close() không xoá được file giữa chừng
+            doc = Document(self.base)
+            doc_en = Document(self.original) if dual else None
+        for pageno in sorted(pages):
+            page_xref, patch = pages[pageno]
+            xref = new_page_xref(doc, pageno)  # xref của tài liệu đang dịch không dùng được ở bản sao
+            for obj_id, ops_new in patch.items():
+                doc.update_stream(xref if obj_id == page_xref else obj_id, ops_new)
+        doc.select(sorted(pages))
+        if self.subset_fonts:
+            try:
+                doc.subset_fonts(fallback=True)
+            except Exception as e:
+                logger.warning(f"Không thể tạo tập hợp con font: {str(e)}")
+        if dual:
+            doc_en.select(sorted(pages))
+            doc_en.insert_file(doc)
+            for i in range(len(pages)):
+                doc_en.move_page(len(pages) + i, i * 2 + 1)
+            doc = doc_en
+        return doc.write(deflate=True, garbage=3, use_objstms=1)
+
+
 def translate_patch(
     inf: BinaryIO,
     pages: Optional[list[int]] = None,
@@ -87,8 +235,17 @@ def translate_patch(
     prompt: Template = None,
     font_name: str = "",
     font_size_factor: float = 1.0,
+    retry_policy: RetryPolicy = None,
+    deadline: Optional[float] = None,
+    report: Dict = None,
+    on_progress: Callable[..., None] = None,
+    partial: PartialResult = None,
     **kwarg: Any,
 ) -> dict:
+    def notify(**fields):
+        if on_progress is not None:
+            on_progress(**fields)
+
     rsrcmgr = PDFResourceManager()
     layout = {}
     device = TranslateConverter(
@@ -106,6 +263,10 @@ def translate_patch(
         prompt,
         font_name,
         font_size_factor,
+        retry_policy,
+        deadline,
+        cancellation_event,
+        lambda stats: notify(paragraphs_done=stats["done"], paragraphs_failed=stats["failed"]),
     )
 
     assert device is not None
@@ -118,6 +279,8 @@ def translate_patch(
 
     parser = PDFParser(inf)
     doc = PDFDocument(parser)
+    pages_done = 0
+    notify(stage="translating", pages_done=0, pages_total=total_pages)
     with tqdm.tqdm(total=total_pages) as progress:
         for pageno, page in enumerate(PDFPage.create_pages(doc)):
             if cancellation_event and cancellation_event.is_set():
@@ -127,50 +290,225 @@ def translate_patch(
             progress.update()
             if callback:
                 callback(progress)
+            notify(page=pageno + 1)
             page.pageno = pageno
-            pix = doc_zh[page.pageno].get_pixmap()
-            image = np.fromstring(pix.samples, np.uint8).reshape(
-                pix.height, pix.width, 3
-            )[:, :, ::-1]
-            page_layout = model.predict(image, imgsz=int(pix.height / 32) * 32)[0]
-            # kdtree là không thể, tốt hơn là render thành hình ảnh, dùng không gian đổi lấy thời gian
-            box = np.ones((pix.height, pix.width))
-            h, w = box.shape
-            vcls = ["abandon", "figure", "table", "isolate_formula", "formula_caption"]
-            for i, d in enumerate(page_layout.boxes):
-                if page_layout.names[int(d.cls)] not in vcls:
-                    x0, y0, x1, y1 = d.xyxy.squeeze()
-                    x0, y0, x1, y1 = (
-                        np.clip(int(x0 - 1), 0, w - 1),
-                        np.clip(int(h - y1 - 1), 0, h - 1),
-                        np.clip(int(x1 + 1), 0, w - 1),
-                        np.clip(int(h - y0 + 1), 0, h - 1),
-                    )
-                    box[y0:y1, x0:x1] = i + 2
-            for i, d in enumerate(page_layout.boxes):
-                if page_layout.names[int(d.cls)] in vcls:
-                    x0, y0, x1, y1 = d.xyxy.squeeze()
-                    x0, y0, x1, y1 = (
-                        np.clip(int(x0 - 1), 0, w - 1),
-                        np.clip(int(h - y1 - 1), 0, h - 1),
-                        np.clip(int(x1 + 1), 0, w - 1),
-                        np.clip(int(h - y0 + 1), 0, h - 1),
-                    )
-                    box[y0:y1, x0:x1] = 0
-            layout[page.pageno] = box
-            # 新建一个 xref 存放新指令流
-            page.page_xref = doc_zh.get_new_xref()  # hack 插入页面的新 xref
-            doc_zh.update_object(page.page_xref, "<<>>")
-            doc_zh.update_stream(page.page_xref, b"")
-            doc_zh[page.pageno].set_contents(page.page_xref)
+            layout[page.pageno] = predict_layout(model, doc_zh[page.pageno])
+            if cancellation_event and cancellation_event.is_set():  # mô hình bố cục chạy lâu
+                raise CancelledError("task cancelled")
+            page.page_xref = new_page_xref(doc_zh, page.pageno)  # hack 插入页面的新 xref
+            # Mỗi trang ghi vào obj_patch riêng để có thể lấy trước trang đã xong
+            page_patch = interpreter.obj_patch = {}
             interpreter.process_page(page)
+            obj_patch.update(page_patch)
+            if partial is not None:
+                partial.add(pageno, page.page_xref, page_patch)
+            pages_done += 1
+            notify(pages_done=pages_done)
+
+    device.close()
+    merge_report(report, device.stats)
+    return obj_patch
+
+
+def merge_report(report: Optional[Dict], stats: Dict):
+    """Cộng dồn số đoạn đã dịch và bị giữ nguyên bản gốc vào report của người gọi"""
+    if report is None:
+        return
+    report["paragraphs"] = report.get("paragraphs", 0) + stats["paragraphs"]
+    report["failed"] = report.get("failed", 0) + stats["failed"]
+    errors = report.setdefault("errors", [])
+    errors.extend(stats["errors"][: max(0, 10 - len(errors))])
+
+
+# Trạng thái của mỗi tiến trình con khi dịch song song, nạp một lần trong initializer
+_shard: Dict[str, Any] = {}
 
+
+def _init_shard(
+    path: str,
+    noto_buffer: Optional[bytes],
+    model: OnnxModel,
+    options: dict,
+    share: float,
+    cancellation_event,
+    paragraphs_done,
+):
+    ratelimit.set_share(share)  # các tiến trình chia nhau hạn mức của dịch vụ
+    # Các tiến trình con dùng chung page cache của file thay vì mỗi tiến trình một bản bytes
+    parser = PDFParser(map_file(path))
+    _shard.update(
+        pages=list(PDFPage.create_pages(PDFDocument(parser))),
+        doc=Document(path),  # chỉ dùng để render ảnh cho mô hình bố cục
+        noto=Font(options["noto_name"], fontbuffer=noto_buffer) if noto_buffer else None,
+        model=model,
+        options=options,
+        cancellation_event=cancellation_event,
+        paragraphs_done=paragraphs_done,
+    )
+
+
+def _count_paragraph(_stats):
+    counter = _shard["paragraphs_done"]
+    with counter.get_lock():
+        counter.value += 1
+
+
+def _translate_shard(page_xrefs: Dict[int, int]) -> tuple:
+    """Dịch một nhóm trang trong tiến trình con, trả về obj_patch của từng trang
+    và thống kê số đoạn dịch lỗi"""
+    rsrcmgr = PDFResourceManager()
+    layout = {}
+    cancellation_event = _shard["cancellation_event"]
+    device = TranslateConverter(
+        rsrcmgr,
+        layout=layout,
+        noto=_shard["noto"],
+        cancellation_event=cancellation_event,
+        progress=_count_paragraph,
+        **_shard["options"],
+    )
+    patches = {}
+    interpreter = PDFPageInterpreterEx(rsrcmgr, device, {})
+    for pageno, page_xref in page_xrefs.items():
+        if cancellation_event.is_set():
+            raise CancelledError("task cancelled")
+        page = _shard["pages"][pageno]
+        page.pageno = pageno
+        page.page_xref = page_xref
+        layout[pageno] = predict_layout(_shard["model"], _shard["doc"][pageno])
+        patches[pageno] = interpreter.obj_patch = {}
+        interpreter.process_page(page)
     device.close()
+    return patches, device.stats
+
+
+def translate_patch_parallel(
+    inf: BinaryIO,
+    pages: Optional[list[int]] = None,
+    vfont: str = "",
+    vchar: str = "",
+    thread: int = 0,
+    doc_zh: Document = None,
+    lang_in: str = "",
+    lang_out: str = "",
+    service: str = "",
+    noto_name: str = "",
+    noto: Font = None,
+    callback: object = None,
+    cancellation_event: asyncio.Event = None,
+    model: OnnxModel = None,
+    envs: Dict = None,
+    prompt: Template = None,
+    font_name: str = "",
+    font_size_factor: float = 1.0,
+    processes: int = 2,
+    retry_policy: RetryPolicy = None,
+    deadline: Optional[float] = None,
+    report: Dict = None,
+    on_progress: Callable[..., None] = None,
+    partial: PartialResult = None,
+    base_path: str = "",
+    **kwarg: Any,
+) -> dict:
+    """Như translate_patch nhưng chia các trang cho nhiều tiến trình
+
+    Mỗi tiến trình tự phân tích PDF từ file base_path (nội dung giống inf) và trả
+    về obj_patch của các trang được giao, tiến trình cha cấp xref cho trang và gộp
+    kết quả theo thứ tự trang.
+    """
+    selected = [p for p in range(doc_zh.page_count) if not pages or p in pages]
+    page_xrefs = {pageno: new_page_xref(doc_zh, pageno) for pageno in selected}
+    processes = max(1, min(processes, len(selected)))
+    # Chia nhỏ hơn số tiến trình để cân tải và cập nhật tiến độ thường xuyên hơn
+    size = max(1, math.ceil(len(selected) / (processes * 4)))
+    shards = [selected[i : i + size] for i in range(0, len(selected), size)]
+
+    options = dict(
+        vfont=vfont,
+        vchar=vchar,
+        thread=thread,
+        lang_in=lang_in,
+        lang_out=lang_out,
+        service=service,
+        noto_name=noto_name,
+        envs=envs,
+        prompt=prompt,
+        font_name=font_name,
+        font_size_factor=font_size_factor,
+        retry_policy=retry_policy,
+        deadline=deadline,
+    )
+    context = multiprocessing.get_context("spawn")
+    # threading.Event không qua được tiến trình con, dùng Event của multiprocessing
+    shard_cancel = context.Event()
+    # Số đoạn đã dịch xong của mọi tiến trình con, để báo tiến độ theo đoạn
+    paragraphs_done = context.Value("i", 0)
+    executor = ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=context,
+        initializer=_init_shard,
+        initargs=(
+            base_path,
+            noto.buffer if noto else None,
+            model,
+            options,
+            1 / processes,
+            shard_cancel,
+            paragraphs_done,
+        ),
+    )
+    results = [None] * len(shards)
+    failed = 0
+    last = None
+    if on_progress is not None:
+        on_progress(stage="translating", pages_done=0, pages_total=len(selected))
+    try:
+        with tqdm.tqdm(total=len(selected)) as progress:
+            futures = {
+                executor.submit(_translate_shard, {p: page_xrefs[p] for p in shard}): i
+                for i, shard in enumerate(shards)
+            }
+            pending = set(futures)
+            while pending:
+                done, pending = concurrent.futures.wait(
+                    pending, timeout=0.2, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                if cancellation_event and cancellation_event.is_set():
+                    raise CancelledError("task cancelled")
+                for future in done:
+                    i = futures[future]
+                    results[i] = future.result()
+                    failed += results[i][1]["failed"]
+                    if partial is not None:
+                        for pageno, patch in results[i][0].items():
+                            partial.add(pageno, page_xrefs[pageno], patch)
+                    progress.update(len(shards[i]))
+                    if callback:
+                        callback(progress)
+                current = (progress.n, paragraphs_done.value, failed)
+                if on_progress is not None and current != last:
+                    last = current
+                    on_progress(
+                        pages_done=progress.n,
+                        paragraphs_done=paragraphs_done.value,
+                        paragraphs_failed=failed,
+                    )
+    finally:
+        # Lỗi ở một nhóm trang hay bị huỷ: các tiến trình con đang dịch cũng dừng lại,
+        # không tiếp tục gọi dịch vụ cho một job đã thất bại
+        shard_cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    obj_patch = {}
+    for patches, stats in results:  # trang sau ghi đè trang trước, giống khi chạy tuần tự
+        for patch in patches.values():
+            obj_patch.update(patch)
+        merge_report(report, stats)
     return obj_patch
 
 
 def translate_stream(
-    stream: bytes,
+    stream: Union[bytes, str, os.PathLike],
     pages: Optional[list[int]] = None,
     lang_in: str = "",
     lang_out: str = "",
@@ -186,8 +524,28 @@ def translate_stream(
     skip_subset_fonts: bool = False,
     font_name: str = "",
     font_size_factor: float = 1.0,
+    processes: int = 0,
+    retry_policy: RetryPolicy = None,
+    timeout: float = 0,
+    report: Dict = None,
+    on_progress: Callable[..., None] = None,
+    partial: PartialResult = None,
     **kwarg: Any,
 ):
+    """
+    stream: nội dung PDF (bytes, mmap, memoryview...) hoặc đường dẫn tới file PDF;
+    với đường dẫn, file được đọc dần khi cần thay vì nạp cả vào bộ nhớ.
+    timeout: thời hạn của cả job (giây, 0 là không giới hạn), quá hạn thì các
+    đoạn còn lại giữ nguyên bản gốc. report: dict nhận số đoạn đã dịch
+    ("paragraphs"), số đoạn giữ nguyên bản gốc ("failed") và vài lỗi mẫu ("errors").
+    on_progress: gọi với các trường thay đổi, ví dụ stage ("preparing", "translating",
+    "writing"), page, pages_done, pages_total, paragraphs_done, paragraphs_failed.
+    Có thể được gọi từ luồng event loop dùng chung, cần nhanh và an toàn luồng.
+    partial: PartialResult nhận từng trang ngay khi dịch xong.
+    """
+    if on_progress is not None:
+        on_progress(stage="preparing")
+    deadline = time.time() + timeout if timeout else None
     font_list = [("tiro", None)]
     noto = None  # Initialize noto variable
     noto_name = NOTO_NAME
@@ -230,10 +588,21 @@ def translate_stream(
         except Exception:
             logger.error("Không thể tải font dự phòng. Quá trình dịch có thể bị ảnh hưởng.")
 
-    doc_en = Document(stream=stream)
-    stream = io.BytesIO()
-    doc_en.save(stream)
-    doc_zh = Document(stream=stream)
+    doc_en = open_pdf(stream)
+    # Các bản trung gian được lưu ra file tạm rồi ánh xạ vào bộ nhớ: MuPDF và pdfminer
+    # đọc phần cần đến qua page cache, không giữ thêm bản sao của cả tài liệu trong heap.
+    # File được xoá ngay khi đã mở, tài liệu và mmap vẫn đọc được cho tới khi đóng;
+    # có partial thì partial giữ file để dựng trang và xoá khi task kết thúc.
+    fd, original_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        doc_en.save(original_path)
+        doc_zh = Document(original_path)
+    finally:
+        if partial is not None:
+            partial.own(original_path)
+        else:
+            os.remove(original_path)
     page_count = doc_zh.page_count
 
     # Thêm font vào từng trang
@@ -289,13 +658,28 @@ def translate_stream(
             except Exception as e:
                 logger.debug(f"Bỏ qua lỗi xref: {str(e)}")
 
-    fp = io.BytesIO()
-
-    doc_zh.save(fp)
-    obj_patch: dict = translate_patch(fp, **locals())
+    fd, base_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        doc_zh.save(base_path)
+        fp = map_file(base_path)
+        if partial is not None:
+            partial.start(original_path, base_path, page_count, not skip_subset_fonts)
+        if processes > 1:
+            # Các tiến trình con mở base_path nên file chỉ được xoá sau khi dịch xong
+            obj_patch: dict = translate_patch_parallel(fp, **locals())
+        else:
+            obj_patch: dict = translate_patch(fp, **locals())
+    finally:
+        if partial is not None:
+            partial.own(base_path)
+        else:
+            os.remove(base_path)
 
+    if on_progress is not None:
+        on_progress(stage="writing")
     for obj_id, ops_new in obj_patch.items():
-        doc_zh.update_stream(obj_id, ops_new.encode())
+        doc_zh.update_stream(obj_id, ops_new)
 
     doc_en.insert_file(doc_zh)
     for id in range(page_count):
@@ -379,6 +763,7 @@ def translate(
     envs: Dict = None,
     prompt: Template = None,
     skip_subset_fonts: bool = False,
+    processes: int = 0,
     **kwarg: Any,
 ):
     if not files:
@@ -424,19 +809,20 @@ def translate(
             ) as tmp_pdfa:
                 print(f"Converting {file} to PDF/A format...")
                 convert_to_pdfa(file, tmp_pdfa.name)
-                doc_raw = open(tmp_pdfa.name, "rb")
-                os.unlink(tmp_pdfa.name)
+                s_raw = tmp_pdfa.name
         else:
-            doc_raw = open(file, "rb")
-        s_raw = doc_raw.read()
-        doc_raw.close()
-
-        if file.startswith(tempfile.gettempdir()):
-            os.unlink(file)
-        s_mono, s_dual = translate_stream(
-            s_raw,
-            **locals(),
-        )
+            s_raw = file
+
+        # translate_stream đọc thẳng từ file, file tạm được xoá sau khi dịch
+        try:
+            s_mono, s_dual = translate_stream(
+                s_raw,
+                **locals(),
+            )
+        finally:
+            for path in {s_raw, file}:
+                if path.startswith(tempfile.gettempdir()):
+                    os.unlink(path)
         file_mono = Path(output) / f"{filename}-mono.pdf"
         file_dual = Path(output) / f"{filename}-dual.pdf"
         doc_mono = open(file_mono, "wb")
@@ -0,0 +1,139 @@
+import re
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Sequence, Tuple, Union
+
+from code_pdf.fontcache import GlyphInfo
+
+# {vn} 公式标记，翻译器可能会在中间插入空格或改成大写
+PLACEHOLDER = re.compile(r"\{\s*v([\d\s]+)\}", re.IGNORECASE)
+
+Token = Union[str, int]  # 文字段或公式编号
+
+
+class TextRun(NamedTuple):
+    font: str   # 字体在资源中的名字
+    x: float    # 起始横坐标
+    lidx: int   # 所在行
+    text: str
+
+
+class FormulaSlot(NamedTuple):
+    vid: int    # 公式编号
+    x: float    # 公式左边界的横坐标
+    lidx: int   # 所在行
+
+
+def tokenize(text: str, count: int) -> List[Token]:
+    """把译文切成文字段和公式编号，只扫描一遍
+
+    越界或无法解析的公式标记（翻译器可能会自动补一个）直接丢弃，
+    其前后的文字合并为同一段。
+    """
+    tokens: List[Token] = []
+    ptr = 0
+    for m in PLACEHOLDER.finditer(text):
+        try:
+            vid = int(m.group(1).replace(" ", ""))
+        except ValueError:
+            vid = -1
+        if m.start() > ptr:
+            run = text[ptr:m.start()]
+            if tokens and type(tokens[-1]) is str:
+                tokens[-1] += run
+            else:
+                tokens.append(run)
+        if 0 <= vid < count:
+            tokens.append(vid)
+        ptr = m.end()
+    if ptr < len(text):
+        if tokens and type(tokens[-1]) is str:
+            tokens[-1] += text[ptr:]
+        else:
+            tokens.append(text[ptr:])
+    return tokens
+
+
+def break_lines(
+    tokens: Sequence[Token],
+    glyphs: Dict[str, GlyphInfo],
+    widths: Sequence[float],
+    mods: Sequence[float],
+    font: str,
+    size: float,
+    x: float,
+    x0: float,
+    x1: float,
+    brk: bool,
+) -> Tuple[List[Union[TextRun, FormulaSlot]], int]:
+    """单遍断行，返回排好的文字段、公式位置和行数
+
+    glyphs 为 字符 -> (字体, 字号 1 时的宽度, 编码)，widths/mods 为公式宽度和
+    结尾修饰符宽度。只有原文段落存在换行（brk）时才会折行，否则沿用原来的
+    单行排版，超出右边界时仅切分文字段。
+    """
+    items: List[Union[TextRun, FormulaSlot]] = []
+    limit = x1 + 0.1 * size  # 可能一整行都被符号化，这里需要考虑浮点误差
+    lidx = 0
+    for token in tokens:
+        if type(token) is int:
+            adv = widths[token]
+            if brk and x + adv > limit:
+                x = x0
+                lidx += 1
+            items.append(FormulaSlot(token, x, lidx))
+            x += adv - mods[token]
+            continue
+        start = -1  # 当前文字段在 token 中的起点，-1 表示为空
+        tx = x
+        for i, ch in enumerate(token):
+            fnext, adv, _ = glyphs[ch]
+            adv *= size
+            over = x + adv > limit
+            if start >= 0 and (fnext != font or over):  # 字体更新或到达右边界
+                items.append(TextRun(font, tx, lidx, token[start:i]))
+                start = -1
+            if brk and over:
+                x = x0
+                lidx += 1
+            if start < 0:  # 单行开头
+                tx = x
+                if x == x0 and ch == " ":  # 消除段落换行空格
+                    adv = 0
+                else:
+                    start = i
+            font = fnext
+            x += adv
+        if start >= 0:
+            items.append(TextRun(font, tx, lidx, token[start:]))
+    return items, lidx + 1
+
+
+@lru_cache(maxsize=64)
+def line_height_steps(line_height: float) -> Tuple[float, ...]:
+    """行距按 0.05 递减的全部取值，直到第一个小于 1 的值（含）
+
+    逐次相减而不是 line_height - k * 0.05，保持和原来循环完全相同的浮点结果。
+    """
+    steps = [line_height]
+    while line_height >= 1:
+        line_height -= 0.05
+        steps.append(line_height)
+    return tuple(steps)
+
+
+def fit_line_height(line_height: float, lines: int, size: float, height: float) -> float:
+    """压缩行距直到 lines 行能放进段落高度，但不低于 1
+
+    等价于 while lines * size * line_height > height and line_height >= 1 的
+    逐步递减，候选值单调递减，二分查找第一个放得下的取值。
+    """
+    total = lines * size
+    steps = line_height_steps(line_height)
+    lo, hi = 0, len(steps) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if total * steps[mid] > height:
+            lo = mid + 1
+        else:
+            hi = mid
+    return steps[lo]
@@ -1,5 +1,5 @@
 import logging
-from typing import Any, Dict, Optional, Sequence, Tuple, cast
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, cast
 import numpy as np
 
 from pdfminer import settings
@@ -239,7 +239,7 @@ class PDFPageInterpreterEx(PDFPageInterpreter):
                 a, b, c, d = ctm_inv.reshape(4).tolist()
                 e, f = pos_inv.tolist()[0]
                 self.obj_patch[self.xobjmap[xobjid].objid] = (
-                    f"q {ops_base}Q {a} {b} {c} {d} {e} {f} cm {ops_new}"
+                    f"q {ops_base}Q {a} {b} {c} {d} {e} {f} cm ".encode() + ops_new
                 )
             except Exception:
                 pass
@@ -272,10 +272,10 @@ class PDFPageInterpreterEx(PDFPageInterpreter):
         ops_new = self.device.end_page(page)
         # Khi render ở trên, dùng cropbox để trừ đi độ lệch trang để có tọa độ thực; khi xuất ở đây, cần dùng cm để thêm độ lệch trang vào lại
         self.obj_patch[page.page_xref] = (
-            f"q {ops_base}Q 1 0 0 1 {x0} {y0} cm {ops_new}"  # ops_base có thể chứa hình, cần để văn bản ops_new hiển thị trên cùng, sử dụng q/Q để đặt lại ma trận vị trí
+            f"q {ops_base}Q 1 0 0 1 {x0} {y0} cm ".encode() + ops_new  # ops_base có thể chứa hình, cần để văn bản ops_new hiển thị trên cùng, sử dụng q/Q để đặt lại ma trận vị trí; ops_new đã là bytes
         )
         for obj in page.contents:
-            self.obj_patch[obj.objid] = ""
+            self.obj_patch[obj.objid] = b""
 
     def render_contents(
         self,
@@ -298,9 +298,29 @@ class PDFPageInterpreterEx(PDFPageInterpreter):
         self.init_state(ctm)
         return self.execute(list_value(streams))
 
+    @classmethod
+    def get_operator(cls, name: str) -> Optional[Tuple[Callable, int]]:
+        """Tra bảng điều phối toán tử -> (hàm do_*, số tham số), dựng dần một lần cho mỗi lớp"""
+        table = cls.__dict__.get("_operator_table")
+        if table is None:
+            table = {}
+            setattr(cls, "_operator_table", table)
+        try:
+            return table[name]
+        except KeyError:
+            pass
+        method = "do_%s" % name.replace("*", "_a").replace('"', "_w").replace(
+            "'",
+            "_q",
+        )
+        func = getattr(cls, method, None)
+        entry = (func, func.__code__.co_argcount - 1) if func else None
+        table[name] = entry
+        return entry
+
     def execute(self, streams: Sequence[object]) -> None:
         # Ghi đè để trả về luồng lệnh
-        ops = ""
+        ops: List[str] = []  # Ghi nối vào list rồi join một lần, tránh cộng chuỗi bậc hai
         try:
             parser = PDFContentParser(streams)
         except PSEOF:
@@ -313,18 +333,14 @@ class PDFPageInterpreterEx(PDFPageInterpreter):
                 break
             if isinstance(obj, PSKeyword):
                 name = keyword_name(obj)
-                method = "do_%s" % name.replace("*", "_a").replace('"', "_w").replace(
-                    "'",
-                    "_q",
-                )
-                if hasattr(self, method):
-                    func = getattr(self, method)
-                    nargs = func.__code__.co_argcount - 1
+                operator = self.get_operator(name)
+                if operator:
+                    func, nargs = operator
                     if nargs:
                         args = self.pop(nargs)
                         # log.debug("exec: %s %r", name, args)
                         if len(args) == nargs:
-                            func(*args)
+                            func(self, *args)
                             if not (
                                 name[0] == "T"
                                 or name in ['"', "'", "EI", "MP", "DP", "BMC", "BDC"]
@@ -339,10 +355,10 @@ class PDFPageInterpreterEx(PDFPageInterpreter):
                                         for x in args
                                     ]
                                 )
-                                ops += f"{p} {name} "
+                                ops.append(f"{p} {name} ")
                     else:
                         # log.debug("exec: %s", name)
-                        targs = func()
+                        targs = func(self)
                         if targs is None:
                             targs = []
                         if not (name[0] == "T" or name in ["BI", "ID", "EMC"]):
@@ -356,11 +372,11 @@ class PDFPageInterpreterEx(PDFPageInterpreter):
                                     for x in targs
                                 ]
                             )
-                            ops += f"{p} {name} "
+                            ops.append(f"{p} {name} ")
                 elif settings.STRICT:
                     error_msg = "Unknown operator: %r" % name
                     raise PDFInterpreterError(error_msg)
             else:
                 self.push(obj)
         # print('REV DATA',ops)
-        return ops
+        return "".join(ops)
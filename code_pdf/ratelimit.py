@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from code_pdf.config import ConfigManager
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+# Tỉ lệ hạn mức của tiến trình này khi nhiều tiến trình dùng chung một hạn mức
+# (ví dụ dịch song song theo trang), mỗi tiến trình chỉ dùng 1/N.
+_share = 1.0
+
+
+def set_share(share: float):
+    global _share
+    _share = share
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token của một yêu cầu: khoảng 4 ký tự một token, tính cả chiều vào và ra"""
+    return max(1, len(text) // 4) * 2
+
+
+def error_status(e: BaseException) -> Optional[int]:
+    """Mã HTTP của lỗi từ requests, httpx, openai, ollama..., không có thì trả về None"""
+    status = getattr(e, "status_code", None)
+    if status is None:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after(e: BaseException) -> float:
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def is_overload(status: Optional[int]) -> bool:
+    return status is not None and (status == 429 or status >= 500)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # số token nạp lại mỗi giây
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, cost: float) -> float:
+        """Số giây cần chờ để đủ cost token (không trừ)"""
+        cost = min(cost, self.capacity)  # yêu cầu lớn hơn cả thùng thì chờ thùng đầy
+        return 0.0 if self.tokens >= cost else (cost - self.tokens) / self.rate
+
+
+class ProviderLimiter:
+    """Giới hạn tốc độ và số yêu cầu đồng thời cho một dịch vụ + bộ thông tin xác thực
+
+    - rps: số yêu cầu mỗi giây, tpm: số token mỗi phút (None là không giới hạn)
+    - số yêu cầu đồng thời tự điều chỉnh theo AIMD: tăng dần khi thành công,
+      giảm một nửa khi gặp 429/5xx
+    - ngân sách thử lại (mỗi yêu cầu thành công nạp retry_ratio lượt, tối đa
+      retry_burst lượt): bộ giới hạn không tự thử lại, nơi thử lại (vòng thử lại
+      của converter) phải lấy lượt bằng take_retry trước mỗi lần thử lại
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rps: Optional[float] = None,
+        tpm: Optional[float] = None,
+        concurrency: int = 64,
+        min_concurrency: int = 1,
+        retry_ratio: float = 0.2,
+        retry_burst: float = 10,
+    ):
+        self.name = name
+        self.requests = TokenBucket(rps, max(1.0, rps)) if rps else None
+        self.tokens = TokenBucket(tpm / 60, tpm) if tpm else None
+        self.max_concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(concurrency)
+        self.inflight = 0
+        self.retry_ratio = retry_ratio
+        self.retry_burst = retry_burst
+        self.retry_budget = retry_burst
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0, "retries": 0}
+        self._lock = threading.Lock()
+        # Các yêu cầu đang chờ chỗ trống, mỗi yêu cầu là một future trên vòng lặp của nó:
+        # bộ giới hạn dùng chung giữa các vòng lặp nên được đánh thức qua call_soon_threadsafe
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def _notify(self):
+        """Đánh thức các yêu cầu đang chờ, tối đa bằng số chỗ trống (gọi khi giữ _lock)"""
+        free = int(self.concurrency) - self.inflight
+        while self._waiters and free > 0:
+            loop, waiter = self._waiters.pop(0)
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:  # vòng lặp đã đóng
+                continue
+            free -= 1
+
+    async def _wait_slot(self, waiter: asyncio.Future):
+        try:
+            await waiter
+        except BaseException:
+            with self._lock:
+                entry = (waiter.get_loop(), waiter)
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                elif self.inflight < int(self.concurrency):
+                    self._notify()  # đã được đánh thức nhưng bị huỷ: nhường lượt
+            raise
+
+    async def acquire(self, cost: int = 1):
+        while True:
+            waiter = None
+            with self._lock:
+                now = time.monotonic()
+                delay = 0.0
+                if self.inflight >= int(self.concurrency):
+                    waiter = asyncio.get_running_loop().create_future()
+                    self._waiters.append((waiter.get_loop(), waiter))
+                for bucket, need in ((self.requests, 1), (self.tokens, cost)):
+                    if bucket:
+                        bucket.refill(now)
+                        delay = max(delay, bucket.delay(need))
+                if waiter is None and delay == 0:
+                    if self.requests:
+                        self.requests.tokens -= 1
+                    if self.tokens:
+                        self.tokens.tokens -= min(cost, self.tokens.capacity)
+                    self.inflight += 1
+                    self.stats["requests"] += 1
+                    return
+            if waiter is not None:
+                await self._wait_slot(waiter)
+            else:
+                await asyncio.sleep(delay)
+
+    def release(self, status: Optional[int] = None, ok: bool = True):
+        with self._lock:
+            self.inflight -= 1
+            if ok:
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1 / self.concurrency
+                )
+                self.retry_budget = min(
+                    self.retry_burst, self.retry_budget + self.retry_ratio
+                )
+            else:
+                self.stats["errors"] += 1
+                if is_overload(status):
+                    self.stats["throttled"] += 1
+                    self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            if self.inflight < int(self.concurrency):
+                self._notify()
+
+    def abandon(self):
+        """Trả chỗ của yêu cầu bị huỷ giữa chừng (huỷ job, thua khi gửi song song...),
+        không tính là thành công hay lỗi của dịch vụ"""
+        with self._lock:
+            self.inflight -= 1
+            if self.inflight < int(self.concurrency):
+                self._notify()
+
+    def take_retry(self) -> bool:
+        with self._lock:
+            if self.retry_budget < 1:
+                return False
+            self.retry_budget -= 1
+            self.stats["retries"] += 1
+            return True
+
+    async def call(self, func: Callable[..., Awaitable[T]], *args, cost: int = 1) -> T:
+        """Gọi func một lần trong giới hạn, lỗi được ghi nhận rồi ném lại cho nơi gọi"""
+        await self.acquire(cost)
+        try:
+            result = await func(*args)
+        except Exception as e:
+            self.release(error_status(e), ok=False)
+            raise
+        except BaseException:
+            self.abandon()
+            raise
+        self.release()
+        return result
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "rps": self.requests.rate if self.requests else None,
+                "tpm": self.tokens.rate * 60 if self.tokens else None,
+                "concurrency": round(self.concurrency, 2),
+                "max_concurrency": self.max_concurrency,
+                "inflight": self.inflight,
+                "retry_budget": round(self.retry_budget, 2),
+                **self.stats,
+            }
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+# Các khoá được phép trong RATE_LIMITS của mỗi dịch vụ
+LIMIT_KEYS = ("rps", "tpm", "concurrency")
+_limiters_lock = threading.Lock()
+
+
+def limiter_config(service: str) -> dict:
+    """Đọc hạn mức của dịch vụ từ cấu hình RATE_LIMITS
+
+    Ví dụ: {"openai": {"rps": 5, "tpm": 90000, "concurrency": 16}}, có thể đặt
+    trong config.json hoặc biến môi trường (chuỗi JSON).
+    """
+    limits = ConfigManager.get("RATE_LIMITS")
+    if isinstance(limits, str):
+        try:
+            limits = json.loads(limits)
+        except ValueError:
+            logger.warning("RATE_LIMITS is not valid JSON, ignored")
+            limits = None
+    config = {}
+    for k, v in dict((limits or {}).get(service, {})).items():
+        if k in LIMIT_KEYS:
+            config[k] = v
+        else:
+            logger.warning(f"RATE_LIMITS[{service!r}]: unknown key {k!r} ignored, expected one of {LIMIT_KEYS}")
+    return config
+
+
+def get_limiter(service: str, credentials: Optional[dict] = None) -> ProviderLimiter:
+    """Bộ giới hạn dùng chung trong tiến trình cho dịch vụ và thông tin xác thực"""
+    digest = hashlib.sha256(
+        json.dumps(credentials or {}, sort_keys=True, default=str).encode()
+    ).hexdigest()[:12]
+    key = f"{service}:{digest}"
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                config = limiter_config(service)
+                for k in ("rps", "tpm"):
+                    if config.get(k):
+                        config[k] = float(config[k]) * _share
+                if config.get("concurrency"):
+                    config["concurrency"] = max(1, int(int(config["concurrency"]) * _share))
+                limiter = _limiters[key] = ProviderLimiter(key, **config)
+    return limiter
+
+
+def metrics() -> list:
+    return [limiter.snapshot() for limiter in list(_limiters.values())]
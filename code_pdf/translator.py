@@ -1,39 +1,65 @@
+import asyncio
 import html
+import importlib
 import json
 import logging
+import math
 import os
 import re
+import threading
+import time
 import unicodedata
+import weakref
+from collections import OrderedDict, deque
 from copy import copy
 from string import Template
 from typing import cast
 
 logger = logging.getLogger(__name__)
 
-try:
-    import argostranslate.package
-    import argostranslate.translate
-except ImportError:
-    logger.warning(
-        "argos-translate is not installed, if you want to use argostranslate, please install it. If you don't use argostranslate translator, you can safely ignore this warning."
-    )
-
-import deepl
-import ollama
-import openai
 import requests
-import xinference_client
-from azure.ai.translation.text import TextTranslationClient
-from azure.core.credentials import AzureKeyCredential
-from tencentcloud.common import credential
-from tencentcloud.tmt.v20180321.models import (
-    TextTranslateRequest,
-    TextTranslateResponse,
-)
-from tencentcloud.tmt.v20180321.tmt_client import TmtClient
 
+from code_pdf.aio import http_client, per_loop, run_in, run_sync
 from code_pdf.cache import TranslationCache
 from code_pdf.config import ConfigManager
+from code_pdf.ratelimit import estimate_tokens, get_limiter
+
+
+class LazyModule:
+    """
+    SDK của dịch vụ dịch, chỉ import khi dùng tới lần đầu.
+    Import translator (và mỗi tiến trình con) không phải trả giá cho mọi SDK,
+    chỉ dịch vụ thực sự được dùng mới nạp SDK của nó.
+    """
+
+    def __init__(self, name: str, service: str):
+        self._name = name
+        self._service = service
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            try:
+                self._module = importlib.import_module(self._name)
+            except ImportError as e:
+                raise ImportError(
+                    f"{self._name} is required by the {self._service} translator, please install it"
+                ) from e
+        return getattr(self._module, attr)
+
+
+# Bảng dịch vụ -> SDK, import khi khởi tạo translator tương ứng
+deepl = LazyModule("deepl", "deepl")
+ollama = LazyModule("ollama", "ollama")
+openai = LazyModule("openai", "openai")
+xinference_client = LazyModule("xinference_client", "xinference")
+azure_text = LazyModule("azure.ai.translation.text", "azure")
+azure_credentials = LazyModule("azure.core.credentials", "azure")
+tencent_credential = LazyModule("tencentcloud.common.credential", "tencent")
+tencent_models = LazyModule("tencentcloud.tmt.v20180321.models", "tencent")
+tencent_client = LazyModule("tencentcloud.tmt.v20180321.tmt_client", "tencent")
+argos_package = LazyModule("argostranslate.package", "argos")
+argos_translate = LazyModule("argostranslate.translate", "argos")
 
 
 def remove_control_characters(s):
@@ -62,24 +88,25 @@ class BaseTranslator:
                 "model": model,
             },
         )
+        # Giới hạn tốc độ dùng chung giữa các job có cùng dịch vụ và thông tin xác thực
+        self.limiter = get_limiter(self.name, self.envs)
 
     def set_envs(self, envs):
         # Tách khỏi self.__class__.envs
         # Không thể sử dụng self.envs = copy(self.__class__.envs)
         # bởi vì nếu set_envs được gọi hai lần, lần gọi thứ hai sẽ ghi đè lần gọi đầu tiên
         self.envs = copy(self.envs)
-        if ConfigManager.get_translator_by_name(self.name):
-            self.envs = ConfigManager.get_translator_by_name(self.name)
-        needUpdate = False
+        stored = ConfigManager.get_translator_by_name(self.name)
+        if stored:
+            self.envs = copy(stored)
         for key in self.envs:
             if key in os.environ:
                 self.envs[key] = os.environ[key]
-                needUpdate = True
-        if needUpdate:
-            ConfigManager.set_translator_by_name(self.name, self.envs)
         if envs is not None:
             for key in envs:
                 self.envs[key] = envs[key]
+        # Chỉ ghi config.json khi cấu hình thực sự thay đổi
+        if self.envs != stored:
             ConfigManager.set_translator_by_name(self.name, self.envs)
 
     def add_cache_impact_parameters(self, k: str, v):
@@ -93,18 +120,33 @@ class BaseTranslator:
     def translate(self, text: str, ignore_cache: bool = False) -> str:
         """
         Dịch văn bản, các phần khác nên gọi phương thức này.
+        Chỉ là lớp bọc đồng bộ, yêu cầu chạy trên event loop dùng chung.
+        :param text: văn bản cần dịch
+        :return: văn bản đã dịch
+        """
+        return run_sync(self.atranslate(text, ignore_cache))
+
+    async def atranslate(self, text: str, ignore_cache: bool = False) -> str:
+        """
+        Dịch văn bản bất đồng bộ, có dùng bộ nhớ đệm.
         :param text: văn bản cần dịch
         :return: văn bản đã dịch
         """
         if not (self.ignore_cache or ignore_cache):
-            cache = self.cache.get(text)
+            cache = await run_in("cache", self.cache.get, text)
             if cache is not None:
                 return cache
 
-        translation = self.do_translate(text)
-        self.cache.set(text, translation)
+        translation = await self.limiter.call(
+            self.ado_translate, text, cost=estimate_tokens(text)
+        )
+        await run_in("cache", self.cache.set, text, translation)
         return translation
 
+    def take_retry(self) -> bool:
+        """Lấy một lượt thử lại từ ngân sách thử lại của dịch vụ, hết lượt thì không thử lại"""
+        return self.limiter.take_retry()
+
     def do_translate(self, text: str) -> str:
         """
         Thực hiện dịch văn bản, ghi đè phương thức này
@@ -113,6 +155,16 @@ class BaseTranslator:
         """
         raise NotImplementedError
 
+    async def ado_translate(self, text: str) -> str:
+        """
+        Bản bất đồng bộ của do_translate. Mặc định chạy do_translate trong
+        pool luồng "blocking" dùng chung (BLOCKING_THREADS luồng), các dịch vụ có
+        client bất đồng bộ nên ghi đè phương thức này.
+        :param text: văn bản cần dịch
+        :return: văn bản đã dịch
+        """
+        return await run_in("blocking", self.do_translate, text)
+
     def prompt(
         self, text: str, prompt_template: Template | None = None
     ) -> list[dict[str, str]]:
@@ -174,6 +226,19 @@ class GoogleTranslator(BaseTranslator):
             params={"tl": self.lang_out, "sl": self.lang_in, "q": text},
             headers=self.headers,
         )
+        return self.parse_response(response)
+
+    async def ado_translate(self, text):
+        text = text[:5000]  # google translate max length
+        response = await http_client().get(
+            self.endpoint,
+            params={"tl": self.lang_out, "sl": self.lang_in, "q": text},
+            headers=self.headers,
+        )
+        return self.parse_response(response)
+
+    @staticmethod
+    def parse_response(response) -> str:
         re_result = re.findall(
             r'(?s)class="(?:t0|result-container)">(.*?)<', response.text
         )
@@ -189,6 +254,7 @@ class BingTranslator(BaseTranslator):
     # https://github.com/immersive-translate/old-immersive-translate/blob/6df13da22664bea2f51efe5db64c63aca59c4e79/src/background/translationService.js
     name = "bing"
     lang_map = {"zh": "zh-Hans"}
+    sid_ttl = 600  # giây, dùng khi trang không cho biết thời hạn token
 
     def __init__(self, lang_in, lang_out, model, **kwargs):
         super().__init__(lang_in, lang_out, model)
@@ -197,34 +263,112 @@ class BingTranslator(BaseTranslator):
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36 Edg/131.0.0.0",  # noqa: E501
         }
+        # (url, ig, iid, key, token) dùng chung giữa các luồng, chỉ lấy lại khi hết hạn
+        # hoặc khi bị từ chối xác thực
+        self.sid = None
+        self.sid_expires = 0.0
+        self.sid_lock = threading.Lock()
+        self.asid_locks = weakref.WeakKeyDictionary()
 
     def find_sid(self):
         response = self.session.get(self.endpoint)
         response.raise_for_status()
-        url = response.url[:-10]
-        ig = re.findall(r"\"ig\":\"(.*?)\"", response.text)[0]
-        iid = re.findall(r"data-iid=\"(.*?)\"", response.text)[-1]
-        key, token = re.findall(
-            r"params_AbusePreventionHelper\s=\s\[(.*?),\"(.*?)\",", response.text
+        return self.parse_sid(str(response.url), response.text)
+
+    async def afind_sid(self):
+        response = await http_client().get(self.endpoint, follow_redirects=True)
+        response.raise_for_status()
+        return self.parse_sid(str(response.url), response.text)
+
+    def parse_sid(self, url: str, text: str):
+        url = url[:-10]
+        ig = re.findall(r"\"ig\":\"(.*?)\"", text)[0]
+        iid = re.findall(r"data-iid=\"(.*?)\"", text)[-1]
+        key, token, expiry = re.findall(
+            r"params_AbusePreventionHelper\s=\s\[(.*?),\"(.*?)\",(\d*)", text
         )[0]
-        return url, ig, iid, key, token
+        # Thời hạn token tính bằng mili giây, lấy lại sớm hơn một chút cho chắc
+        ttl = int(expiry) / 1000 * 0.9 if expiry else self.sid_ttl
+        return (url, ig, iid, key, token), ttl
+
+    def store_sid(self, sid, ttl):
+        self.sid = sid
+        self.sid_expires = time.monotonic() + ttl
+
+    def sid_valid(self, stale) -> bool:
+        return (
+            self.sid is not None
+            and self.sid is not stale
+            and time.monotonic() < self.sid_expires
+        )
 
-    def do_translate(self, text):
-        text = text[:1000]  # bing translate max length
-        url, ig, iid, key, token = self.find_sid()
-        response = self.session.post(
-            f"{url}ttranslatev3?IG={ig}&IID={iid}",
-            data={
+    def get_sid(self, stale=None):
+        """Lấy token đang dùng, stale là token vừa bị từ chối và cần bỏ đi"""
+        if self.sid_valid(stale):
+            return self.sid
+        with self.sid_lock:  # chỉ một luồng đi lấy token mới, các luồng khác chờ
+            if not self.sid_valid(stale):
+                self.store_sid(*self.find_sid())
+            return self.sid
+
+    async def aget_sid(self, stale=None):
+        if self.sid_valid(stale):
+            return self.sid
+        async with per_loop(self.asid_locks, asyncio.Lock):
+            if not self.sid_valid(stale):
+                self.store_sid(*await self.afind_sid())
+            return self.sid
+
+    @staticmethod
+    def auth_failed(response) -> bool:
+        """Token hết hạn: HTTP 401/403 hoặc JSON dạng {"statusCode": ...} thay cho kết quả"""
+        if response.status_code in (401, 403):
+            return True
+        if response.status_code != 200:
+            return False
+        try:
+            return isinstance(response.json(), dict)
+        except ValueError:
+            return False
+
+    def parse_response(self, response):
+        response.raise_for_status()
+        result = response.json()
+        if isinstance(result, dict):  # token mới lấy vẫn bị từ chối
+            raise ValueError(f"Bing rejected the session token: {result}")
+        return result[0]["translations"][0]["text"]
+
+    def request(self, sid, text):
+        url, ig, iid, key, token = sid
+        return {
+            "url": f"{url}ttranslatev3?IG={ig}&IID={iid}",
+            "data": {
                 "fromLang": self.lang_in,
                 "to": self.lang_out,
                 "text": text,
                 "token": token,
                 "key": key,
             },
-            headers=self.headers,
-        )
-        response.raise_for_status()
-        return response.json()[0]["translations"][0]["text"]
+            "headers": self.headers,
+        }
+
+    def do_translate(self, text):
+        text = text[:1000]  # bing translate max length
+        sid = self.get_sid()
+        response = self.session.post(**self.request(sid, text))
+        if self.auth_failed(response):
+            sid = self.get_sid(stale=sid)
+            response = self.session.post(**self.request(sid, text))
+        return self.parse_response(response)
+
+    async def ado_translate(self, text):
+        text = text[:1000]  # bing translate max length
+        sid = await self.aget_sid()
+        response = await http_client().post(**self.request(sid, text))
+        if self.auth_failed(response):
+            sid = await self.aget_sid(stale=sid)
+            response = await http_client().post(**self.request(sid, text))
+        return self.parse_response(response)
 
 
 class DeepLTranslator(BaseTranslator):
@@ -278,6 +422,18 @@ class DeepLXTranslator(BaseTranslator):
         response.raise_for_status()
         return response.json()["data"]
 
+    async def ado_translate(self, text):
+        response = await http_client().post(
+            self.endpoint,
+            json={
+                "source_lang": self.lang_in,
+                "target_lang": self.lang_out,
+                "text": text,
+            },
+        )
+        response.raise_for_status()
+        return response.json()["data"]
+
 
 class OllamaTranslator(BaseTranslator):
     # https://github.com/ollama/ollama-python
@@ -305,17 +461,34 @@ class OllamaTranslator(BaseTranslator):
             "num_predict": 2000,
         }
         self.client = ollama.Client(host=self.envs["OLLAMA_HOST"])
+        self.aclients = weakref.WeakKeyDictionary()
         self.prompt_template = prompt
         self.add_cache_impact_parameters("temperature", self.options["temperature"])
 
-    def do_translate(self, text: str) -> str:
-        if (max_token := len(text) * 5) > self.options["num_predict"]:
-            self.options["num_predict"] = max_token
+    def request_options(self, text: str) -> dict:
+        # Không sửa self.options, instance được dùng chung giữa các luồng
+        options = dict(self.options)
+        if (max_token := len(text) * 5) > options["num_predict"]:
+            options["num_predict"] = max_token
+        return options
 
+    def do_translate(self, text: str) -> str:
         response = self.client.chat(
             model=self.model,
             messages=self.prompt(text, self.prompt_template),
-            options=self.options,
+            options=self.request_options(text),
+        )
+        content = self._remove_cot_content(response.message.content or "")
+        return content.strip()
+
+    async def ado_translate(self, text: str) -> str:
+        client = per_loop(
+            self.aclients, lambda: ollama.AsyncClient(host=self.envs["OLLAMA_HOST"])
+        )
+        response = await client.chat(
+            model=self.model,
+            messages=self.prompt(text, self.prompt_template),
+            options=self.request_options(text),
         )
         content = self._remove_cot_content(response.message.content or "")
         return content.strip()
@@ -338,6 +511,8 @@ class XinferenceTranslator(BaseTranslator):
         "XINFERENCE_MODEL": "gemma-2-it",
     }
     CustomPrompt = True
+    cooldown = 30  # 秒，连续失败时加倍
+    max_cooldown = 600
 
     def __init__(self, lang_in, lang_out, model, envs=None, prompt=None):
         self.set_envs(envs)
@@ -347,35 +522,85 @@ class XinferenceTranslator(BaseTranslator):
         self.options = {"temperature": 0}  # 随机采样可能会打断公式标记
         self.client = xinference_client.RESTfulClient(self.envs["XINFERENCE_HOST"])
         self.prompttext = prompt
+        # model 用 ; 分隔，按最近的成功率和延迟排序，失败的 model 暂停一段时间
+        self.models = [m for m in self.model.split(";") if m]
+        self.handles = {}
+        self.health = {
+            m: {"failures": 0, "latency": 0.0, "until": 0.0} for m in self.models
+        }
+        self.health_lock = threading.Lock()
         self.add_cache_impact_parameters("temperature", self.options["temperature"])
 
+    def ranked_models(self):
+        """按尝试顺序排列 model：先按连续失败次数，再按平均延迟，暂停中的排在最后"""
+        now = time.monotonic()
+        with self.health_lock:
+            ranked = sorted(
+                self.models,
+                key=lambda m: (
+                    self.health[m]["until"] > now,
+                    self.health[m]["failures"],
+                    self.health[m]["latency"],
+                ),
+            )
+            healthy = [m for m in ranked if self.health[m]["until"] <= now]
+        return healthy or ranked  # 全部都在暂停时仍然依次尝试
+
+    def record(self, model, latency=None):
+        """记录一次调用结果，latency 为 None 表示失败"""
+        with self.health_lock:
+            health = self.health[model]
+            if latency is None:
+                health["failures"] += 1
+                cooldown = min(
+                    self.cooldown * 2 ** (health["failures"] - 1), self.max_cooldown
+                )
+                health["until"] = time.monotonic() + cooldown
+                self.handles.pop(model, None)  # model 可能已经重启，下次重新获取
+            else:
+                health["failures"] = 0
+                health["until"] = 0.0
+                # 指数滑动平均，第一次测量直接取值
+                health["latency"] = (
+                    latency
+                    if not health["latency"]
+                    else 0.8 * health["latency"] + 0.2 * latency
+                )
+
+    def get_handle(self, model):
+        handle = self.handles.get(model)
+        if handle is None:
+            handle = self.handles[model] = self.client.get_model(model)
+        return handle
+
     def do_translate(self, text):
         maxlen = max(2000, len(text) * 5)
-        for model in self.model.split(";"):
+        xf_prompt = [
+            {
+                "role": "user",
+                "content": "\n".join(
+                    m["content"] for m in self.prompt(text, self.prompttext)
+                ),
+            }
+        ]
+        for model in self.ranked_models():
+            start = time.monotonic()
             try:
-                xf_model = self.client.get_model(model)
-                xf_prompt = self.prompt(text, self.prompttext)
-                xf_prompt = [
-                    {
-                        "role": "user",
-                        "content": xf_prompt[0]["content"]
-                        + "\n"
-                        + xf_prompt[1]["content"],
-                    }
-                ]
-                response = xf_model.chat(
+                response = self.get_handle(model).chat(
                     generate_config=self.options,
                     messages=xf_prompt,
                 )
-
                 response = response["choices"][0]["message"]["content"].replace(
                     "<end_of_turn>", ""
                 )
                 if len(response) > maxlen:
                     raise Exception("Response too long")
-                return response.strip()
             except Exception as e:
-                print(e)
+                self.record(model)
+                logger.warning(f"xinference model {model} failed: {e}")
+                continue
+            self.record(model, time.monotonic() - start)
+            return response.strip()
         raise Exception("All models failed")
 
 
@@ -408,6 +633,7 @@ class OpenAITranslator(BaseTranslator):
             base_url=base_url or self.envs["OPENAI_BASE_URL"],
             api_key=api_key or self.envs["OPENAI_API_KEY"],
         )
+        self.aclients = weakref.WeakKeyDictionary()
         self.prompttext = prompt
         self.add_cache_impact_parameters("temperature", self.options["temperature"])
         self.add_cache_impact_parameters("prompt", self.prompt("", self.prompttext))
@@ -421,6 +647,28 @@ class OpenAITranslator(BaseTranslator):
             **self.options,
             messages=self.prompt(text, self.prompttext),
         )
+        return self.parse_response(response)
+
+    async def ado_translate(self, text) -> str:
+        response = await self.async_client().chat.completions.create(
+            model=self.model,
+            **self.options,
+            messages=self.prompt(text, self.prompttext),
+        )
+        return self.parse_response(response)
+
+    def async_client(self) -> "openai.AsyncOpenAI":
+        """Client bất đồng bộ cùng cấu hình với self.client, dùng pool kết nối chung"""
+        return per_loop(
+            self.aclients,
+            lambda: openai.AsyncOpenAI(
+                base_url=self.client.base_url,
+                api_key=self.client.api_key,
+                http_client=http_client(),
+            ),
+        )
+
+    def parse_response(self, response) -> str:
         if not response.choices:
             if hasattr(response, "error"):
                 raise ValueError("Error response from Service", response.error)
@@ -530,6 +778,9 @@ class ZhipuTranslator(OpenAITranslator):
         self.prompttext = prompt
         self.add_cache_impact_parameters("prompt", self.prompt("", self.prompttext))
 
+    # do_translate riêng, chạy bản đồng bộ trong luồng
+    ado_translate = BaseTranslator.ado_translate
+
     def do_translate(self, text) -> str:
         try:
             response = self.client.chat.completions.create(
@@ -601,8 +852,8 @@ class AzureTranslator(BaseTranslator):
         super().__init__(lang_in, lang_out, model)
         endpoint = self.envs["AZURE_ENDPOINT"]
         api_key = self.envs["AZURE_API_KEY"]
-        credential = AzureKeyCredential(api_key)
-        self.client = TextTranslationClient(
+        credential = azure_credentials.AzureKeyCredential(api_key)
+        self.client = azure_text.TextTranslationClient(
             endpoint=endpoint, credential=credential, region="chinaeast2"
         )
         # https://github.com/Azure/azure-sdk-for-python/issues/9422
@@ -630,16 +881,16 @@ class TencentTranslator(BaseTranslator):
     def __init__(self, lang_in, lang_out, model, envs=None, **kwargs):
         self.set_envs(envs)
         super().__init__(lang_in, lang_out, model)
-        cred = credential.DefaultCredentialProvider().get_credential()
-        self.client = TmtClient(cred, "ap-beijing")
-        self.req = TextTranslateRequest()
-        self.req.Source = self.lang_in
-        self.req.Target = self.lang_out
-        self.req.ProjectId = 0
+        cred = tencent_credential.DefaultCredentialProvider().get_credential()
+        self.client = tencent_client.TmtClient(cred, "ap-beijing")
 
     def do_translate(self, text):
-        self.req.SourceText = text
-        resp: TextTranslateResponse = self.client.TextTranslate(self.req)
+        req = tencent_models.TextTranslateRequest()  # mỗi lần gọi một request riêng để dùng được từ nhiều luồng
+        req.Source = self.lang_in
+        req.Target = self.lang_out
+        req.ProjectId = 0
+        req.SourceText = text
+        resp = self.client.TextTranslate(req)
         return resp.TargetText
 
 
@@ -680,6 +931,23 @@ class AnythingLLMTranslator(BaseTranslator):
         if "textResponse" in data:
             return data["textResponse"].strip()
 
+    async def ado_translate(self, text):
+        messages = self.prompt(text, self.prompttext)
+        payload = {
+            "message": messages,
+            "mode": "chat",
+            "sessionId": "translation_expert",
+        }
+
+        response = await http_client().post(
+            self.api_url, headers=self.headers, content=json.dumps(payload)
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        if "textResponse" in data:
+            return data["textResponse"].strip()
+
 
 class DifyTranslator(BaseTranslator):
     name = "dify"
@@ -694,7 +962,7 @@ class DifyTranslator(BaseTranslator):
         self.api_url = self.envs["DIFY_API_URL"]
         self.api_key = self.envs["DIFY_API_KEY"]
 
-    def do_translate(self, text):
+    def request(self, text):
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
@@ -709,17 +977,26 @@ class DifyTranslator(BaseTranslator):
             "response_mode": "blocking",
             "user": "translator-service",
         }
+        return headers, json.dumps(payload)
 
+    def do_translate(self, text):
+        headers, payload = self.request(text)
         # 向 Dify 服务器发送请求
-        response = requests.post(
-            self.api_url, headers=headers, data=json.dumps(payload)
-        )
+        response = requests.post(self.api_url, headers=headers, data=payload)
         response.raise_for_status()
         response_data = response.json()
 
         # 解析响应
         return response_data.get("data", {}).get("outputs", {}).get("text", [])
 
+    async def ado_translate(self, text):
+        headers, payload = self.request(text)
+        response = await http_client().post(self.api_url, headers=headers, content=payload)
+        response.raise_for_status()
+        response_data = response.json()
+
+        return response_data.get("data", {}).get("outputs", {}).get("text", [])
+
 
 class ArgosTranslator(BaseTranslator):
     name = "argos"
@@ -730,8 +1007,8 @@ class ArgosTranslator(BaseTranslator):
         lang_out = self.lang_map.get(lang_out.lower(), lang_out)
         self.lang_in = lang_in
         self.lang_out = lang_out
-        argostranslate.package.update_package_index()
-        available_packages = argostranslate.package.get_available_packages()
+        argos_package.update_package_index()
+        available_packages = argos_package.get_available_packages()
         try:
             available_package = list(
                 filter(
@@ -745,11 +1022,11 @@ class ArgosTranslator(BaseTranslator):
                 "lang_in and lang_out pair not supported by Argos Translate."
             )
         download_path = available_package.download()
-        argostranslate.package.install_from_path(download_path)
+        argos_package.install_from_path(download_path)
 
     def translate(self, text: str, ignore_cache: bool = False):
         # Translate
-        installed_languages = argostranslate.translate.get_installed_languages()
+        installed_languages = argos_translate.get_installed_languages()
         from_lang = list(filter(lambda x: x.code == self.lang_in, installed_languages))[
             0
         ]
@@ -760,6 +1037,10 @@ class ArgosTranslator(BaseTranslator):
         translatedText = translation.translate(text)
         return translatedText
 
+    async def atranslate(self, text: str, ignore_cache: bool = False):
+        # Dịch cục bộ, không qua bộ nhớ đệm
+        return await run_in("blocking", self.translate, text, ignore_cache)
+
 
 class GorkTranslator(OpenAITranslator):
     # https://docs.x.ai/docs/overview#getting-started
@@ -891,6 +1172,9 @@ class QwenMtTranslator(OpenAITranslator):
 
         return langdict[input_lang]
 
+    # do_translate riêng, chạy bản đồng bộ trong luồng
+    ado_translate = BaseTranslator.ado_translate
+
     def do_translate(self, text) -> str:
         """
         Mô hình Qwen-MT yêu cầu gửi translation_options đến máy chủ.
@@ -908,3 +1192,254 @@ class QwenMtTranslator(OpenAITranslator):
             extra_body={"translation_options": translation_options},
         )
         return response.choices[0].message.content.strip()
+
+
+class ProviderStats:
+    """Thống kê của một dịch vụ trong chuỗi: độ trễ gần đây, số lần lỗi/quá hạn"""
+
+    def __init__(self, name: str, window: int = 200):
+        self.name = name
+        self.latencies: deque = deque(maxlen=window)  # chỉ tính lần thành công
+        self.counts = {"ok": 0, "errors": 0, "timeouts": 0, "cancelled": 0}
+        self.failures = 0  # số lần lỗi liên tiếp
+        self.until = 0.0  # tạm bỏ qua dịch vụ tới thời điểm này
+
+    def p95(self, default: float, min_samples: int = 20) -> float:
+        if len(self.latencies) < min_samples:
+            return default
+        ordered = sorted(self.latencies)
+        return ordered[math.ceil(len(ordered) * 0.95) - 1]
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.until
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.latencies)
+        return {
+            "name": self.name,
+            **self.counts,
+            "p50": round(ordered[len(ordered) // 2], 3) if ordered else None,
+            "p95": round(self.p95(0.0, 1), 3) if ordered else None,
+            "available": self.available(),
+        }
+
+
+class ChainTranslator(BaseTranslator):
+    """
+    Chuỗi nhiều dịch vụ dịch, mỗi dịch vụ giữ bộ nhớ đệm và thống kê riêng.
+    - "deepl>google": dự phòng, lỗi hoặc quá fallback_timeout thì chuyển dịch vụ sau
+    - "openai|deepseek": chạy song song có trễ, dịch vụ trước chưa xong sau p95 độ
+      trễ của nó thì gửi thêm yêu cầu tới dịch vụ sau, lấy kết quả về trước
+    """
+
+    name = "chain"
+    fallback_timeout = 30.0  # giây, dịch vụ cuối cùng không giới hạn
+    hedge_delay = 2.0  # giây, dùng khi chưa đủ mẫu để tính p95
+    max_failures = 3  # lỗi liên tiếp bao nhiêu lần thì tạm bỏ qua dịch vụ
+    cooldown = 60.0
+
+    def __init__(self, members: list[BaseTranslator], hedged: bool = False):
+        self.members = members
+        self.hedged = hedged
+        self.lang_in = members[0].lang_in
+        self.lang_out = members[0].lang_out
+        self.model = None
+        self.stats = {id(m): ProviderStats(self.label(m)) for m in members}
+
+    @staticmethod
+    def label(member: BaseTranslator) -> str:
+        return f"{member.name}:{member.model}" if member.model else member.name
+
+    def ordered(self) -> list[BaseTranslator]:
+        """Dịch vụ đang bị tạm bỏ qua xếp cuối, vẫn dùng khi các dịch vụ khác đều lỗi"""
+        return sorted(self.members, key=lambda m: not self.stats[id(m)].available())
+
+    async def timed(
+        self, member: BaseTranslator, text: str, ignore_cache: bool, timeout=None
+    ):
+        stats = self.stats[id(member)]
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(
+                member.atranslate(text, ignore_cache), timeout
+            )
+        except asyncio.CancelledError:
+            stats.counts["cancelled"] += 1
+            raise
+        except Exception as e:
+            kind = "timeouts" if isinstance(e, asyncio.TimeoutError) else "errors"
+            stats.counts[kind] += 1
+            stats.failures += 1
+            if stats.failures >= self.max_failures:
+                stats.until = time.monotonic() + self.cooldown
+            raise
+        stats.latencies.append(time.monotonic() - start)
+        stats.counts["ok"] += 1
+        stats.failures = 0
+        stats.until = 0.0
+        return result
+
+    def take_retry(self) -> bool:
+        # Thử lại cả chuỗi có thể gửi lại tới mọi dịch vụ, cần còn lượt ở tất cả
+        return all(member.take_retry() for member in self.members)
+
+    async def atranslate(self, text: str, ignore_cache: bool = False) -> str:
+        if self.hedged:
+            return await self.hedge(text, ignore_cache)
+        return await self.fallback(text, ignore_cache)
+
+    async def fallback(self, text: str, ignore_cache: bool) -> str:
+        members = self.ordered()
+        for i, member in enumerate(members):
+            last = i == len(members) - 1
+            try:
+                return await self.timed(
+                    member, text, ignore_cache, None if last else self.fallback_timeout
+                )
+            except Exception as e:
+                if last:
+                    raise
+                if isinstance(e, asyncio.TimeoutError):
+                    logger.warning(f"{self.label(member)} timed out, falling back")
+                else:
+                    logger.warning(f"{self.label(member)} failed, falling back: {e}")
+
+    async def hedge(self, text: str, ignore_cache: bool) -> str:
+        waiting = self.ordered()
+        pending: dict[asyncio.Task, BaseTranslator] = {}
+        error = None
+        try:
+            while True:
+                if waiting:
+                    member = waiting.pop(0)
+                    task = asyncio.ensure_future(self.timed(member, text, ignore_cache))
+                    pending[task] = member
+                    # Chờ theo p95 của dịch vụ vừa gửi, hết dịch vụ dự phòng thì chờ tới cùng
+                    delay = (
+                        self.stats[id(member)].p95(self.hedge_delay) if waiting else None
+                    )
+                elif not pending:
+                    raise error
+                else:
+                    delay = None
+                done, _ = await asyncio.wait(
+                    pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    member = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    logger.warning(f"{self.label(member)} failed: {error}")
+        finally:
+            for task in pending:  # yêu cầu thua cuộc bị huỷ, không ghi vào bộ nhớ đệm
+                task.cancel()
+
+    def snapshot(self) -> dict:
+        return {
+            "mode": "hedged" if self.hedged else "fallback",
+            "providers": [self.stats[id(m)].snapshot() for m in self.members],
+        }
+
+
+TRANSLATORS = [
+    GoogleTranslator,
+    BingTranslator,
+    DeepLTranslator,
+    DeepLXTranslator,
+    OllamaTranslator,
+    XinferenceTranslator,
+    AzureOpenAITranslator,
+    OpenAITranslator,
+    ZhipuTranslator,
+    ModelScopeTranslator,
+    SiliconTranslator,
+    GeminiTranslator,
+    AzureTranslator,
+    TencentTranslator,
+    DifyTranslator,
+    AnythingLLMTranslator,
+    ArgosTranslator,
+    GorkTranslator,
+    GroqTranslator,
+    DeepseekTranslator,
+    OpenAIlikedTranslator,
+    QwenMtTranslator,
+]
+
+MAX_CACHED_TRANSLATORS = 32
+_instances: "OrderedDict[tuple, BaseTranslator]" = OrderedDict()
+_instances_lock = threading.Lock()
+
+
+def translator_class(name: str) -> type[BaseTranslator]:
+    for cls in TRANSLATORS:
+        if cls.name == name:
+            return cls
+    raise ValueError("Unsupported translation service")
+
+
+def get_translator(
+    service: str,
+    lang_in: str,
+    lang_out: str,
+    envs: dict | None = None,
+    prompt: Template | None = None,
+) -> BaseTranslator:
+    """
+    Lấy translator đã cấu hình cho dịch vụ, dùng lại giữa các trang và các job.
+    :param service: tên dịch vụ, có thể kèm model, ví dụ "ollama:gemma2:9b",
+        hoặc chuỗi dịch vụ "deepl>google" (dự phòng), "openai|deepseek" (song song có trễ)
+    :return: instance dùng chung, client bên trong phải an toàn đa luồng
+    """
+    envs = envs or {}
+    config = (
+        lang_in,
+        lang_out,
+        json.dumps(envs, sort_keys=True, default=str),
+        prompt.template if prompt else None,
+    )
+    hedged = "|" in service
+    if hedged or ">" in service:
+        if hedged and ">" in service:
+            raise ValueError("Cannot mix '>' and '|' in a service chain")
+        key = ("chain", service, *config)
+    else:
+        # e.g. "ollama:gemma2:9b" -> ["ollama", "gemma2:9b"]
+        param = service.split(":", 1)
+        name = param[0]
+        model = param[1] if len(param) > 1 else None
+        key = (name, model, *config)
+    with _instances_lock:
+        translator = _instances.get(key)
+        if translator is not None:
+            _instances.move_to_end(key)
+            return translator
+
+    if key[0] == "chain":
+        # envs của cả chuỗi, mỗi dịch vụ chỉ nhận các khoá của mình
+        members = []
+        for part in re.split(r"[>|]", service):
+            part = part.strip()
+            keys = translator_class(part.split(":", 1)[0]).envs
+            member_envs = {k: v for k, v in envs.items() if k in keys}
+            members.append(get_translator(part, lang_in, lang_out, member_envs, prompt))
+        translator = ChainTranslator(members, hedged)
+    else:
+        cls = translator_class(name)
+        # Khởi tạo ngoài khoá, một số dịch vụ cần tải dữ liệu lúc khởi tạo
+        translator = cls(lang_in, lang_out, model, envs=envs, prompt=prompt)
+
+    with _instances_lock:
+        translator = _instances.setdefault(key, translator)
+        _instances.move_to_end(key)
+        while len(_instances) > MAX_CACHED_TRANSLATORS:
+            _instances.popitem(last=False)
+    return translator
+
+
+def chain_metrics() -> list:
+    """Thống kê theo dịch vụ của các chuỗi dịch vụ đang được dùng"""
+    with _instances_lock:
+        chains = [t for t in _instances.values() if isinstance(t, ChainTranslator)]
+    return [chain.snapshot() for chain in chains]
@@ -0,0 +1,24 @@
+# Cấu hình gunicorn: gunicorn -c gunicorn.conf.py app:app
+#
+# Tiến trình chính import app (preload, import không nạp mô hình hay mở file), mỗi
+# worker tự mở bộ nhớ đệm và nạp mô hình DocLayout sau khi fork: phiên onnxruntime
+# tạo trước khi fork giữ các luồng C++ không tồn tại trong worker.
+# Lưu ý: trạng thái task nằm trong bộ nhớ của từng worker, chạy nhiều worker thì
+# cần định tuyến các request của cùng một task về cùng một worker.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 7860)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+# Mỗi client theo dõi /translate/<id>/events (SSE hoặc ?wait) chiếm một luồng suốt kết nối,
+# app giới hạn ở threads / 2 client mỗi worker (đọc cùng biến GUNICORN_THREADS)
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+timeout = 120
+preload_app = True
+
+
+def post_fork(server, worker):
+    import app
+
+    app.init_app()
+    # Luồng không được sao chép khi fork, mỗi worker tự chạy luồng dọn dẹp
+    app.start_cleanup_thread()
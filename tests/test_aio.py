@@ -0,0 +1,30 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from code_pdf import aio
+
+
+def test_blocking_calls_run_in_their_own_pool():
+    async def main():
+        return await aio.run_in("blocking", lambda: threading.current_thread().name)
+
+    assert aio.run_sync(main()).startswith("code_pdf-blocking")
+
+
+def test_cache_io_is_not_queued_behind_blocking_calls(monkeypatch):
+    monkeypatch.setitem(aio._executors, "blocking", ThreadPoolExecutor(1))
+    release = threading.Event()
+
+    async def main():
+        stuck = asyncio.ensure_future(aio.run_in("blocking", release.wait, 5))
+        await asyncio.sleep(0.05)  # the only blocking thread is now taken
+        name = await asyncio.wait_for(
+            aio.run_in("cache", lambda: threading.current_thread().name), 1
+        )
+        release.set()
+        await stuck
+        return name
+
+    assert aio.run_sync(main()).startswith("code_pdf-cache")
+    aio._executors["blocking"].shutdown()
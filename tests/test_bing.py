@@ -0,0 +1,199 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from code_pdf.aio import run_sync
+from code_pdf.translator import BingTranslator
+
+
+class FakeBing:
+    """Local stand-in for www.bing.com/translator
+
+    GET serves the page with the session token, POST translates (reverses the text)
+    while the token is current. rotate() invalidates the token the way Bing does
+    when a session expires, rejected requests get reject_status or a JSON dict.
+    """
+
+    def __init__(self, expiry="3600000", reject_status=200):
+        self.expiry = expiry
+        self.reject_status = reject_status
+        self.token = 0
+        self.gets = 0
+        self.posts = 0
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body, ctype="application/json", status=200):
+                body = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with fake.lock:
+                    fake.gets += 1
+                    token = fake.token
+                self.reply(
+                    '<div data-iid="translator.5023"></div><script>var _G={"ig":"F00D"};'
+                    f'var params_AbusePreventionHelper = [1700000000000,"tok{token}",{fake.expiry}];'
+                    "</script>",
+                    "text/html",
+                )
+
+            def do_POST(self):
+                length = int(self.headers["Content-Length"])
+                form = parse_qs(self.rfile.read(length).decode())
+                with fake.lock:
+                    fake.posts += 1
+                    current = form["token"][0] == f"tok{fake.token}"
+                if not current:
+                    return self.reply('{"statusCode": 205}', status=fake.reject_status)
+                text = form["text"][0][::-1]
+                self.reply(json.dumps([{"translations": [{"text": text}]}]))
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        ).start()
+
+    def rotate(self):
+        with self.lock:
+            self.token += 1
+
+    def translator(self) -> BingTranslator:
+        translator = BingTranslator("en", "vi", None)
+        translator.endpoint = f"http://127.0.0.1:{self.server.server_port}/translator"
+        return translator
+
+
+@pytest.fixture
+def bing():
+    fake = FakeBing()
+    yield fake
+    fake.server.shutdown()
+    fake.server.server_close()
+
+
+def test_token_fetched_once_for_many_paragraphs(bing):
+    translator = bing.translator()
+    for i in range(5):
+        assert translator.do_translate(f"text {i}") == f"text {i}"[::-1]
+    assert bing.gets == 1
+    assert bing.posts == 5
+
+
+def test_token_ttl_from_page(bing):
+    translator = bing.translator()
+    translator.do_translate("a")
+    # 3600000 ms on the page, refreshed a little early
+    assert translator.sid_expires - time.monotonic() == pytest.approx(3240, abs=5)
+
+
+def test_token_ttl_default_without_expiry():
+    fake = FakeBing(expiry="")
+    try:
+        translator = fake.translator()
+        translator.do_translate("a")
+        remaining = translator.sid_expires - time.monotonic()
+        assert remaining == pytest.approx(BingTranslator.sid_ttl, abs=5)
+    finally:
+        fake.server.shutdown()
+        fake.server.server_close()
+
+
+def test_expired_token_is_fetched_again(bing):
+    translator = bing.translator()
+    translator.do_translate("a")
+    translator.sid_expires = time.monotonic() - 1
+    assert translator.do_translate("b") == "b"
+    assert bing.gets == 2
+    assert bing.posts == 2
+
+
+@pytest.mark.parametrize("reject_status", [200, 401, 403])
+def test_rejected_token_is_refreshed_once(reject_status):
+    fake = FakeBing(reject_status=reject_status)
+    try:
+        translator = fake.translator()
+        translator.do_translate("a")
+        fake.rotate()
+        assert translator.do_translate("hello") == "olleh"
+        assert fake.gets == 2
+        assert fake.posts == 3  # a, rejected hello, retried hello
+    finally:
+        fake.server.shutdown()
+        fake.server.server_close()
+
+
+def test_auth_failed():
+    class Response:
+        def __init__(self, status_code, body):
+            self.status_code = status_code
+            self.body = body
+
+        def json(self):
+            return json.loads(self.body)
+
+    assert BingTranslator.auth_failed(Response(401, ""))
+    assert BingTranslator.auth_failed(Response(200, '{"statusCode": 205}'))
+    assert not BingTranslator.auth_failed(Response(200, '[{"translations": []}]'))
+    assert not BingTranslator.auth_failed(Response(200, "<html>"))
+    assert not BingTranslator.auth_failed(Response(500, '{"statusCode": 500}'))
+
+
+def test_rejected_fresh_token_raises(bing):
+    translator = bing.translator()
+    find_sid = translator.find_sid
+
+    def stale_sid():
+        sid, ttl = find_sid()
+        return (*sid[:4], "stale"), ttl
+
+    translator.find_sid = stale_sid
+    with pytest.raises(ValueError, match="rejected"):
+        translator.do_translate("a")
+
+
+def test_threads_share_one_token_fetch(bing):
+    translator = bing.translator()
+    texts = [f"p{i}" for i in range(32)]
+    with ThreadPoolExecutor(8) as pool:
+        assert list(pool.map(translator.do_translate, texts)) == [t[::-1] for t in texts]
+    assert bing.gets == 1
+
+
+def test_async_tasks_share_one_token_fetch(bing):
+    translator = bing.translator()
+    texts = [f"p{i}" for i in range(32)]
+
+    async def main():
+        return await asyncio.gather(*map(translator.ado_translate, texts))
+
+    assert run_sync(main()) == [t[::-1] for t in texts]
+    assert bing.gets == 1
+
+
+def test_async_lock_is_per_event_loop(bing):
+    translator = bing.translator()
+
+    async def main():
+        # the shared loop and a private loop both refresh through their own lock
+        translator.sid_expires = 0
+        return await asyncio.gather(*map(translator.ado_translate, ["a", "b", "c"]))
+
+    assert run_sync(main()) == ["a", "b", "c"]
+    assert asyncio.run(main()) == ["a", "b", "c"]
+    assert bing.gets == 2
+    assert len(translator.asid_locks) >= 1
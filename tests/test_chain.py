@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from code_pdf.translator import ChainTranslator
+
+
+class Member:
+    """Translator stand-in: answers after delay, or raises error"""
+
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = name
+        self.model = None
+        self.lang_in = "en"
+        self.lang_out = "vi"
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    async def atranslate(self, text, ignore_cache=False):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return f"{self.name}:{text}"
+
+
+def chain(*members, hedged=False):
+    translator = ChainTranslator(list(members), hedged=hedged)
+    translator.fallback_timeout = 0.05
+    translator.hedge_delay = 0.05
+    return translator
+
+
+def run(translator, text="x"):
+    return asyncio.run(translator.atranslate(text))
+
+
+def test_fallback_uses_first_member_that_answers():
+    a, b = Member("a"), Member("b")
+    assert run(chain(a, b)) == "a:x"
+    assert (a.calls, b.calls) == (1, 0)
+
+
+def test_fallback_moves_on_after_error():
+    a, b, c = Member("a", error=RuntimeError("down")), Member("b"), Member("c")
+    translator = chain(a, b, c)
+    assert run(translator) == "b:x"
+    assert (a.calls, b.calls, c.calls) == (1, 1, 0)
+    assert translator.stats[id(a)].counts["errors"] == 1
+
+
+def test_fallback_moves_on_after_timeout():
+    a, b = Member("a", delay=1.0), Member("b")
+    translator = chain(a, b)
+    assert run(translator) == "b:x"
+    assert a.cancelled == 1
+    assert translator.stats[id(a)].counts["timeouts"] == 1
+
+
+def test_last_member_error_is_raised():
+    a, b = Member("a", error=RuntimeError("a down")), Member("b", error=ValueError("b down"))
+    with pytest.raises(ValueError, match="b down"):
+        run(chain(a, b))
+
+
+def test_last_member_timeout_is_raised():
+    # e.g. a socket timeout inside an SDK; the last member has no fallback timeout
+    a = Member("a", error=RuntimeError("a down"))
+    b = Member("b", error=TimeoutError("read timed out"))
+    with pytest.raises(TimeoutError, match="read timed out"):
+        run(chain(a, b))
+
+
+def test_failing_member_is_skipped_during_cooldown():
+    a, b = Member("a", error=RuntimeError("down")), Member("b")
+    translator = chain(a, b)
+    for _ in range(translator.max_failures):
+        assert run(translator) == "b:x"
+    calls = a.calls
+    assert translator.ordered() == [b, a]
+    assert run(translator) == "b:x"
+    assert a.calls == calls
+
+
+def test_hedge_takes_the_first_answer_and_cancels_the_rest():
+    a, b = Member("a", delay=1.0), Member("b")
+    assert run(chain(a, b, hedged=True)) == "b:x"
+    assert (a.calls, b.calls) == (1, 1)
+    assert a.cancelled == 1
+
+
+def test_hedge_raises_when_every_member_fails():
+    a = Member("a", error=RuntimeError("a down"))
+    b = Member("b", error=RuntimeError("b down"))
+    with pytest.raises(RuntimeError):
+        run(chain(a, b, hedged=True))
@@ -0,0 +1,128 @@
+import pytest
+
+from code_pdf.linelayout import (
+    FormulaSlot,
+    TextRun,
+    break_lines,
+    fit_line_height,
+    tokenize,
+)
+
+
+def glyphs_for(text, font="F1", width=1.0):
+    return {ch: (font, width, ord(ch)) for ch in text}
+
+
+def layout(tokens, glyphs, widths=(), mods=(), x1=50.0, brk=True):
+    # size 10, width 1 per char: 5 chars per line between x0=0 and x1=50
+    return break_lines(tokens, glyphs, widths, mods, "F1", 10.0, 0.0, 0.0, x1, brk)
+
+
+def lines_of(items):
+    lines = {}
+    for item in items:
+        if isinstance(item, TextRun):
+            lines[item.lidx] = lines.get(item.lidx, "") + item.text
+    return [lines[k] for k in sorted(lines)]
+
+
+def test_tokenize_splits_formulas():
+    assert tokenize("a {v0} b {v1}", 2) == ["a ", 0, " b ", 1]
+
+
+def test_tokenize_tolerates_translator_mangling():
+    assert tokenize("x{ V 1 }y", 2) == ["x", 1, "y"]
+
+
+def test_tokenize_drops_unknown_placeholders():
+    # out of range markers vanish and the text around them joins
+    assert tokenize("a{v5}b{v0}c", 2) == ["ab", 0, "c"]
+    # not a marker at all, kept as text
+    assert tokenize("a{vx}b", 2) == ["a{vx}b"]
+
+
+def test_tokenize_empty():
+    assert tokenize("", 0) == []
+
+
+def test_cjk_breaks_between_any_characters():
+    text = "汉字排版测试文本"
+    items, lines = layout([text], glyphs_for(text))
+    assert lines == 2
+    assert lines_of(items) == ["汉字排版测", "试文本"]
+    assert [run.x for run in items] == [0.0, 0.0]
+
+
+def test_space_separated_drops_leading_space_on_new_line():
+    text = "abcde fgh"
+    items, lines = layout([text], glyphs_for(text))
+    assert lines == 2
+    # the space that lands at the start of line 2 takes no room
+    assert lines_of(items) == ["abcde", "fgh"]
+    assert items[-1] == TextRun("F1", 0.0, 1, "fgh")
+
+
+def test_over_long_token_wraps_over_several_lines():
+    text = "x" * 12
+    items, lines = layout([text], glyphs_for(text))
+    assert lines == 3
+    assert lines_of(items) == ["xxxxx", "xxxxx", "xx"]
+
+
+def test_without_brk_stays_on_one_line():
+    text = "x" * 12
+    items, lines = layout([text], glyphs_for(text), brk=False)
+    assert lines == 1
+    # runs are still cut at the right edge but keep advancing on the same line
+    assert "".join(run.text for run in items) == text
+    assert {run.lidx for run in items} == {0}
+    assert items[-1].x > 50
+
+
+def test_font_change_starts_a_new_run():
+    glyphs = {**glyphs_for("ab"), **glyphs_for("中", font="noto")}
+    items, lines = layout(["a中b"], glyphs)
+    assert lines == 1
+    assert [(run.font, run.text, run.x) for run in items] == [
+        ("F1", "a", 0.0),
+        ("noto", "中", 10.0),
+        ("F1", "b", 20.0),
+    ]
+
+
+def test_formula_wraps_when_it_does_not_fit():
+    items, lines = layout(["abc", 0], glyphs_for("abc"), widths=[30.0], mods=[0.0])
+    assert lines == 2
+    assert items[-1] == FormulaSlot(0, 0.0, 1)
+
+
+def test_formula_modifier_width_is_not_advanced():
+    items, _ = layout([0, "a"], glyphs_for("a"), widths=[20.0], mods=[5.0])
+    assert items == [FormulaSlot(0, 0.0, 0), TextRun("F1", 15.0, 0, "a")]
+
+
+def naive_fit(line_height, lines, size, height):
+    while lines * size * line_height > height and line_height >= 1:
+        line_height -= 0.05
+    return line_height
+
+
+@pytest.mark.parametrize(
+    "line_height,lines,size,height",
+    [
+        (1.5, 1, 10, 100),   # fits, untouched
+        (1.5, 5, 10, 60),    # shrinks to 1.2
+        (1.5, 10, 10, 50),   # never fits, stops just below 1
+        (1.2, 3, 11.5, 37),
+        (2.0, 0, 10, 0),
+    ],
+)
+def test_fit_line_height_matches_shrink_loop(line_height, lines, size, height):
+    assert fit_line_height(line_height, lines, size, height) == naive_fit(
+        line_height, lines, size, height
+    )
+
+
+def test_fit_line_height_shrinks_until_it_fits():
+    assert fit_line_height(1.5, 5, 10, 60) == pytest.approx(1.2)
+    assert fit_line_height(1.5, 10, 10, 50) < 1
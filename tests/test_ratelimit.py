@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from code_pdf import ratelimit
+from code_pdf.ratelimit import ProviderLimiter
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_call_does_not_retry_on_its_own():
+    limiter = ProviderLimiter("test", concurrency=4)
+    calls = []
+
+    async def overloaded():
+        calls.append(1)
+        raise HTTPError(429)
+
+    with pytest.raises(HTTPError):
+        asyncio.run(limiter.call(overloaded))
+    assert len(calls) == 1
+    assert limiter.inflight == 0
+    assert limiter.concurrency == 2  # halved on 429
+    assert limiter.stats["throttled"] == 1
+    assert limiter.stats["retries"] == 0
+
+
+def test_cancelled_call_is_neutral():
+    limiter = ProviderLimiter("test", concurrency=4, retry_burst=2)
+    limiter.concurrency = 2.0
+    limiter.retry_budget = 0.0
+
+    async def main():
+        task = asyncio.ensure_future(limiter.call(asyncio.sleep, 10))
+        await asyncio.sleep(0.01)
+        assert limiter.inflight == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert limiter.inflight == 0
+    # neither additive increase nor a refilled retry budget
+    assert limiter.concurrency == 2.0
+    assert limiter.retry_budget == 0.0
+    assert limiter.stats["errors"] == 0
+
+
+def test_retry_budget_is_refilled_by_successes_only():
+    limiter = ProviderLimiter("test", retry_ratio=0.5, retry_burst=1)
+    assert limiter.take_retry()
+    assert not limiter.take_retry()
+
+    async def ok():
+        return "ok"
+
+    for _ in range(2):
+        assert asyncio.run(limiter.call(ok)) == "ok"
+    assert limiter.take_retry()
+    assert not limiter.take_retry()
+
+
+def test_waiter_is_woken_by_release_without_polling():
+    limiter = ProviderLimiter("test", concurrency=1, min_concurrency=1)
+    limiter.max_concurrency = 1
+
+    async def main():
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        assert len(limiter._waiters) == 1
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        limiter.release()
+        await waiting
+        assert loop.time() - start < 0.01
+        limiter.abandon()
+
+    asyncio.run(main())
+    assert limiter.inflight == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    limiter = ProviderLimiter("test", concurrency=1)
+
+    async def main():
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert limiter._waiters == []
+        limiter.abandon()
+
+    asyncio.run(main())
+    assert limiter.inflight == 0
+
+
+def test_unknown_rate_limit_keys_are_ignored(monkeypatch, caplog):
+    monkeypatch.setattr(
+        ratelimit.ConfigManager,
+        "get",
+        lambda key, default=None: {"svc": {"rpm": 60, "rps": 2}} if key == "RATE_LIMITS" else default,
+    )
+    with caplog.at_level("WARNING", logger=ratelimit.__name__):
+        config = ratelimit.limiter_config("svc")
+    assert config == {"rps": 2}
+    assert "'rpm'" in caplog.text